@@ -0,0 +1,104 @@
+"""Compares reading the speech table as ORM objects copied to dicts with the Core row modes.
+
+Run from the telegram directory against a database from DB_PATH:
+
+    python -m benchmarks.row_mode [number of speeches]
+
+Temporary speeches are added before measuring and deleted afterwards.
+"""
+import asyncio
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy.sql.expression import select, delete
+
+from core.database.create_table import SessionLocal, Speech, update_tables
+from core.database.repositories.speech import SpeechRepository
+
+BENCH_KEY_PREFIX = "bench-row-mode-"
+REPEATS = 50
+
+
+async def legacy_get_all(repository: SpeechRepository):
+    """get_all before the row modes: full ORM objects copied into dicts"""
+    return [
+        {
+            "key": speech.key,
+            "title": speech.title,
+            "start_time": speech.start_time,
+            "end_time": speech.end_time,
+            "venue": speech.venue,
+            "venue_description": speech.venue_description,
+        }
+        for speech in (await repository.session.execute(select(Speech))).scalars()
+    ]
+
+
+async def dict_get_all(repository: SpeechRepository):
+    return await repository.get_all()
+
+
+async def records_get_all(repository: SpeechRepository):
+    return await repository.get_all(as_records=True)
+
+
+async def measure(name, read, repository: SpeechRepository):
+    await read(repository)  # warm up connection and compiled statement cache
+
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        await read(repository)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    result = await read(repository)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name:<8} rows={len(result):<6} "
+        f"median={statistics.median(timings) * 1000:8.2f} ms  "
+        f"p95={sorted(timings)[int(REPEATS * 0.95) - 1] * 1000:8.2f} ms  "
+        f"peak={peak / 1024:9.1f} KiB  retained={retained / 1024:9.1f} KiB"
+    )
+
+
+async def main(speeches_number: int):
+    await update_tables()
+    session = SessionLocal()
+    repository = SpeechRepository(session)
+
+    start = datetime(2022, 3, 1, 9, 0)
+    await repository.add(
+        [
+            {
+                "key": f"{BENCH_KEY_PREFIX}{number}",
+                "title": f"Доклад номер {number}",
+                "start_time": start + timedelta(minutes=10 * number),
+                "end_time": start + timedelta(minutes=10 * number + 45),
+                "venue": f"Аудитория {number % 40}",
+                "venue_description": f"https://telegra.ph/bench-{number}",
+            }
+            for number in range(speeches_number)
+        ]
+    )
+
+    try:
+        for name, read in (
+            ("legacy", legacy_get_all),
+            ("dict", dict_get_all),
+            ("records", records_get_all),
+        ):
+            await measure(name, read, repository)
+    finally:
+        await session.execute(delete(Speech).where(Speech.key.startswith(BENCH_KEY_PREFIX)))
+        await session.commit()
+        await session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1500))
@@ -0,0 +1,65 @@
+"""Compares the per-call overhead of filter statements built on every call with prebuilt ones.
+
+No database connection is made, run from the telegram directory:
+
+    python -m benchmarks.statement_cache [number of calls]
+
+Every call does what Session.execute does before sending a statement to the database: the
+statement is built, its cache key is computed and the compiled form is looked up in the
+compiled cache. "uncached" compiles the statement on every call for comparison.
+"""
+import statistics
+import sys
+import time
+
+from sqlalchemy.dialects.postgresql.asyncpg import dialect as asyncpg_dialect
+from sqlalchemy.sql.expression import select
+
+from core.database.create_table import User
+from core.database.repositories.user import SELECT_STATEMENTS
+
+REPEATS = 20
+dialect = asyncpg_dialect()
+
+
+def rebuilt_statement(tg_chat_id: int):
+    """get_all before prebuilt statements: a new select with the filter value inside"""
+    query = select(User.uid, User.snp, User.phone, User.is_admin, User.tg_chat_id)
+    return query.where(User.tg_chat_id == tg_chat_id)
+
+
+def prebuilt_statement(tg_chat_id: int):
+    return SELECT_STATEMENTS.get(tg_chat_id=tg_chat_id)[0]
+
+
+def uncached(build, calls: int):
+    for tg_chat_id in range(calls):
+        build(tg_chat_id).compile(dialect=dialect)
+
+
+def cached(build, calls: int):
+    compiled_cache = {}
+    for tg_chat_id in range(calls):
+        statement = build(tg_chat_id)
+        key = statement._generate_cache_key().key
+        if key not in compiled_cache:
+            compiled_cache[key] = statement.compile(dialect=dialect)
+
+
+def measure(name, run, build, calls: int):
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        run(build, calls)
+        timings.append((time.perf_counter() - started) / calls)
+    print(f"{name:<9} per call median={statistics.median(timings) * 1e6:8.2f} us")
+
+
+def main(calls: int):
+    measure("uncached", uncached, rebuilt_statement, calls)
+    measure("rebuilt", cached, rebuilt_statement, calls)
+    measure("prebuilt", cached, prebuilt_statement, calls)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -11,6 +11,16 @@ def event_loop():
     return asyncio.get_event_loop()
 
 
+@pytest_asyncio.fixture
+async def session(event_loop):
+    """Session passed to handlers like the one DbSessionMiddleware injects"""
+    session = SessionLocal()
+
+    yield session
+
+    await session.close()
+
+
 @pytest_asyncio.fixture(scope="session")
 async def use_test_guest(event_loop):
     session = SessionLocal()
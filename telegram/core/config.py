@@ -14,6 +14,10 @@ class Settings(BaseSettings):
     JOB_STORE_HOST: str
     JOB_STORE_PORT: str
     TELEGRAPH_TOKEN: str
+    TELEGRAPH_CONCURRENCY: int = 8
+    TELEGRAPH_TIMEOUT: float = 10  # seconds
+    TELEGRAPH_RETRIES: int = 3
+    VALIDATION_WORKERS: int = 2  # processes validating rows of uploaded sheets
     SMTP_HOST: str
     SMTP_PORT: int
     SMTP_USER: str
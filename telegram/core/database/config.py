@@ -8,6 +8,18 @@ class Settings(BaseSettings):
 
     PROJECT_NAME: str = "Onlineedu"
     DB_PATH: Optional[str]
+    # optional read replica of DB_PATH, repository reads are sent there when it is set
+    DB_REPLICA_PATH: Optional[str] = None
+
+    # connection pool of the engine, connections above the pool size are closed when released
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30  # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 30 * 60  # seconds before a connection is replaced, -1 to keep
+    DB_POOL_PRE_PING: bool = True
+    # prepared statements cached per connection, set both to 0 behind pgbouncer
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 500
+    DB_STATEMENT_CACHE_SIZE: int = 500
 
     class Config:
         # env_prefix = 'ONLINEEDU_'
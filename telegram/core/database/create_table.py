@@ -1,9 +1,9 @@
 import asyncio
 
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio.engine import create_async_engine
-from sqlalchemy.sql.sqltypes import String, Boolean, BigInteger, DateTime
-from sqlalchemy.sql.schema import Column, ForeignKey, MetaData
+from sqlalchemy import text, func
+from sqlalchemy.ext.asyncio.engine import AsyncEngine, create_async_engine
+from sqlalchemy.sql.sqltypes import String, Boolean, BigInteger, DateTime, Integer
+from sqlalchemy.sql.schema import Column, ForeignKey, Index, MetaData, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio.session import AsyncSession
@@ -11,6 +11,9 @@ from sqlalchemy.ext.asyncio.session import AsyncSession
 from uuid import uuid4 as create_uuid
 
 from .config import settings
+from .migrations import run_migrations
+from .pool import MeasuredQueuePool
+from .routing import RoutingSession
 
 
 convention = {
@@ -24,14 +27,37 @@ convention = {
     "pk": "pk__%(table_name)s",
 }
 
-engine = create_async_engine(
-    settings.DB_PATH,
-    # connect_args={"check_same_thread": False},  # use this with SQLite
-    # echo=True,
-)
+
+def create_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        # connect_args={"check_same_thread": False},  # use this with SQLite
+        # echo=True,
+        poolclass=MeasuredQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            # statements prepared by SQLAlchemy and by asyncpg itself
+            "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+
+
+engine = create_engine(settings.DB_PATH)
+replica_engine = create_engine(settings.DB_REPLICA_PATH) if settings.DB_REPLICA_PATH else None
 
 SessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=engine, expire_on_commit=False, class_=AsyncSession
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
+    expire_on_commit=False,
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    replica_bind=replica_engine.sync_engine if replica_engine is not None else None,
 )
 
 meta = MetaData(naming_convention=convention)
@@ -53,7 +79,7 @@ class User(Base):
 
     uid = Column(String, primary_key=True, default=str(create_uuid))
     snp = Column(String, nullable=False)
-    phone = Column(String, nullable=False)
+    phone = Column(String, unique=True, nullable=False)
     is_admin = Column(Boolean, default=False, nullable=False)
     tg_chat_id = Column(BigInteger, unique=True, nullable=True)
 
@@ -71,10 +97,11 @@ class Speech(Base):
     """
 
     __tablename__ = "speech"
+    __table_args__ = (UniqueConstraint("title", "start_time"),)
 
     key = Column(String, primary_key=True, default=str(create_uuid))
     title = Column(String, nullable=False)
-    start_time = Column(DateTime, nullable=False)
+    start_time = Column(DateTime, nullable=False, index=True)
     end_time = Column(DateTime, nullable=False)
     venue = Column(String, nullable=False)
     venue_description = Column(String, nullable=False)
@@ -103,13 +130,23 @@ class UserSpeech(Base):
     """
 
     __tablename__ = "user_speech"
+    __table_args__ = (
+        UniqueConstraint("uid", "key"),
+        Index("ix__user_speech__key_role", "key", "role"),
+    )
 
     uid_key = Column(String, primary_key=True)
     uid = Column(
-        String, ForeignKey(User.uid, onupdate="cascade", ondelete="cascade"), nullable=False
+        String,
+        ForeignKey(User.uid, onupdate="cascade", ondelete="cascade"),
+        nullable=False,
+        index=True,
     )
     key = Column(
-        String, ForeignKey(Speech.key, onupdate="cascade", ondelete="cascade"), nullable=False
+        String,
+        ForeignKey(Speech.key, onupdate="cascade", ondelete="cascade"),
+        nullable=False,
+        index=True,
     )
     role = Column(
         String, ForeignKey(Role.value, onupdate="cascade", ondelete="cascade"), nullable=False
@@ -135,16 +172,48 @@ class Token(Base):
     vacant = Column(Boolean, default=True, nullable=False)
 
 
-# create tables
-async def update_tables(dev=False):
+class SchemaVersion(Base):
+    """Object in the schema_version table in db.
+
+    version – number of the applied migration
+    description – what the migration changes
+    applied_at – time of applying the migration
+
+    """
+
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+async def upgrade_schema(engine: AsyncEngine) -> int:
+    """Creates missing tables, seeds the default token and applies migrations.
+
+    Every step runs in its own transaction, so an existing token can not roll back the
+    created tables.
+
+    :param engine: engine connected to the database
+    :type engine: AsyncEngine
+
+    :return: version of the database after migrating
+    :rtype: int
+
+    """
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-        try:
-            await conn.execute(
-                text("insert into token values ('tok', true)")
-            )
-        except Exception:  # noqa
-            print('Token is there already')
+    async with engine.begin() as conn:
+        await conn.execute(text("insert into token values ('tok', true) on conflict do nothing"))
+
+    # create_all does not touch existing tables, their changes are applied by migrations
+    return await run_migrations(engine)
+
+
+# create tables
+async def update_tables(dev=False):
+    await upgrade_schema(engine)
 
     if dev:
         from tests.test_all import TestBase
@@ -0,0 +1,137 @@
+"""Versioned schema migrations applied at startup.
+
+create_all only creates missing tables, so every change to existing tables (constraints,
+indexes, new columns) is described here as a numbered migration. Applied versions are
+stored in the schema_version table; each migration runs in its own transaction, so a
+failed one leaves the database at the previous version. Migrations must be idempotent
+because on a fresh database create_all has already created everything the models declare.
+
+Before a unique index is created, rows that would violate it are either moved to a backup
+table, if they are plain duplicates, or reported by a check that stops the migration with a
+clear error, if the right row can not be chosen automatically.
+"""
+from typing import List, NamedTuple, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio.engine import AsyncEngine
+
+
+# any constant is fine, it only has to be the same for every replica of the bot
+MIGRATION_LOCK_ID = 20220301
+
+
+class MigrationError(Exception):
+    """The database holds rows that a migration can not be applied to"""
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: List[str]
+    # queries returning rows that block the migration and the error explaining them
+    checks: List[Tuple[str, str]] = []
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "unique phone of user and unique (uid, key) of user_speech",
+        [
+            'create unique index if not exists uq__user__phone on "user" (phone)',
+            # the same user registered to the same speech twice, the earliest row is kept and
+            # the others are moved to user_speech_duplicate to be reviewed by hand
+            "create table if not exists user_speech_duplicate (like user_speech)",
+            "insert into user_speech_duplicate select * from user_speech duplicate "
+            "where exists (select from user_speech kept where duplicate.uid = kept.uid "
+            "and duplicate.key = kept.key and duplicate.uid_key > kept.uid_key)",
+            "delete from user_speech duplicate using user_speech kept "
+            "where duplicate.uid = kept.uid and duplicate.key = kept.key "
+            "and duplicate.uid_key > kept.uid_key",
+            "create unique index if not exists uq__user_speech__uid_key on user_speech (uid, key)",
+        ],
+        checks=[
+            (
+                'select phone from "user" group by phone having count(*) > 1',
+                "Several users share phones {rows}, leave one user per phone and restart",
+            ),
+        ],
+    ),
+    Migration(
+        2,
+        "indexes for schedule and registration lookups",
+        [
+            "create index if not exists ix__user_speech__uid on user_speech (uid)",
+            "create index if not exists ix__user_speech__key on user_speech (key)",
+            "create index if not exists ix__user_speech__key_role on user_speech (key, role)",
+            "create index if not exists ix__speech__start_time on speech (start_time)",
+            "create unique index if not exists uq__speech__title_start_time "
+            "on speech (title, start_time)",
+        ],
+        checks=[
+            (
+                "select title, start_time from speech group by title, start_time "
+                "having count(*) > 1",
+                "Several speeches share title and start_time {rows}, "
+                "leave one speech of each and restart",
+            ),
+        ],
+    ),
+]
+
+
+async def get_version(engine: AsyncEngine) -> int:
+    """Returns the latest applied migration version, 0 for a database without migrations."""
+    async with engine.connect() as conn:
+        version = await conn.scalar(text("select coalesce(max(version), 0) from schema_version"))
+    return version
+
+
+async def run_migrations(engine: AsyncEngine, migrations: List[Migration] = MIGRATIONS) -> int:
+    """Applies all migrations newer than the current version of the database.
+
+    An advisory lock makes replicas starting at the same time apply migrations one by one.
+
+    :param engine: engine connected to the database
+    :type engine: AsyncEngine
+
+    :param migrations: migrations sorted by version
+    :type migrations: List[Migration]
+
+    :return: version of the database after migrating
+    :rtype: int
+
+    """
+
+    async with engine.connect() as lock_conn:
+        await lock_conn.execute(text(f"select pg_advisory_lock({MIGRATION_LOCK_ID})"))
+        try:
+            version = await get_version(engine)
+            for migration in migrations:
+                if migration.version <= version:
+                    continue
+                logger.info(f"Applying migration {migration.version}: {migration.description}")
+                async with engine.begin() as conn:
+                    for query, message in migration.checks:
+                        rows = (await conn.execute(text(query))).all()
+                        if rows:
+                            raise MigrationError(
+                                f"Migration {migration.version} is not applied. "
+                                + message.format(rows=[tuple(row) for row in rows])
+                            )
+                    for statement in migration.statements:
+                        await conn.execute(text(statement))
+                    await conn.execute(
+                        text(
+                            "insert into schema_version (version, description) "
+                            "values (:version, :description)"
+                        ),
+                        {"version": migration.version, "description": migration.description},
+                    )
+                version = migration.version
+        finally:
+            await lock_conn.execute(text(f"select pg_advisory_unlock({MIGRATION_LOCK_ID})"))
+            await lock_conn.commit()
+
+    logger.info(f"Database schema version {version}")
+    return version
@@ -0,0 +1,91 @@
+"""Connection pool of the engine with wait time measurement.
+
+The pool itself is the usual queue pool, it only records how long every checkout waited
+for a connection, so pool sizing can be checked against real traffic. Opening new
+connections is measured separately, a slow database connect is not a too small pool.
+"""
+import time
+from typing import Dict, Union
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio.engine import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# attribute of a new connection record holding how long its connection was being opened
+CONNECT_TIME_ATTRIBUTE = "_measured_connect_time"
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.connects = 0
+        self.connect_total = 0.0
+        self.connect_max = 0.0
+
+    def record_wait(self, wait: float) -> None:
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def record_connect(self, connect: float) -> None:
+        self.connects += 1
+        self.connect_total += connect
+        self.connect_max = max(self.connect_max, connect)
+
+
+class MeasuredQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        try:
+            record = super()._create_connection()
+        finally:
+            connect = time.perf_counter() - started
+            self.metrics.record_connect(connect)
+        setattr(record, CONNECT_TIME_ATTRIBUTE, connect)
+        return record
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except TimeoutError:  # the whole timeout was spent waiting for a free connection
+            self.metrics.record_wait(time.perf_counter() - started)
+            raise
+        # a connection opened by this checkout is counted as connect time, not as waiting
+        connect = record.__dict__.pop(CONNECT_TIME_ATTRIBUTE, 0.0)
+        self.metrics.record_wait(time.perf_counter() - started - connect)
+        return record
+
+
+def pool_stats(engine: AsyncEngine) -> Dict[str, Union[int, float]]:
+    """Returns the current state of the engine pool and checkout wait times.
+
+    :param engine: engine with a MeasuredQueuePool
+    :type engine: AsyncEngine
+
+    :return: pool size, connections checked out and in, overflow, wait times and times of
+             opening new connections in seconds
+    :rtype: Dict[str, int | float]
+
+    """
+
+    pool = engine.sync_engine.pool
+    metrics = pool.metrics
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "checkouts": metrics.checkouts,
+        "wait_avg": metrics.wait_total / metrics.checkouts if metrics.checkouts else 0.0,
+        "wait_max": metrics.wait_max,
+        "connects": metrics.connects,
+        "connect_avg": metrics.connect_total / metrics.connects if metrics.connects else 0.0,
+        "connect_max": metrics.connect_max,
+    }
@@ -0,0 +1,47 @@
+"""Immutable records returned by repositories in the lightweight read mode.
+
+A record is a named tuple with the same fields as the dictionaries repositories return by
+default, it is built straight from a Core row without creating ORM objects.
+"""
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+
+class UserRecord(NamedTuple):
+    uid: str
+    snp: str
+    phone: str
+    is_admin: bool
+    tg_chat_id: Optional[int]
+
+
+class SpeechRecord(NamedTuple):
+    key: str
+    title: str
+    start_time: datetime
+    end_time: datetime
+    venue: str
+    venue_description: str
+
+
+class RoleRecord(NamedTuple):
+    value: str
+
+
+class UserSpeechRecord(NamedTuple):
+    uid_key: str
+    uid: str
+    key: str
+    role: str
+    acknowledgment: Optional[str]
+
+
+class TokenRecord(NamedTuple):
+    token: str
+    vacant: bool
+
+
+class SpeechPage(NamedTuple):
+    speeches: List[SpeechRecord]
+    has_prev: bool
+    has_next: bool
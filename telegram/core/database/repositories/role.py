@@ -1,33 +1,50 @@
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy.sql.expression import select, delete
+from sqlalchemy.sql.expression import select, delete, update
 from typing import Optional, List, Union
 
+from ..records import RoleRecord
+from ..statements import FilterStatements
 from ..create_table import Role
+from ..unit_of_work import commit, rollback
+
+FILTERS = {"value": Role.value}
+SELECT_STATEMENTS = FilterStatements(
+    lambda: select(Role.value).execution_options(use_replica=True), FILTERS
+)
+DELETE_STATEMENTS = FilterStatements(lambda: delete(Role), FILTERS)
 
 
 class RoleRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def get_all(self, value="") -> List[Optional[dict]]:
+    async def get_all(self, value="", as_records: bool = False) -> List[Union[dict, RoleRecord]]:
         """The function of getting all roles from the Role table.
 
         :param value: person's role name
         :type value: str
 
-        :return: list of dictionaries - json format of the requested object
-        :rtype: List[dict | None]
+        :param as_records: return immutable records instead of dictionaries
+        :type as_records: bool
+
+        :return: list of dictionaries - json format of the requested object; or list of records
+        :rtype: List[dict | RoleRecord]
 
         """
 
-        query = select(Role)
+        filters = {}
 
         if value != "":
-            query = query.where(Role.value == value)
+            filters["value"] = value
 
-        roles = [{"value": role.value} for role in (await self.session.execute(query)).scalars()]
+        query, params = SELECT_STATEMENTS.get(**filters)
+        rows = await self.session.execute(query, params)
 
-        return roles
+        if as_records:
+            return [RoleRecord._make(row) for row in rows]
+
+        return [row._asdict() for row in rows]
 
     async def get_one(self, value="") -> Optional[dict]:
         """The function of getting one role from the Role table.
@@ -57,13 +74,14 @@ class RoleRepository:
 
         """
 
-        query = delete(Role)
+        filters = {}
 
         if value != "":
-            query = query.where(Role.value == value)
+            filters["value"] = value
 
-        await self.session.execute(query)
-        await self.session.commit()
+        query, params = DELETE_STATEMENTS.get(**filters)
+        await self.session.execute(query, params)
+        await commit(self.session)
 
         return None
 
@@ -105,7 +123,7 @@ class RoleRepository:
             self.session.add(Role(**params))
             values.add(params["value"])
 
-            await self.session.commit()
+            await commit(self.session)
             return_roles.append(params)
 
         if len(return_roles) == 1:
@@ -113,7 +131,7 @@ class RoleRepository:
 
         return return_roles
 
-    async def update(self, value="", new_value="") -> None:
+    async def update(self, value="", new_value="") -> List[dict]:
         """The function of updating roles in the Role table.
 
         :param value: person's role name
@@ -122,37 +140,34 @@ class RoleRepository:
         :param new_value: new person's role name
         :type new_value: str
 
-        :return: nothing
-        :rtype: None
+        :return: list of dictionaries - json format of the updated objects
+        :rtype: List[dict]
 
         """
 
-        params = dict()
-        query = select(Role)
+        table = Role.__table__
 
-        if value != "":
-            params["value"] = value
-            query = query.where(Role.value == value)
+        if value == "" or new_value == "":
+            return []
 
-        if not params:
-            return
+        query = (
+            update(table)
+            .where(table.c.value == value)
+            .values(value=new_value)
+            .returning(table.c.value)
+        )
 
-        roles = (await self.session.execute(query)).scalars()
+        try:
+            roles = [row._asdict() for row in await self.session.execute(query)]
+        except IntegrityError as exp:
+            await rollback(self.session)
+            raise ValueError(
+                f"Unable to update the value in role "
+                f"because role with this "
+                f'value="{new_value}" already exists.'
+            ) from exp
 
-        query = select(Role).distinct()
-        values = {role.value for role in (await self.session.execute(query)).scalars()}
-
-        for role in roles:
-            if new_value != "":
-                if new_value not in values:
-                    values.remove(role.value)
-                    role.value = new_value
-                    values.add(new_value)
-                else:
-                    ValueError(
-                        f"Unable to update the value in role "
-                        f"because role with this "
-                        f'value="{new_value}" already exists.'
-                    )
+        await commit(self.session)
+        self.session.expire_all()
 
-            await self.session.commit()
+        return roles
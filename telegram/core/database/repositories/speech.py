@@ -1,10 +1,51 @@
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy.sql.expression import select, delete
+from sqlalchemy.sql.expression import bindparam, select, delete, update
 from typing import Optional, List, Union
 from uuid import uuid4 as create_uuid
 from datetime import datetime
 
+from ..records import SpeechRecord
+from ..statements import FilterStatements
 from ..create_table import Speech
+from ..unit_of_work import commit, rollback
+
+# asyncpg accepts at most 32767 bind parameters per statement, Speech has 6 columns and a
+# delete by key takes one parameter per row
+INSERT_CHUNK_SIZE = 5000
+DELETE_CHUNK_SIZE = 30000
+
+# columns changed by update_many, the speech is found by its key
+UPDATE_MANY_COLUMNS = ("title", "start_time", "end_time", "venue", "venue_description")
+UPDATE_MANY_STATEMENT = (
+    update(Speech)
+    .where(Speech.key == bindparam("filter_key"))
+    .values({column: bindparam(f"new_{column}") for column in UPDATE_MANY_COLUMNS})
+)
+
+FILTERS = {
+    "key": Speech.key,
+    "title": Speech.title,
+    "start_time": Speech.start_time,
+    "end_time": Speech.end_time,
+    "venue": Speech.venue,
+    "venue_description": Speech.venue_description,
+    "start_from": lambda value: Speech.start_time >= value,
+    "start_before": lambda value: Speech.start_time < value,
+}
+SELECT_STATEMENTS = FilterStatements(
+    lambda: select(
+        Speech.key,
+        Speech.title,
+        Speech.start_time,
+        Speech.end_time,
+        Speech.venue,
+        Speech.venue_description,
+    ).execution_options(use_replica=True),
+    FILTERS,
+)
+DELETE_STATEMENTS = FilterStatements(lambda: delete(Speech), FILTERS)
 
 
 class SpeechRepository:
@@ -19,7 +60,10 @@ class SpeechRepository:
         end_time: Optional[datetime] = "",
         venue="",
         venue_description="",
-    ) -> List[Optional[dict]]:
+        start_from: Optional[datetime] = None,
+        start_before: Optional[datetime] = None,
+        as_records: bool = False,
+    ) -> List[Union[dict, SpeechRecord]]:
         """The function of getting all speeches from the Speech table.
 
         :param key: unique code of speech (replace None with new uuid)
@@ -40,44 +84,53 @@ class SpeechRepository:
         :param venue_description: description of venue
         :type venue_description: str
 
-        :return: list of dictionaries - json format of the requested object
-        :rtype: List[dict | None]
+        :param start_from: the earliest start time of speech, inclusive
+        :type start_from: datetime | None
+
+        :param start_before: the latest start time of speech, exclusive
+        :type start_before: datetime | None
+
+        :param as_records: return immutable records instead of dictionaries
+        :type as_records: bool
+
+        :return: list of dictionaries - json format of the requested object; or list of records
+        :rtype: List[dict | SpeechRecord]
 
         """
 
-        query = select(Speech)
+        filters = {}
 
         if key != "" and key is not None:
-            query = query.where(Speech.key == key)
+            filters["key"] = key
 
         if title != "":
-            query = query.where(Speech.title == title)
+            filters["title"] = title
 
         if start_time != "":
-            query = query.where(Speech.start_time == start_time)
+            filters["start_time"] = start_time
 
         if end_time != "":
-            query = query.where(Speech.end_time == end_time)
+            filters["end_time"] = end_time
 
         if venue != "":
-            query = query.where(Speech.venue == venue)
+            filters["venue"] = venue
 
         if venue_description != "":
-            query = query.where(Speech.venue_description == venue_description)
-
-        speeches = [
-            {
-                "key": speech.key,
-                "title": speech.title,
-                "start_time": speech.start_time,
-                "end_time": speech.end_time,
-                "venue": speech.venue,
-                "venue_description": speech.venue_description,
-            }
-            for speech in (await self.session.execute(query)).scalars()
-        ]
+            filters["venue_description"] = venue_description
 
-        return speeches
+        if start_from is not None:
+            filters["start_from"] = start_from
+
+        if start_before is not None:
+            filters["start_before"] = start_before
+
+        query, params = SELECT_STATEMENTS.get(**filters)
+        rows = await self.session.execute(query, params)
+
+        if as_records:
+            return [SpeechRecord._make(row) for row in rows]
+
+        return [row._asdict() for row in rows]
 
     async def get_one(
         self,
@@ -160,34 +213,39 @@ class SpeechRepository:
 
         """
 
-        query = delete(Speech)
+        filters = {}
 
         if key != "":
-            query = query.where(Speech.key == key)
+            filters["key"] = key
 
         if title != "":
-            query = query.where(Speech.title == title)
+            filters["title"] = title
 
         if start_time != "":
-            query = query.where(Speech.start_time == start_time)
+            filters["start_time"] = start_time
 
         if end_time != "":
-            query = query.where(Speech.end_time == end_time)
+            filters["end_time"] = end_time
 
         if venue != "":
-            query = query.where(Speech.venue == venue)
+            filters["venue"] = venue
 
         if venue_description != "":
-            query = query.where(Speech.venue_description == venue_description)
+            filters["venue_description"] = venue_description
 
-        await self.session.execute(query)
-        await self.session.commit()
+        query, params = DELETE_STATEMENTS.get(**filters)
+        await self.session.execute(query, params)
+        await commit(self.session)
 
         return None
 
     async def add(self, speeches: Union[dict, List[dict]]) -> Union[dict, List[dict]]:
         """The function of adding speeches to the Speech table.
 
+        All speeches are sent as one INSERT ... ON CONFLICT DO NOTHING statement, uniqueness of
+        key and of title and start_time is enforced by the table constraints. If any of the
+        speeches conflicts with an existing one nothing is added.
+
         :param speeches: dictionary or list of dictionaries - json format of the received objects
         :type speeches: dict | List[dict]
 
@@ -196,9 +254,6 @@ class SpeechRepository:
 
         """
 
-        query = select(Speech).distinct()
-        keys = {speech.key for speech in (await self.session.execute(query)).scalars()}
-
         if type(speeches) == dict:
             speeches = [speeches]
 
@@ -208,12 +263,6 @@ class SpeechRepository:
             params = {}
 
             if "key" in speech.keys() and speech["key"] is not None:
-                if speech["key"] in keys:
-                    raise ValueError(
-                        f"Unable to add new speech with parameter "
-                        f'key="{speech["key"]}" '
-                        f"because this key already exists."
-                    )
                 params["key"] = speech["key"]
             else:
                 params["key"] = str(create_uuid())
@@ -254,17 +303,86 @@ class SpeechRepository:
                     f'because a parameter "venue_description" does not exist.'
                 )
 
-            self.session.add(Speech(**params))
-            keys.add(params["key"])
-
-            await self.session.commit()
             return_speeches.append(params)
 
+        inserted = set()
+        for chunk_start in range(0, len(return_speeches), INSERT_CHUNK_SIZE):
+            chunk = return_speeches[chunk_start : chunk_start + INSERT_CHUNK_SIZE]
+            query = insert(Speech).values(chunk).on_conflict_do_nothing().returning(Speech.key)
+            inserted.update((await self.session.execute(query)).scalars())
+
+        for speech in return_speeches:
+            if speech["key"] not in inserted:
+                await rollback(self.session)
+                raise ValueError(
+                    f"Unable to add new speech with parameters "
+                    f'key="{speech["key"]}", title="{speech["title"]}", '
+                    f'start_time="{speech["start_time"]}" '
+                    f"because one of them already exists."
+                )
+            inserted.remove(speech["key"])  # the same key twice in one batch is a conflict too
+
+        await commit(self.session)
+
         if len(return_speeches) == 1:
             return_speeches = return_speeches[0]
 
         return return_speeches
 
+    async def update_many(self, speeches: List[dict]) -> None:
+        """The function of updating a batch of speeches in the Speech table by key.
+
+        All speeches are updated by one executemany of the same UPDATE statement.
+
+        :param speeches: list of dictionaries - json format of the speeches with every column
+        :type speeches: List[dict]
+
+        :return: nothing
+        :rtype: None
+
+        """
+
+        if not speeches:
+            return None
+
+        params = []
+        for speech in speeches:
+            speech_params = {f"new_{column}": speech[column] for column in UPDATE_MANY_COLUMNS}
+            speech_params["filter_key"] = speech["key"]
+            params.append(speech_params)
+
+        try:
+            await self.session.execute(UPDATE_MANY_STATEMENT, params)
+        except IntegrityError as exp:
+            await rollback(self.session)
+            raise ValueError(
+                "Unable to update the speeches "
+                "because a speech with the same title and start_time already exists."
+            ) from exp
+
+        await commit(self.session)
+        self.session.expire_all()
+
+        return None
+
+    async def delete_many(self, keys: List[str]) -> None:
+        """The function of deleting a batch of speeches from the Speech table by key.
+
+        :param keys: unique codes of the speeches
+        :type keys: List[str]
+
+        :return: nothing
+        :rtype: None
+
+        """
+
+        for chunk_start in range(0, len(keys), DELETE_CHUNK_SIZE):
+            chunk = keys[chunk_start : chunk_start + DELETE_CHUNK_SIZE]
+            await self.session.execute(delete(Speech).where(Speech.key.in_(chunk)))
+        await commit(self.session)
+
+        return None
+
     async def update(
         self,
         key="",
@@ -279,7 +397,7 @@ class SpeechRepository:
         new_end_time: Optional[datetime] = "",
         new_venue="",
         new_venue_description="",
-    ) -> None:
+    ) -> List[dict]:
         """The function of updating speeches in the Speech table.
 
         :param key: unique code of speech
@@ -318,72 +436,77 @@ class SpeechRepository:
         :param new_venue_description: new description of venue
         :type new_venue_description: str
 
-        :return: nothing
-        :rtype: None
+        :return: list of dictionaries - json format of the updated objects
+        :rtype: List[dict]
 
         """
 
-        params = dict()
-        query = select(Speech)
+        table = Speech.__table__
+        query = update(table)
 
         if key != "":
-            params["key"] = key
-            query = query.where(Speech.key == key)
+            query = query.where(table.c.key == key)
 
         if title != "":
-            params["title"] = title
-            query = query.where(Speech.title == title)
+            query = query.where(table.c.title == title)
 
         if start_time != "":
-            params["start_time"] = start_time
-            query = query.where(Speech.start_time == start_time)
+            query = query.where(table.c.start_time == start_time)
 
         if end_time != "":
-            params["end_time"] = end_time
-            query = query.where(Speech.end_time == end_time)
+            query = query.where(table.c.end_time == end_time)
 
         if venue != "":
-            params["venue"] = venue
-            query = query.where(Speech.venue == venue)
+            query = query.where(table.c.venue == venue)
 
         if venue_description != "":
-            params["venue_description"] = venue_description
-            query = query.where(Speech.venue_description == venue_description)
+            query = query.where(table.c.venue_description == venue_description)
 
-        if not params:
-            return
+        if query.whereclause is None:
+            return []
 
-        speeches = (await self.session.execute(query)).scalars()
+        values = dict()
 
-        query = select(Speech).distinct()
-        keys = {speech.key for speech in (await self.session.execute(query)).scalars()}
+        if new_key != "":
+            values["key"] = new_key
 
-        for speech in speeches:
-            if new_key != "":
-                if new_key not in keys:
-                    keys.remove(speech.key)
-                    speech.key = new_key
-                    keys.add(new_key)
-                else:
-                    ValueError(
-                        f"Unable to update the value in speech "
-                        f"because speech with this "
-                        f'key="{new_key}" already exists.'
-                    )
-
-            if new_title != "":
-                speech.title = new_title
-
-            if new_start_time != "":
-                speech.start_time = new_start_time
-
-            if new_end_time != "":
-                speech.end_time = new_end_time
-
-            if new_venue != "":
-                speech.venue = new_venue
-
-            if new_venue_description != "":
-                speech.venue_description = new_venue_description
-
-            await self.session.commit()
+        if new_title != "":
+            values["title"] = new_title
+
+        if new_start_time != "":
+            values["start_time"] = new_start_time
+
+        if new_end_time != "":
+            values["end_time"] = new_end_time
+
+        if new_venue != "":
+            values["venue"] = new_venue
+
+        if new_venue_description != "":
+            values["venue_description"] = new_venue_description
+
+        if not values:
+            return []
+
+        query = query.values(**values).returning(
+            table.c.key,
+            table.c.title,
+            table.c.start_time,
+            table.c.end_time,
+            table.c.venue,
+            table.c.venue_description,
+        )
+
+        try:
+            speeches = [row._asdict() for row in await self.session.execute(query)]
+        except IntegrityError as exp:
+            await rollback(self.session)
+            raise ValueError(
+                f"Unable to update the values in speech "
+                f"because speech with one of these values {values} already exists."
+            ) from exp
+
+        await commit(self.session)
+        self.session.expire_all()
+
+        return speeches
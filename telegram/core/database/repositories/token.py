@@ -1,15 +1,34 @@
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy.sql.expression import select, delete
+from sqlalchemy.sql.expression import bindparam, select, delete, update
 from typing import Optional, List, Union
 
+from ..records import TokenRecord
+from ..statements import FilterStatements
 from ..create_table import Token, User
+from ..unit_of_work import commit, rollback
+
+FILTERS = {"token": Token.token, "vacant": Token.vacant}
+SELECT_STATEMENTS = FilterStatements(
+    lambda: select(Token.token, Token.vacant).execution_options(use_replica=True), FILTERS
+)
+DELETE_STATEMENTS = FilterStatements(lambda: delete(Token), FILTERS)
+# marks a vacant token as used, the row is returned only if the token was still vacant
+CLAIM_STATEMENT = (
+    update(Token)
+    .where(Token.token == bindparam("filter_token"), Token.vacant.is_(True))
+    .values(vacant=False)
+    .returning(Token.token)
+)
 
 
 class TokenRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def get_all(self, token="", uid="", vacant: Optional[bool] = "") -> List[Optional[dict]]:
+    async def get_all(
+        self, token="", uid="", vacant: Optional[bool] = "", as_records: bool = False
+    ) -> List[Union[dict, TokenRecord]]:
         """The function of getting all tokens from the Token table.
 
         :param token: key to activate a person in the database
@@ -22,27 +41,31 @@ class TokenRepository:
                        (replace None with True)
         :type vacant: bool | None
 
-        :return: list of dictionaries - json format of the requested object
-        :rtype: List[dict | None]
+        :param as_records: return immutable records instead of dictionaries
+        :type as_records: bool
+
+        :return: list of dictionaries - json format of the requested object; or list of records
+        :rtype: List[dict | TokenRecord]
 
         """
 
-        query = select(Token)
+        filters = {}
 
         if token != "":
-            query = query.where(Token.token == token)
+            filters["token"] = token
 
         if vacant != "":
             if vacant is None:
                 vacant = True
-            query = query.where(Token.vacant == vacant)
+            filters["vacant"] = vacant
 
-        tokens = [
-            {"token": token.token, "vacant": token.vacant}
-            for token in (await self.session.execute(query)).scalars()
-        ]
+        query, params = SELECT_STATEMENTS.get(**filters)
+        rows = await self.session.execute(query, params)
 
-        return tokens
+        if as_records:
+            return [TokenRecord._make(row) for row in rows]
+
+        return [row._asdict() for row in rows]
 
     async def get_one(self, token="", uid="", vacant: Optional[bool] = "") -> Optional[dict]:
         """The function of getting one token from the Token table.
@@ -86,24 +109,44 @@ class TokenRepository:
 
         """
 
-        query = delete(Token)
+        # the token table has no uid column (see Token), so uid is ignored like in get_all
+        filters = {}
 
         if token != "":
-            query = query.where(Token.token == token)
-
-        if uid != "":
-            query = query.where(Token.uid == uid)
+            filters["token"] = token
 
         if vacant != "":
             if vacant is None:
                 vacant = True
-            query = query.where(Token.vacant == vacant)
+            filters["vacant"] = vacant
 
-        await self.session.execute(query)
-        await self.session.commit()
+        query, params = DELETE_STATEMENTS.get(**filters)
+        await self.session.execute(query, params)
+        await commit(self.session)
 
         return None
 
+    async def claim(self, token: str) -> bool:
+        """The function of using a vacant token from the Token table.
+
+        The token is checked and marked as used by one statement, so the same token can not
+        be used twice even by simultaneous requests.
+
+        :param token: key to activate a person in the database
+        :type token: str
+
+        :return: whether the token was vacant and is used now
+        :rtype: bool
+
+        """
+
+        rows = await self.session.execute(CLAIM_STATEMENT, {"filter_token": token})
+        claimed = rows.first() is not None
+        await commit(self.session)
+        self.session.expire_all()
+
+        return claimed
+
     async def add(self, tokens: Union[dict, List[dict]]) -> Union[dict, List[dict]]:
         """The function of adding tokens to the Token table.
 
@@ -162,7 +205,7 @@ class TokenRepository:
             self.session.add(Token(**params))
             token_tokens.add(params["token"])
 
-            await self.session.commit()
+            await commit(self.session)
             return_tokens.append(params)
 
         if len(return_tokens) == 1:
@@ -178,7 +221,7 @@ class TokenRepository:
         new_token="",
         new_uid="",
         new_vacant: Optional[bool] = "",
-    ) -> None:
+    ) -> List[dict]:
         """The function of updating tokens in the Token table.
 
         :param token: key to activate a person in the database
@@ -201,62 +244,53 @@ class TokenRepository:
                        (replace None with True)
         :type new_vacant: bool | None
 
-        :return: nothing
-        :rtype: None
+        :return: list of dictionaries - json format of the updated objects
+        :rtype: List[dict]
 
         """
 
-        params = dict()
-        query = select(Token)
+        # the token table has no uid column (see Token), so uid and new_uid are ignored
+        # the same way get_all ignores them
+        table = Token.__table__
+        query = update(table)
 
         if token != "":
-            params["token"] = token
-            query = query.where(Token.token == token)
-
-        if uid != "":
-            params["uid"] = uid
-            query = query.where(Token.uid == uid)
+            query = query.where(table.c.token == token)
 
         if vacant != "":
             if vacant is None:
                 vacant = True
-            params["vacant"] = vacant
-            query = query.where(Token.vacant == vacant)
+            query = query.where(table.c.vacant == vacant)
 
-        if not params:
-            return
+        if query.whereclause is None:
+            return []
 
-        tokens = (await self.session.execute(query)).scalars()
+        values = dict()
 
-        query = select(Token).distinct()
-        token_tokens = {token.token for token in (await self.session.execute(query)).scalars()}
-        query = select(User).distinct()
-        uids = {user.uid for user in (await self.session.execute(query)).scalars()}
+        if new_token != "":
+            values["token"] = new_token
 
-        for token in tokens:
-            if new_token != "":
-                if new_token not in token_tokens:
-                    token_tokens.remove(token.token)
-                    token.token = new_token
-                    token_tokens.add(new_token)
-                else:
-                    ValueError(
-                        f"Unable to update the value in token "
-                        f"because token with this "
-                        f'token="{new_token}" already exists.'
-                    )
+        if new_vacant != "":
+            if new_vacant is None:
+                new_vacant = True
+            values["vacant"] = new_vacant
 
-            if new_uid != "":
-                if new_uid in uids:
-                    token.uid = new_uid
-                else:
-                    ValueError(
-                        f"Unable to update the value in token "
-                        f"because user with this "
-                        f'uid="{new_uid}" does not exist.'
-                    )
+        if not values:
+            return []
 
-            if new_vacant != "":
-                token.vacant = new_vacant
+        query = query.values(**values).returning(table.c.token, table.c.vacant)
 
-            await self.session.commit()
+        try:
+            tokens = [row._asdict() for row in await self.session.execute(query)]
+        except IntegrityError as exp:
+            await rollback(self.session)
+            raise ValueError(
+                f"Unable to update the value in token "
+                f"because token with this "
+                f'token="{new_token}" already exists.'
+            ) from exp
+
+        await commit(self.session)
+        self.session.expire_all()
+
+        return tokens
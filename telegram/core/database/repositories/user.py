@@ -1,15 +1,59 @@
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy.sql.expression import select, delete
-from typing import Optional, List, Union
+from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import select, delete, update, or_
+from typing import Iterable, Optional, List, Union
 from uuid import uuid4 as create_uuid
 
+from ..records import UserRecord
+from ..statements import FilterStatements
 from ..create_table import User
+from ..unit_of_work import after_commit, commit, get_unit_of_work, rollback
+from ..user_cache import user_cache
+
+# asyncpg accepts at most 32767 bind parameters per statement, User has 5 columns and a delete
+# by uid takes one parameter per row
+INSERT_CHUNK_SIZE = 5000
+DELETE_CHUNK_SIZE = 30000
+
+UPSERT_INSERTED = "inserted"
+UPSERT_UPDATED = "updated"
+UPSERT_CONFLICT = "conflict"
+UPSERT_INVALID = "invalid"
+
+FILTERS = {
+    "uid": User.uid,
+    "snp": User.snp,
+    "phone": User.phone,
+    "is_admin": User.is_admin,
+    "tg_chat_id": User.tg_chat_id,
+}
+SELECT_STATEMENTS = FilterStatements(
+    lambda: select(
+        User.uid, User.snp, User.phone, User.is_admin, User.tg_chat_id
+    ).execution_options(use_replica=True),
+    FILTERS,
+)
+DELETE_STATEMENTS = FilterStatements(
+    lambda: delete(User).returning(User.uid, User.tg_chat_id), FILTERS
+)
 
 
 class UserRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    async def _invalidate_cache(
+        self, uids: Iterable[str] = (), tg_chat_ids: Iterable[Optional[int]] = ()
+    ) -> None:
+        """Removes changed users from the user cache once the changes are committed"""
+        uids = {uid for uid in uids if uid != ""}
+        tg_chat_ids = {tg_chat_id for tg_chat_id in tg_chat_ids if tg_chat_id not in ("", None)}
+        await after_commit(
+            self.session, lambda: user_cache.invalidate(uids=uids, tg_chat_ids=tg_chat_ids)
+        )
+
     async def get_all(
         self,
         uid: Optional[str] = "",
@@ -17,7 +61,8 @@ class UserRepository:
         phone="",
         is_admin: Optional[bool] = "",
         tg_chat_id: Optional[int] = "",
-    ) -> List[Optional[dict]]:
+        as_records: bool = False,
+    ) -> List[Union[dict, UserRecord]]:
         """The function of getting all users from the User table.
 
         :param uid: unique id (replace None with new uuid)
@@ -35,40 +80,38 @@ class UserRepository:
         :param tg_chat_id: user's tg chat id
         :type tg_chat_id: int | None
 
-        :return: list of dictionaries - json format of the requested object
-        :rtype: List[dict | None]
+        :param as_records: return immutable records instead of dictionaries
+        :type as_records: bool
+
+        :return: list of dictionaries - json format of the requested object; or list of records
+        :rtype: List[dict | UserRecord]
 
         """
 
-        query = select(User)
+        filters = {}
 
         if uid != "" and uid is not None:
-            query = query.where(User.uid == uid)
+            filters["uid"] = uid
 
         if snp != "":
-            query = query.where(User.snp == snp)
+            filters["snp"] = snp
 
         if phone != "":
-            query = query.where(User.phone == phone)
+            filters["phone"] = phone
 
         if is_admin != "" and is_admin is not None:
-            query = query.where(User.is_admin == is_admin)
+            filters["is_admin"] = is_admin
 
         if tg_chat_id != "":
-            query = query.where(User.tg_chat_id == tg_chat_id)
-
-        users = [
-            {
-                "uid": user.uid,
-                "snp": user.snp,
-                "phone": user.phone,
-                "is_admin": user.is_admin,
-                "tg_chat_id": user.tg_chat_id,
-            }
-            for user in (await self.session.execute(query)).scalars()
-        ]
+            filters["tg_chat_id"] = tg_chat_id
 
-        return users
+        query, params = SELECT_STATEMENTS.get(**filters)
+        rows = await self.session.execute(query, params)
+
+        if as_records:
+            return [UserRecord._make(row) for row in rows]
+
+        return [row._asdict() for row in rows]
 
     async def get_one(
         self,
@@ -100,13 +143,31 @@ class UserRepository:
 
         """
 
+        # the lookup of the user who sent an update is served from the user cache,
+        # except inside a unit of work which may see its own uncommitted changes
+        cacheable = (
+            tg_chat_id not in ("", None)
+            and uid == ""
+            and snp == ""
+            and phone == ""
+            and is_admin == ""
+            and get_unit_of_work(self.session) is None
+        )
+        if cacheable:
+            found, user = await user_cache.get(tg_chat_id)
+            if found:
+                return user
+            # taken before the query, so a user changed meanwhile is not cached
+            generation = await user_cache.generation()
+
         users = await self.get_all(
             uid=uid, snp=snp, phone=phone, is_admin=is_admin, tg_chat_id=tg_chat_id
         )
 
-        if users and users[0]:
-            return users[0]
-        return None
+        user = users[0] if users and users[0] else None
+        if cacheable:
+            await user_cache.set(tg_chat_id, user, generation=generation)
+        return user
 
     async def delete(
         self,
@@ -138,33 +199,112 @@ class UserRepository:
 
         """
 
-        query = delete(User)
+        filters = {}
 
         if uid != "":
-            query = query.where(User.uid == uid)
+            filters["uid"] = uid
 
         if snp != "":
-            query = query.where(User.snp == snp)
+            filters["snp"] = snp
 
         if phone != "":
-            query = query.where(User.phone == phone)
+            filters["phone"] = phone
 
         if is_admin != "":
             if is_admin is None:
                 is_admin = False
-            query = query.where(User.is_admin == is_admin)
+            filters["is_admin"] = is_admin
 
         if tg_chat_id != "":
-            query = query.where(User.tg_chat_id == tg_chat_id)
+            filters["tg_chat_id"] = tg_chat_id
+
+        query, params = DELETE_STATEMENTS.get(**filters)
+        deleted = (await self.session.execute(query, params)).all()
+        await commit(self.session)
+        await self._invalidate_cache(
+            uids=[user.uid for user in deleted], tg_chat_ids=[user.tg_chat_id for user in deleted]
+        )
+
+        return None
+
+    async def delete_many(self, uids: List[str]) -> None:
+        """The function of deleting a batch of users from the User table by uid.
+
+        :param uids: unique ids of the users
+        :type uids: List[str]
+
+        :return: nothing
+        :rtype: None
+
+        """
 
-        await self.session.execute(query)
-        await self.session.commit()
+        deleted = []
+        for chunk_start in range(0, len(uids), DELETE_CHUNK_SIZE):
+            query = (
+                delete(User)
+                .where(User.uid.in_(uids[chunk_start : chunk_start + DELETE_CHUNK_SIZE]))
+                .returning(User.uid, User.tg_chat_id)
+            )
+            deleted.extend((await self.session.execute(query)).all())
+        await commit(self.session)
+        await self._invalidate_cache(
+            uids=[user.uid for user in deleted], tg_chat_ids=[user.tg_chat_id for user in deleted]
+        )
 
         return None
 
+    @staticmethod
+    def _prepare(user: dict) -> dict:
+        """Turns one received object into a full row of the User table.
+
+        :param user: dictionary - json format of the received object
+        :type user: dict
+
+        :return: dictionary with every column of the User table
+        :rtype: dict
+
+        """
+
+        params = {}
+
+        if "uid" in user.keys() and user["uid"] is not None:
+            params["uid"] = user["uid"]
+        else:
+            params["uid"] = str(create_uuid())
+
+        if "snp" in user.keys():
+            params["snp"] = user["snp"]
+        else:
+            raise ValueError(
+                f"Unable to add new user " f'because a parameter "snp" does not exist.'
+            )
+
+        if "phone" in user.keys():
+            params["phone"] = user["phone"]
+        else:
+            raise ValueError(
+                f"Unable to add new user " f'because a parameter "phone" does not exist.'
+            )
+
+        if "is_admin" in user.keys() and user["is_admin"] is not None:
+            params["is_admin"] = user["is_admin"]
+        else:
+            params["is_admin"] = False
+
+        if "tg_chat_id" in user.keys():
+            params["tg_chat_id"] = user["tg_chat_id"]
+        else:
+            params["tg_chat_id"] = None
+
+        return params
+
     async def add(self, users: Union[dict, List[dict]]) -> Union[dict, List[dict]]:
         """The function of adding users to the User table.
 
+        All users are sent as one INSERT ... ON CONFLICT DO NOTHING statement, uniqueness of
+        uid, phone and tg_chat_id is enforced by the table constraints. If any of the users
+        conflicts with an existing one nothing is added.
+
         :param users: dictionary or list of dictionaries - json format of the received objects
         :type users: dict | List[dict]
 
@@ -173,80 +313,157 @@ class UserRepository:
 
         """
 
-        query = select(User).distinct()
-        uids = {user.uid for user in (await self.session.execute(query)).scalars()}
-        phones = {user.phone for user in (await self.session.execute(query)).scalars()}
-        tg_chat_ids = {user.tg_chat_id for user in (await self.session.execute(query)).scalars()}
-
         if type(users) == dict:
             users = [users]
 
-        return_users = []
-
-        for user in users:
-            params = {}
+        return_users = [self._prepare(user) for user in users]
 
-            if "uid" in user.keys() and user["uid"] is not None:
-                if user["uid"] in uids:
-                    raise ValueError(
-                        f"Unable to add new user with parameter "
-                        f'uid="{user["uid"]}" '
-                        f"because this uid already exists."
-                    )
-                params["uid"] = user["uid"]
-            else:
-                params["uid"] = str(create_uuid())
+        inserted = set()
+        for chunk_start in range(0, len(return_users), INSERT_CHUNK_SIZE):
+            chunk = return_users[chunk_start : chunk_start + INSERT_CHUNK_SIZE]
+            query = insert(User).values(chunk).on_conflict_do_nothing().returning(User.uid)
+            inserted.update((await self.session.execute(query)).scalars())
 
-            if "snp" in user.keys():
-                params["snp"] = user["snp"]
-            else:
+        for user in return_users:
+            if user["uid"] not in inserted:
+                await rollback(self.session)
                 raise ValueError(
-                    f"Unable to add new user " f'because a parameter "snp" does not exist.'
+                    f"Unable to add new user with parameters "
+                    f'uid="{user["uid"]}", phone="{user["phone"]}", '
+                    f'tg_chat_id="{user["tg_chat_id"]}" '
+                    f"because one of them already exists."
                 )
+            inserted.remove(user["uid"])  # the same uid twice in one batch is a conflict too
 
-            if "phone" in user.keys():
-                if user["phone"] not in phones:
-                    params["phone"] = user["phone"]
-                    phones.add(user["phone"])
-                else:
-                    raise ValueError(
-                        f"Unable to add new user with parameter "
-                        f'phone="{user["phone"]}" '
-                        f"because this phone already exists."
-                    )
-            else:
-                raise ValueError(
-                    f"Unable to add new user " f'because a parameter "phone" does not exist.'
-                )
+        await commit(self.session)
+        await self._invalidate_cache(tg_chat_ids=[user["tg_chat_id"] for user in return_users])
 
-            if "is_admin" in user.keys():
-                params["is_admin"] = user["is_admin"]
+        if len(return_users) == 1:
+            return_users = return_users[0]
+
+        return return_users
+
+    async def upsert(self, users: List[dict], update_existing: bool = True) -> List[dict]:
+        """The function of adding or updating a batch of users in the User table.
+
+        The batch is written with one INSERT ... ON CONFLICT (uid) statement in one transaction.
+        Users that clash with another user by phone or tg_chat_id (or with an earlier row of
+        the same batch) are not written and reported as conflicts instead of raising.
+        A missing tg_chat_id never unbinds an existing user from telegram.
+
+        :param users: list of dictionaries - json format of the received objects
+        :type users: List[dict]
+
+        :param update_existing: update users whose uid already exists, otherwise report them
+                                as conflicts
+        :type update_existing: bool
+
+        :return: list of results in the order of received objects, every result is a dictionary
+                 {"uid": str | None, "status": "inserted" | "updated" | "conflict" | "invalid",
+                 "reason": str | None}
+        :rtype: List[dict]
+
+        """
+
+        results = []
+        rows = {}  # index of the received object -> row of the User table
+        seen_uids, seen_phones, seen_tg_chat_ids = set(), set(), set()
+
+        for index, user in enumerate(users):
+            try:
+                params = self._prepare(user)
+            except ValueError as exp:
+                results.append(
+                    {"uid": user.get("uid"), "status": UPSERT_INVALID, "reason": str(exp)}
+                )
+                continue
+
+            results.append({"uid": params["uid"], "status": None, "reason": None})
+            if params["uid"] in seen_uids:
+                reason = f'uid="{params["uid"]}" is repeated in the batch'
+            elif params["phone"] in seen_phones:
+                reason = f'phone="{params["phone"]}" is repeated in the batch'
+            elif params["tg_chat_id"] is not None and params["tg_chat_id"] in seen_tg_chat_ids:
+                reason = f'tg_chat_id="{params["tg_chat_id"]}" is repeated in the batch'
             else:
-                params["is_admin"] = False
-
-            if "tg_chat_id" in user.keys():
-                if user["tg_chat_id"] not in tg_chat_ids or user["tg_chat_id"] is None:
-                    params["tg_chat_id"] = user["tg_chat_id"]
-                    tg_chat_ids.add(user["tg_chat_id"])
-                else:
-                    raise ValueError(
-                        f"Unable to add new user with parameter "
-                        f'tg_chat_id="{user["tg_chat_id"]}" '
-                        f"because this tg_chat_id already exists."
-                    )
+                reason = None
+
+            if reason:
+                results[index].update(status=UPSERT_CONFLICT, reason=reason)
+                continue
+
+            seen_uids.add(params["uid"])
+            seen_phones.add(params["phone"])
+            if params["tg_chat_id"] is not None:
+                seen_tg_chat_ids.add(params["tg_chat_id"])
+            rows[index] = params
+
+        if not rows:
+            return results
+
+        # one indexed lookup instead of scanning the whole table
+        query = select(User.uid, User.phone, User.tg_chat_id).where(
+            or_(
+                User.uid.in_(seen_uids),
+                User.phone.in_(seen_phones),
+                User.tg_chat_id.in_(seen_tg_chat_ids),
+            )
+        )
+        existing = (await self.session.execute(query)).all()
+        existing_uids = {row.uid for row in existing}
+        phone_owners = {row.phone: row.uid for row in existing}
+        tg_chat_id_owners = {row.tg_chat_id: row.uid for row in existing if row.tg_chat_id}
+
+        for index, params in list(rows.items()):
+            if params["uid"] in existing_uids and not update_existing:
+                reason = f'uid="{params["uid"]}" already exists'
+            elif phone_owners.get(params["phone"], params["uid"]) != params["uid"]:
+                reason = f'phone="{params["phone"]}" belongs to another user'
+            elif (
+                params["tg_chat_id"] is not None
+                and tg_chat_id_owners.get(params["tg_chat_id"], params["uid"]) != params["uid"]
+            ):
+                reason = f'tg_chat_id="{params["tg_chat_id"]}" belongs to another user'
             else:
-                params["tg_chat_id"] = None
-
-            self.session.add(User(**params))
-            uids.add(params["uid"])
+                continue
+            results[index].update(status=UPSERT_CONFLICT, reason=reason)
+            del rows[index]
+
+        written = set()
+        batch = list(rows.values())
+        for chunk_start in range(0, len(batch), INSERT_CHUNK_SIZE):
+            query = insert(User).values(batch[chunk_start : chunk_start + INSERT_CHUNK_SIZE])
+            if update_existing:
+                query = query.on_conflict_do_update(
+                    index_elements=[User.uid],
+                    set_={
+                        "snp": query.excluded.snp,
+                        "phone": query.excluded.phone,
+                        "is_admin": query.excluded.is_admin,
+                        "tg_chat_id": func.coalesce(query.excluded.tg_chat_id, User.tg_chat_id),
+                    },
+                )
+            else:
+                query = query.on_conflict_do_nothing()
+            written.update((await self.session.execute(query.returning(User.uid))).scalars())
 
-            await self.session.commit()
-            return_users.append(params)
+        await commit(self.session)
+        await self._invalidate_cache(
+            uids=written,
+            tg_chat_ids=[params["tg_chat_id"] for params in rows.values()],
+        )
 
-        if len(return_users) == 1:
-            return_users = return_users[0]
+        for index, params in rows.items():
+            if params["uid"] not in written:
+                results[index].update(
+                    status=UPSERT_CONFLICT, reason=f'uid="{params["uid"]}" was added concurrently'
+                )
+            elif params["uid"] in existing_uids:
+                results[index]["status"] = UPSERT_UPDATED
+            else:
+                results[index]["status"] = UPSERT_INSERTED
 
-        return return_users
+        return results
 
     async def update(
         self,
@@ -260,7 +477,7 @@ class UserRepository:
         new_phone="",
         new_is_admin: Optional[bool] = "",
         new_tg_chat_id: Optional[int] = "",
-    ) -> None:
+    ) -> List[dict]:
         """The function of updating users in the User table.
 
         :param uid: unique id
@@ -294,87 +511,87 @@ class UserRepository:
         :param new_tg_chat_id: user's new tg chat id
         :type new_tg_chat_id: int | None
 
-        :return: nothing
-        :rtype: None
+        :return: list of dictionaries - json format of the updated objects
+        :rtype: List[dict]
 
         """
 
-        params = dict()
-        query = select(User)
+        table = User.__table__
+        # the rows before the update, their tg_chat_ids are invalidated in the user cache too
+        old = select(table.c.uid, table.c.tg_chat_id)
 
         if uid != "":
-            params["uid"] = uid
-            query = query.where(User.uid == uid)
+            old = old.where(table.c.uid == uid)
 
         if snp != "":
-            params["snp"] = snp
-            query = query.where(User.snp == snp)
+            old = old.where(table.c.snp == snp)
 
         if phone != "":
-            params["phone"] = phone
-            query = query.where(User.phone == phone)
+            old = old.where(table.c.phone == phone)
 
         if is_admin != "":
             if is_admin is None:
                 is_admin = False
-            params["is_admin"] = is_admin
-            query = query.where(User.is_admin == is_admin)
+            old = old.where(table.c.is_admin == is_admin)
 
         if tg_chat_id != "":
-            params["tg_chat_id"] = tg_chat_id
-            query = query.where(User.tg_chat_id == tg_chat_id)
-
-        if not params:
-            return
-
-        users = (await self.session.execute(query)).scalars()
-
-        query = select(User).distinct()
-        uids = {user.uid for user in (await self.session.execute(query)).scalars()}
-        phones = {user.phone for user in (await self.session.execute(query)).scalars()}
-        tg_chat_ids = {user.tg_chat_id for user in (await self.session.execute(query)).scalars()}
-
-        for user in users:
-            if new_uid != "":
-                if new_uid not in uids:
-                    uids.remove(user.uid)
-                    user.uid = new_uid
-                    uids.add(new_uid)
-                else:
-                    ValueError(
-                        f"Unable to update the value in user "
-                        f"because user with this "
-                        f'uid="{new_uid}" already exists.'
-                    )
-
-            if new_snp != "":
-                user.snp = new_snp
-
-            if new_phone != "":
-                if new_phone not in phones:
-                    phones.remove(user.phone)
-                    user.phone = new_phone
-                    phones.add(new_phone)
-                else:
-                    ValueError(
-                        f"Unable to update the value in user "
-                        f"because user with this "
-                        f'phone="{new_phone}" already exists.'
-                    )
-
-            if new_is_admin != "":
-                user.is_admin = new_is_admin
-
-            if new_tg_chat_id != "":
-                if new_tg_chat_id == None or new_tg_chat_id not in tg_chat_ids:
-                    tg_chat_ids.remove(user.tg_chat_id)
-                    user.tg_chat_id = new_tg_chat_id
-                    tg_chat_ids.add(new_tg_chat_id)
-                else:
-                    ValueError(
-                        f"Unable to update the value in user "
-                        f"because user with this "
-                        f'tg_chat_id="{new_tg_chat_id}" already exists.'
-                    )
-
-            await self.session.commit()
+            old = old.where(table.c.tg_chat_id == tg_chat_id)
+
+        if old.whereclause is None:
+            return []
+
+        old = old.with_for_update().cte("old_user")
+        query = update(table).where(table.c.uid == old.c.uid)
+
+        values = dict()
+
+        if new_uid != "":
+            values["uid"] = new_uid
+
+        if new_snp != "":
+            values["snp"] = new_snp
+
+        if new_phone != "":
+            values["phone"] = new_phone
+
+        if new_is_admin != "":
+            if new_is_admin is None:
+                new_is_admin = False
+            values["is_admin"] = new_is_admin
+
+        if new_tg_chat_id != "":
+            values["tg_chat_id"] = new_tg_chat_id
+
+        if not values:
+            return []
+
+        query = query.values(**values).returning(
+            table.c.uid,
+            table.c.snp,
+            table.c.phone,
+            table.c.is_admin,
+            table.c.tg_chat_id,
+            old.c.tg_chat_id.label("old_tg_chat_id"),
+        )
+
+        try:
+            users = [row._asdict() for row in await self.session.execute(query)]
+        except IntegrityError as exp:
+            await rollback(self.session)
+            raise ValueError(
+                f"Unable to update the values in user "
+                f"because user with one of these values {values} already exists."
+            ) from exp
+
+        await commit(self.session)
+        # objects loaded before the update must not be served from the identity map
+        self.session.expire_all()
+        old_tg_chat_ids = [user.pop("old_tg_chat_id") for user in users]
+        await self._invalidate_cache(
+            uids=[uid] + [user["uid"] for user in users],
+            tg_chat_ids=[tg_chat_id, new_tg_chat_id]
+            + old_tg_chat_ids
+            + [user["tg_chat_id"] for user in users],
+        )
+
+        return users
@@ -1,17 +1,71 @@
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy.sql.expression import select, delete
-from typing import Optional, List, Union
+from sqlalchemy.sql.expression import Select, select, delete, update, literal, tuple_
+from typing import Any, AsyncIterator, Dict, Optional, List, Tuple, Union
+from datetime import datetime
 
+from ..records import UserSpeechRecord
+from ..statements import FilterStatements
 from ..create_table import UserSpeech, User, Speech, Role
+from ..unit_of_work import commit, rollback
+
+# asyncpg accepts at most 32767 bind parameters per statement, UserSpeech has 5 columns and a delete
+# by uid_key takes one parameter per row
+INSERT_CHUNK_SIZE = 5000
+DELETE_CHUNK_SIZE = 30000
+
+# default number of rows fetched from the server-side cursor at once by stream()
+STREAM_BATCH_SIZE = 1000
+
+FILTERS = {
+    "uid": UserSpeech.uid,
+    "key": UserSpeech.key,
+    "role": UserSpeech.role,
+    "acknowledgment": UserSpeech.acknowledgment,
+}
+SELECT_STATEMENTS = FilterStatements(
+    lambda: select(
+        UserSpeech.uid_key,
+        UserSpeech.uid,
+        UserSpeech.key,
+        UserSpeech.role,
+        UserSpeech.acknowledgment,
+    ).execution_options(use_replica=True),
+    FILTERS,
+)
+DELETE_STATEMENTS = FilterStatements(lambda: delete(UserSpeech), FILTERS)
 
 
 class UserSpeechRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    @staticmethod
+    def _select(
+        uid="", key="", role="", acknowledgment: Optional[str] = ""
+    ) -> Tuple[Select, Dict[str, Any]]:
+        """Returns a query of user_speeches filtered by the given parameters and its parameters."""
+
+        filters = {}
+
+        if uid != "":
+            filters["uid"] = uid
+
+        if key != "":
+            filters["key"] = key
+
+        if role != "":
+            filters["role"] = role
+
+        if acknowledgment != "":
+            filters["acknowledgment"] = acknowledgment
+
+        return SELECT_STATEMENTS.get(**filters)
+
     async def get_all(
-        self, uid="", key="", role="", acknowledgment: Optional[str] = ""
-    ) -> List[Optional[dict]]:
+        self, uid="", key="", role="", acknowledgment: Optional[str] = "", as_records: bool = False
+    ) -> List[Union[dict, UserSpeechRecord]]:
         """The function of getting all user_speeches from the UserSpeech table.
 
         :param uid: unique id
@@ -26,37 +80,113 @@ class UserSpeechRepository:
         :param acknowledgment: confirmation of notification
         :type acknowledgment: str | None
 
-        :return: list of dictionaries - json format of the requested object
-        :rtype: List[dict | None]
+        :param as_records: return immutable records instead of dictionaries
+        :type as_records: bool
+
+        :return: list of dictionaries - json format of the requested object; or list of records
+        :rtype: List[dict | UserSpeechRecord]
 
         """
 
-        query = select(UserSpeech)
+        query, params = self._select(uid=uid, key=key, role=role, acknowledgment=acknowledgment)
+        rows = await self.session.execute(query, params)
 
-        if uid != "":
-            query = query.where(UserSpeech.uid == uid)
+        if as_records:
+            return [UserSpeechRecord._make(row) for row in rows]
 
-        if key != "":
-            query = query.where(UserSpeech.key == key)
+        return [row._asdict() for row in rows]
 
-        if role != "":
-            query = query.where(UserSpeech.role == role)
+    async def stream(
+        self,
+        uid="",
+        key="",
+        role="",
+        acknowledgment: Optional[str] = "",
+        as_records: bool = False,
+        batch_size: int = STREAM_BATCH_SIZE,
+    ) -> AsyncIterator[List[Union[dict, UserSpeechRecord]]]:
+        """The function of iterating over user_speeches from the UserSpeech table in batches.
 
-        if acknowledgment != "":
-            query = query.where(UserSpeech.acknowledgment == acknowledgment)
-
-        user_speeches = [
-            {
-                "uid_key": user_speech.uid_key,
-                "uid": user_speech.uid,
-                "key": user_speech.key,
-                "role": user_speech.role,
-                "acknowledgment": user_speech.acknowledgment,
-            }
-            for user_speech in (await self.session.execute(query)).scalars()
-        ]
+        Rows are read through a server-side cursor, so only one batch is in memory at a time.
+        User_speeches are sorted by key, role and uid.
 
-        return user_speeches
+        :param uid: unique id
+        :type uid: str
+
+        :param key: unique code of user_speech
+        :type key: str
+
+        :param role: person's role name
+        :type role: str
+
+        :param acknowledgment: confirmation of notification
+        :type acknowledgment: str | None
+
+        :param as_records: yield immutable records instead of dictionaries
+        :type as_records: bool
+
+        :param batch_size: number of user_speeches in one batch
+        :type batch_size: int
+
+        :return: async iterator over lists of dictionaries - json format of the requested object;
+                 or over lists of records
+        :rtype: AsyncIterator[List[dict | UserSpeechRecord]]
+
+        """
+
+        query, params = self._select(uid=uid, key=key, role=role, acknowledgment=acknowledgment)
+        query = query.order_by(UserSpeech.key, UserSpeech.role, UserSpeech.uid).execution_options(
+            yield_per=batch_size
+        )
+
+        result = await self.session.stream(query, params)
+        async for rows in result.partitions(batch_size):
+            if as_records:
+                yield [UserSpeechRecord._make(row) for row in rows]
+            else:
+                yield [row._asdict() for row in rows]
+
+    async def get_responses(
+        self, after: Optional[Tuple[str, str, str]] = None, limit: int = STREAM_BATCH_SIZE
+    ) -> List[dict]:
+        """The function of getting one page of user_speeches joined with names of their users.
+
+        User_speeches are sorted by key, role and uid, a page starts right after the given
+        (key, role, uid). Every page is read by its own query, so nothing stays open in the
+        database while the page is being sent.
+
+        :param after: (key, role, uid) of the last user_speech of the previous page, the first
+                      page if not set
+        :type after: Tuple[str, str, str] | None
+
+        :param limit: maximum number of user_speeches on the page
+        :type limit: int
+
+        :return: list of dictionaries - json format of the user_speeches with the snp of the user
+        :rtype: List[dict]
+
+        """
+
+        order = (UserSpeech.key, UserSpeech.role, UserSpeech.uid)
+        query = (
+            select(
+                UserSpeech.uid,
+                UserSpeech.key,
+                UserSpeech.role,
+                UserSpeech.acknowledgment,
+                User.snp,
+            )
+            .select_from(UserSpeech)
+            .join(User, User.uid == UserSpeech.uid)
+            .order_by(*order)
+            .limit(limit)
+            .execution_options(use_replica=True)
+        )
+
+        if after is not None:
+            query = query.where(tuple_(*order) > tuple_(*after))
+
+        return [row._asdict() for row in await self.session.execute(query)]
 
     async def get_one(
         self, uid="", key="", role="", acknowledgment: Optional[str] = ""
@@ -88,6 +218,102 @@ class UserSpeechRepository:
             return user_speeches[0]
         return None
 
+    async def get_schedule(
+        self,
+        uid: str,
+        role="",
+        start_from: Optional[datetime] = None,
+        start_before: Optional[datetime] = None,
+    ) -> List[dict]:
+        """The function of getting speeches of one user joined with the UserSpeech table.
+
+        :param uid: user's unique id
+        :type uid: str
+
+        :param role: person's role name
+        :type role: str
+
+        :param start_from: the earliest start time of speech, inclusive
+        :type start_from: datetime | None
+
+        :param start_before: the latest start time of speech, exclusive
+        :type start_before: datetime | None
+
+        :return: list of dictionaries - json format of the speeches with the user's role and
+                 acknowledgment, sorted by start time
+        :rtype: List[dict]
+
+        """
+
+        query = (
+            select(
+                Speech.key,
+                Speech.title,
+                Speech.start_time,
+                Speech.end_time,
+                Speech.venue,
+                Speech.venue_description,
+                UserSpeech.role,
+                UserSpeech.acknowledgment,
+            )
+            .join(Speech, Speech.key == UserSpeech.key)
+            .where(UserSpeech.uid == uid)
+            .order_by(Speech.start_time, Speech.key)
+        )
+
+        if role != "":
+            query = query.where(UserSpeech.role == role)
+
+        if start_from is not None:
+            query = query.where(Speech.start_time >= start_from)
+
+        if start_before is not None:
+            query = query.where(Speech.start_time < start_before)
+
+        return [row._asdict() for row in await self.session.execute(query)]
+
+    async def get_overlapping(
+        self, uid: str, start_time: datetime, end_time: datetime, exclude_key: Optional[str] = None
+    ) -> Optional[str]:
+        """The function of finding a speech of the user overlapping the given time.
+
+        Speeches are treated as half-open intervals [start_time, end_time), so a speech
+        starting when another one ends does not overlap it.
+
+        :param uid: user's unique id
+        :type uid: str
+
+        :param start_time: start of the time interval
+        :type start_time: datetime
+
+        :param end_time: end of the time interval
+        :type end_time: datetime
+
+        :param exclude_key: key of a speech that is not taken into account
+        :type exclude_key: str | None
+
+        :return: key of one of the overlapping speeches; or nothing
+        :rtype: str | None
+
+        """
+
+        query = (
+            select(Speech.key)
+            .select_from(UserSpeech)
+            .join(Speech, Speech.key == UserSpeech.key)
+            .where(
+                UserSpeech.uid == uid,
+                Speech.start_time < end_time,
+                Speech.end_time > start_time,
+            )
+            .limit(1)
+        )
+
+        if exclude_key is not None:
+            query = query.where(Speech.key != exclude_key)
+
+        return (await self.session.execute(query)).scalar()
+
     async def delete(self, uid="", key="", role="", acknowledgment: Optional[str] = "") -> None:
         """The function of deleting user_speeches from the UserSpeech table.
 
@@ -108,28 +334,54 @@ class UserSpeechRepository:
 
         """
 
-        query = delete(UserSpeech)
+        filters = {}
 
         if uid != "":
-            query = query.where(UserSpeech.uid == uid)
+            filters["uid"] = uid
 
         if key != "":
-            query = query.where(UserSpeech.key == key)
+            filters["key"] = key
 
         if role != "":
-            query = query.where(UserSpeech.role == role)
+            filters["role"] = role
 
         if acknowledgment != "":
-            query = query.where(UserSpeech.acknowledgment == acknowledgment)
+            filters["acknowledgment"] = acknowledgment
 
-        await self.session.execute(query)
-        await self.session.commit()
+        query, params = DELETE_STATEMENTS.get(**filters)
+        await self.session.execute(query, params)
+        await commit(self.session)
+
+        return None
+
+    async def delete_many(self, user_speeches: List[dict]) -> None:
+        """The function of deleting a batch of user_speeches from the UserSpeech table.
+
+        :param user_speeches: list of dictionaries with the uid and key of every user_speech
+        :type user_speeches: List[dict]
+
+        :return: nothing
+        :rtype: None
+
+        """
+
+        uid_keys = [
+            f'{user_speech["uid"]}_{user_speech["key"]}' for user_speech in user_speeches
+        ]
+        for chunk_start in range(0, len(uid_keys), DELETE_CHUNK_SIZE):
+            chunk = uid_keys[chunk_start : chunk_start + DELETE_CHUNK_SIZE]
+            await self.session.execute(delete(UserSpeech).where(UserSpeech.uid_key.in_(chunk)))
+        await commit(self.session)
 
         return None
 
     async def add(self, user_speeches: Union[dict, List[dict]]) -> Union[dict, List[dict]]:
         """The function of adding user_speeches to the UserSpeech table.
 
+        All user_speeches are sent as one INSERT ... ON CONFLICT DO NOTHING statement. Existence
+        of users, speeches and roles and uniqueness of uid and key are enforced by the table
+        constraints, the other tables are only queried by primary key to explain a failure.
+
         :param user_speeches: dictionary or list of dictionaries - json format of the received objects
         :type user_speeches: dict | List[dict]
 
@@ -138,20 +390,6 @@ class UserSpeechRepository:
 
         """
 
-        query = select(UserSpeech).distinct()
-        uids = {user_speech.uid for user_speech in (await self.session.execute(query)).scalars()}
-        keys = {user_speech.key for user_speech in (await self.session.execute(query)).scalars()}
-        uids_keys = {
-            user_speech.uid_key for user_speech in (await self.session.execute(query)).scalars()
-        }
-
-        query = select(User).distinct()
-        user_uids = {user.uid for user in (await self.session.execute(query)).scalars()}
-        query = select(Speech).distinct()
-        speech_keys = {speech.key for speech in (await self.session.execute(query)).scalars()}
-        query = select(Role).distinct()
-        role_values = {role.value for role in (await self.session.execute(query)).scalars()}
-
         if type(user_speeches) == dict:
             user_speeches = [user_speeches]
 
@@ -160,50 +398,21 @@ class UserSpeechRepository:
         for user_speech in user_speeches:
             params = {}
 
-            if "uid" in user_speech.keys():
-                if user_speech["uid"] not in user_uids:
-                    raise ValueError(
-                        f"Unable to add new user_speech "
-                        f"because user with this "
-                        f'uid="{user_speech["uid"]}" does not exist'
-                    )
-            else:
+            if "uid" not in user_speech.keys():
                 raise ValueError(
                     f"Unable to add new user_speech " f'because a parameter "uid" does not exist.'
                 )
 
-            if "key" in user_speech.keys():
-                if user_speech["key"] not in speech_keys:
-                    raise ValueError(
-                        f"Unable to add new user_speech "
-                        f"because speech with this "
-                        f'key="{user_speech["key"]}" does not exist'
-                    )
-            else:
+            if "key" not in user_speech.keys():
                 raise ValueError(
                     f"Unable to add new user_speech " f'because a parameter "key" does not exist.'
                 )
 
-            if f'{user_speech["uid"]}_{user_speech["key"]}' in uids_keys:
-                raise ValueError(
-                    f"Unable to add new user_speech with parameters "
-                    f'uid="{user_speech["uid"]}" and '
-                    f'key="{user_speech["key"]}" '
-                    f"because this uid and key already exist."
-                )
-
             params["uid_key"] = f'{user_speech["uid"]}_{user_speech["key"]}'
             params["uid"] = user_speech["uid"]
             params["key"] = user_speech["key"]
-            uids_keys.add(f'{user_speech["uid"]}_{user_speech["key"]}')
 
             if "role" in user_speech.keys():
-                if user_speech["role"] not in role_values:
-                    raise ValueError(
-                        f"Unable to add new user_speech "
-                        f"because role with this "
-                        f'value="{user_speech["role"]}" does not exist'
-                    )
                 params["role"] = user_speech["role"]
             else:
                 raise ValueError(
@@ -215,18 +424,70 @@ class UserSpeechRepository:
             else:
                 params["acknowledgment"] = None
 
-            self.session.add(UserSpeech(**params))
-            uids.add(params["uid"])
-            keys.add(params["key"])
-
-            await self.session.commit()
             return_user_speeches.append(params)
 
+        inserted = set()
+        try:
+            for chunk_start in range(0, len(return_user_speeches), INSERT_CHUNK_SIZE):
+                chunk = return_user_speeches[chunk_start : chunk_start + INSERT_CHUNK_SIZE]
+                query = (
+                    insert(UserSpeech)
+                    .values(chunk)
+                    .on_conflict_do_nothing()
+                    .returning(UserSpeech.uid_key)
+                )
+                inserted.update((await self.session.execute(query)).scalars())
+        except IntegrityError as exp:
+            await rollback(self.session)
+            raise await self._missing_reference_error(return_user_speeches) from exp
+
+        for user_speech in return_user_speeches:
+            if user_speech["uid_key"] not in inserted:
+                await rollback(self.session)
+                raise ValueError(
+                    f"Unable to add new user_speech with parameters "
+                    f'uid="{user_speech["uid"]}" and '
+                    f'key="{user_speech["key"]}" '
+                    f"because this uid and key already exist."
+                )
+            inserted.remove(user_speech["uid_key"])
+
+        await commit(self.session)
+
         if len(return_user_speeches) == 1:
             return_user_speeches = return_user_speeches[0]
 
         return return_user_speeches
 
+    async def _missing_reference_error(self, user_speeches: List[dict]) -> ValueError:
+        """Finds which user, speech or role of the received objects does not exist.
+
+        :param user_speeches: list of dictionaries - rows of the UserSpeech table
+        :type user_speeches: List[dict]
+
+        :return: error describing the first missing reference
+        :rtype: ValueError
+
+        """
+
+        references = (
+            ("user", "uid", User.uid),
+            ("speech", "key", Speech.key),
+            ("role", "role", Role.value),
+        )
+        for table_name, field, column in references:
+            wanted = {user_speech[field] for user_speech in user_speeches}
+            query = select(column).where(column.in_(wanted))
+            found = set((await self.session.execute(query)).scalars())
+            for value in wanted - found:
+                return ValueError(
+                    f"Unable to add new user_speech "
+                    f"because {table_name} with this "
+                    f'{column.key}="{value}" does not exist'
+                )
+
+        return ValueError("Unable to add new user_speech because of a constraint violation.")
+
     async def update(
         self,
         uid="",
@@ -237,7 +498,7 @@ class UserSpeechRepository:
         new_key="",
         new_role="",
         new_acknowledgment: Optional[str] = "",
-    ) -> None:
+    ) -> List[dict]:
         """The function of updating user_speeches in the UserSpeech table.
 
         :param uid: unique id
@@ -264,129 +525,67 @@ class UserSpeechRepository:
         :param new_acknowledgment: new confirmation of notification
         :type new_acknowledgment: str | None
 
-        :return: nothing
-        :rtype: None
+        :return: list of dictionaries - json format of the updated objects
+        :rtype: List[dict]
 
         """
 
-        params = dict()
-        query = select(UserSpeech)
+        table = UserSpeech.__table__
+        query = update(table)
 
         if uid != "":
-            params["uid"] = uid
-            query = query.where(UserSpeech.uid == uid)
+            query = query.where(table.c.uid == uid)
 
         if key != "":
-            params["key"] = key
-            query = query.where(UserSpeech.key == key)
+            query = query.where(table.c.key == key)
 
         if role != "":
-            params["role"] = role
-            query = query.where(UserSpeech.role == role)
+            query = query.where(table.c.role == role)
 
         if acknowledgment != "":
-            params["acknowledgment"] = acknowledgment
-            query = query.where(UserSpeech.acknowledgment == acknowledgment)
+            query = query.where(table.c.acknowledgment == acknowledgment)
 
-        if not params:
-            return
+        if query.whereclause is None:
+            return []
 
-        user_speeches = (await self.session.execute(query)).scalars()
+        values = dict()
 
-        query = select(UserSpeech).distinct()
-        uids = {user_speech.uid for user_speech in (await self.session.execute(query)).scalars()}
-        keys = {user_speech.key for user_speech in (await self.session.execute(query)).scalars()}
-        uids_keys = {
-            user_speech.uid_key for user_speech in (await self.session.execute(query)).scalars()
-        }
+        if new_uid != "":
+            values["uid"] = new_uid
 
-        query = select(User).distinct()
-        user_uids = {user.uid for user in (await self.session.execute(query)).scalars()}
-        query = select(Speech).distinct()
-        speech_keys = {speech.key for speech in (await self.session.execute(query)).scalars()}
-        query = select(Role).distinct()
-        role_values = {role.value for role in (await self.session.execute(query)).scalars()}
+        if new_key != "":
+            values["key"] = new_key
 
-        for user_speech in user_speeches:
-            if new_uid != "" and new_key != "":
-                if new_uid not in user_uids:
-                    raise ValueError(
-                        f"Unable to update the value in user_speech "
-                        f"because user with this "
-                        f'uid="{new_uid}" does not exist.'
-                    )
-                if new_key not in speech_keys:
-                    raise ValueError(
-                        f"Unable to update the value in user_speech "
-                        f"because speech with this "
-                        f'key="{new_key}" does not exist.'
-                    )
-                if f"{new_uid}_{new_key}" in uids_keys:
-                    raise ValueError(
-                        f"Unable to update the values in user_speech "
-                        f"because user_speech with this "
-                        f'uid="{new_uid}" and '
-                        f'key="{new_key}" already exists.'
-                    )
-                uids_keys.remove(user_speech.uid_key)
-                user_speech.uid_key = f"{new_uid}_{new_key}"
-                user_speech.uid = new_uid
-                user_speech.key = new_key
-                uids_keys.add(user_speech.uid_key)
-
-            elif new_uid != "":
-                if new_uid in user_uids:
-                    if f"{new_uid}_{user_speech.key}" not in uids_keys:
-                        uids_keys.remove(user_speech.uid_key)
-                        user_speech.uid_key = f"{new_uid}_{user_speech.key}"
-                        user_speech.uid = new_uid
-                        uids_keys.add(user_speech.uid_key)
-                    else:
-                        raise ValueError(
-                            f"Unable to update the values in user_speech "
-                            f"because user_speech with this "
-                            f'uid="{new_uid}" and '
-                            f'key="{user_speech.key}" already exists.'
-                        )
-                else:
-                    raise ValueError(
-                        f"Unable to update the value in user_speech "
-                        f"because user with this "
-                        f'uid="{new_uid}" does not exist.'
-                    )
-
-            elif new_key != "":
-                if new_key in speech_keys:
-                    if f"{user_speech.uid}_{new_key}" not in uids_keys:
-                        uids_keys.remove(user_speech.uid_key)
-                        user_speech.uid_key = f"{user_speech.uid}_{new_key}"
-                        user_speech.key = new_key
-                        uids_keys.add(user_speech.uid_key)
-                    else:
-                        raise ValueError(
-                            f"Unable to update the values in user_speech "
-                            f"because user_speech with this "
-                            f'uid="{new_uid}" and '
-                            f'key="{user_speech.key}" already exists.'
-                        )
-                else:
-                    raise ValueError(
-                        f"Unable to update the value in user_speech "
-                        f"because speech with this "
-                        f'key="{new_key}" does not exist.'
-                    )
-
-            if new_role != "":
-                if new_role in role_values:
-                    user_speech.role = new_role
-                else:
-                    raise ValueError(
-                        f"Unable to update the value in user_speech "
-                        f"because role with this "
-                        f'value="{new_role}" does not exist.'
-                    )
-
-            if new_acknowledgment != "":
-                user_speech.acknowledgment = new_acknowledgment
-
-            await self.session.commit()
+        if new_uid != "" or new_key != "":
+            # uid_key is derived from uid and key, so it is recalculated for every row
+            new_uid_expr = literal(new_uid) if new_uid != "" else table.c.uid
+            new_key_expr = literal(new_key) if new_key != "" else table.c.key
+            values["uid_key"] = new_uid_expr + "_" + new_key_expr
+
+        if new_role != "":
+            values["role"] = new_role
+
+        if new_acknowledgment != "":
+            values["acknowledgment"] = new_acknowledgment
+
+        if not values:
+            return []
+
+        query = query.values(**values).returning(
+            table.c.uid_key, table.c.uid, table.c.key, table.c.role, table.c.acknowledgment
+        )
+
+        try:
+            user_speeches = [row._asdict() for row in await self.session.execute(query)]
+        except IntegrityError as exp:
+            await rollback(self.session)
+            raise ValueError(
+                f"Unable to update the values in user_speech "
+                f"because user, speech or role from {values} does not exist "
+                f"or user_speech with this uid and key already exists."
+            ) from exp
+
+        await commit(self.session)
+        self.session.expire_all()
+
+        return user_speeches
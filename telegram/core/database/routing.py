@@ -0,0 +1,47 @@
+"""Session sending repository reads to a read replica.
+
+Reads opt in with the ``use_replica`` execution option, repositories set it on the statements
+of get_all, so get_one goes to the replica too. Everything else goes to the primary, and so
+do all reads of a session once it has written something or has been pinned to the primary,
+because the replica may not have the written rows yet.
+"""
+from typing import Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import Select
+
+USE_REPLICA_OPTION = "use_replica"
+PRIMARY_KEY = "primary"
+
+
+class RoutingSession(Session):
+    def __init__(self, replica_bind: Optional[Engine] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.replica_bind = replica_bind
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replica_bind is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+        if (
+            isinstance(clause, Select)
+            and not self._flushing
+            and not self.info.get(PRIMARY_KEY)
+            and clause.get_execution_options().get(USE_REPLICA_OPTION)
+        ):
+            return self.replica_bind
+
+        if not isinstance(clause, Select):
+            # the replica may lag behind, later reads must see what this session wrote
+            self.info[PRIMARY_KEY] = True
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+def use_primary(session: AsyncSession) -> None:
+    """Sends all further reads of the session to the primary.
+
+    Used where a read must see rows written just before, e.g. checks before writes.
+    """
+    session.sync_session.info[PRIMARY_KEY] = True
@@ -0,0 +1,172 @@
+"""Process-wide snapshot of all speeches.
+
+Speeches only change when a moderator imports a schedule, so handlers read them from an
+immutable in-memory snapshot instead of querying the database on every interaction. The
+snapshot carries a version: after a successful import the importing process increments
+the version in Redis and publishes it, every replica marks its snapshot as stale and
+rebuilds it from the database on the next read.
+"""
+import asyncio
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from aioredis import Redis, RedisError
+from loguru import logger
+from sqlalchemy.ext.asyncio.session import AsyncSession
+
+from .create_table import SessionLocal
+from .records import SpeechPage, SpeechRecord
+from .repositories.speech import SpeechRepository
+from .routing import use_primary
+
+VERSION_KEY = "speech_catalog:version"
+CHANNEL = "speech_catalog"
+RESUBSCRIBE_DELAY = 5  # seconds
+# number of speeches on one page of the general schedule
+PAGE_SIZE = 5
+
+
+class SpeechSnapshot:
+    """Immutable list of speeches sorted by start time and indexed by key"""
+
+    def __init__(self, version: int, speeches: List[SpeechRecord]):
+        self.version = version
+        self.speeches: Tuple[SpeechRecord, ...] = tuple(
+            sorted(speeches, key=lambda speech: (speech.start_time, speech.key))
+        )
+        self._positions: Dict[str, int] = {
+            speech.key: position for position, speech in enumerate(self.speeches)
+        }
+        self.days: Tuple[date, ...] = tuple(
+            sorted({speech.start_time.date() for speech in self.speeches})
+        )
+
+    def __len__(self) -> int:
+        return len(self.speeches)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns the speech as a dictionary like SpeechRepository.get_one, None if missing"""
+        position = self._positions.get(key)
+        if position is None:
+            return None
+        return self.speeches[position]._asdict()
+
+    def page(
+        self,
+        after_key: Optional[str] = None,
+        before_key: Optional[str] = None,
+        limit: int = PAGE_SIZE,
+    ) -> SpeechPage:
+        """Returns the page of speeches after after_key or before before_key"""
+        cursor_key = before_key if before_key is not None else after_key
+        if cursor_key is not None and cursor_key not in self._positions:
+            return SpeechPage(speeches=[], has_prev=False, has_next=False)
+
+        if before_key is not None:
+            end = self._positions[before_key]
+            start = max(end - limit, 0)
+            return SpeechPage(
+                speeches=list(self.speeches[start:end]), has_prev=start > 0, has_next=True
+            )
+
+        start = 0 if after_key is None else self._positions[after_key] + 1
+        end = start + limit
+        return SpeechPage(
+            speeches=list(self.speeches[start:end]),
+            has_prev=after_key is not None,
+            has_next=end < len(self.speeches),
+        )
+
+
+class SpeechCatalog:
+    def __init__(self, redis: Optional[Redis] = None, session_factory=SessionLocal):
+        self.redis = redis
+        self._session_factory = session_factory
+        self._snapshot: Optional[SpeechSnapshot] = None
+        self._latest_version = 0
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> SpeechSnapshot:
+        """Returns the current snapshot, building it if it is missing or stale.
+
+        :return: snapshot of all speeches
+        :rtype: SpeechSnapshot
+
+        """
+
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version >= self._latest_version:
+            return snapshot
+
+        async with self._lock:
+            if self._snapshot is None or self._snapshot.version < self._latest_version:
+                await self._rebuild(self._latest_version)
+            return self._snapshot
+
+    async def find(self, key: str, session: AsyncSession) -> Optional[dict]:
+        """Returns one speech, from the database if the snapshot does not have it yet.
+
+        :param key: unique code of speech
+        :type key: str
+
+        :param session: session of the update, used only if the speech is not in the snapshot
+        :type session: AsyncSession
+
+        :return: dictionary - json format of the speech; or nothing if it does not exist
+        :rtype: dict | None
+
+        """
+
+        speech = (await self.get()).get(key)
+        if speech is None:
+            speech = await SpeechRepository(session).get_one(key=key)
+        return speech
+
+    async def _rebuild(self, version: int) -> None:
+        async with self._session_factory() as session:
+            # a replica may lag behind the import that bumped the version
+            use_primary(session)
+            speeches = await SpeechRepository(session).get_all(as_records=True)
+        self._snapshot = SpeechSnapshot(version, speeches)
+        logger.info(f"Speech catalog version {version} built with {len(speeches)} speeches")
+
+    async def invalidate(self) -> int:
+        """Bumps the version after speeches are changed and tells the other replicas about it.
+
+        :return: new version of the catalog
+        :rtype: int
+
+        """
+
+        version = self._latest_version + 1
+        if self.redis is not None:
+            try:
+                version = await self.redis.incr(VERSION_KEY)
+                await self.redis.publish(CHANNEL, version)
+            except RedisError as exp:
+                logger.warning(f"Unable to publish speech catalog version: {exp}")
+        self._seen(version)
+        return version
+
+    def _seen(self, version: int) -> None:
+        self._latest_version = max(self._latest_version, version)
+
+    async def listen(self) -> None:
+        """Follows versions published by other replicas, runs until cancelled."""
+        if self.redis is None:
+            return
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(CHANNEL)
+                # versions published while not subscribed would be lost otherwise
+                self._seen(int(await self.redis.get(VERSION_KEY) or 0))
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._seen(int(message["data"]))
+            except RedisError as exp:
+                logger.warning(f"Speech catalog lost its subscription: {exp}")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+
+speech_catalog = SpeechCatalog()
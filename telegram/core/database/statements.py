@@ -0,0 +1,64 @@
+"""Statements of repository filters built once per combination of filters.
+
+Repositories filter by any subset of columns. Building a new statement on every call makes
+SQLAlchemy construct the statement and compute its cache key before it finds the compiled
+form in its cache. Here a statement is built once for every combination of used filters,
+with the filter values as bound parameters, and then reused, so a call only looks it up.
+"""
+from types import FunctionType
+from typing import Any, Callable, Dict, Tuple, Union
+
+from sqlalchemy.sql.elements import BindParameter, ClauseElement
+from sqlalchemy.sql.expression import bindparam
+from sqlalchemy.sql.base import Executable
+
+# a column compared for equality, or a function building a condition from a bound parameter
+Condition = Union[Any, Callable[[BindParameter], ClauseElement]]
+
+
+class FilterStatements:
+    def __init__(self, build: Callable[[], Executable], conditions: Dict[str, Condition]):
+        """
+        :param build: builds the statement without filters
+        :type build: Callable[[], Executable]
+
+        :param conditions: filter names and their columns or condition builders
+        :type conditions: Dict[str, Condition]
+        """
+        self._build = build
+        self._conditions = conditions
+        self._statements: Dict[Tuple[Tuple[str, bool], ...], Executable] = {}
+
+    def get(self, **filters) -> Tuple[Executable, Dict[str, Any]]:
+        """Returns the statement for the used filters and parameters to execute it with.
+
+        A None compared with a column becomes IS NULL, like in a statement built by hand.
+
+        :param filters: names and values of the used filters
+        :type filters: Any
+
+        :return: statement and its parameters
+        :rtype: Tuple[Executable, Dict[str, Any]]
+
+        """
+
+        key = tuple(sorted((name, value is None) for name, value in filters.items()))
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = self._build()
+            for name, is_null in key:
+                condition = self._conditions[name]
+                if isinstance(condition, FunctionType):
+                    statement = statement.where(condition(bindparam(f"filter_{name}")))
+                elif is_null:
+                    statement = statement.where(condition.is_(None))
+                else:
+                    statement = statement.where(condition == bindparam(f"filter_{name}"))
+            self._statements[key] = statement
+
+        params = {
+            f"filter_{name}": value
+            for name, value in filters.items()
+            if value is not None or isinstance(self._conditions[name], FunctionType)
+        }
+        return statement, params
@@ -0,0 +1,29 @@
+import asyncio
+import sqlite3
+import time
+
+from sqlalchemy.util import greenlet_spawn
+
+from core.database.pool import MeasuredQueuePool
+
+
+def slow_connect():
+    time.sleep(0.05)
+    return sqlite3.connect(":memory:")
+
+
+def test_connect_time_is_not_counted_as_waiting():
+    pool = MeasuredQueuePool(slow_connect, pool_size=1, max_overflow=0)
+
+
+    def checkouts():
+        pool.connect().close()  # opens the connection
+        pool.connect().close()  # reuses it
+
+    asyncio.run(greenlet_spawn(checkouts))
+
+    metrics = pool.metrics
+    assert metrics.checkouts == 2
+    assert metrics.connects == 1
+    assert metrics.connect_max >= 0.05
+    assert metrics.wait_max < 0.05
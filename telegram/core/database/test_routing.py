@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine
+from sqlalchemy.sql.expression import select, update
+
+from core.database.routing import PRIMARY_KEY, RoutingSession
+
+table = Table("item", MetaData(), Column("id", Integer))
+replica_read = select(table.c.id).execution_options(use_replica=True)
+
+
+def test_marked_reads_go_to_replica_until_session_writes():
+    primary, replica = create_engine("sqlite://"), create_engine("sqlite://")
+    session = RoutingSession(bind=primary, replica_bind=replica)
+
+    assert session.get_bind(clause=replica_read) is replica
+    assert session.get_bind(clause=select(table.c.id)) is primary  # not marked
+
+    assert session.get_bind(clause=update(table).values(id=1)) is primary
+    assert session.get_bind(clause=replica_read) is primary  # read your own writes
+
+
+def test_pinned_session_and_no_replica():
+    primary, replica = create_engine("sqlite://"), create_engine("sqlite://")
+    session = RoutingSession(bind=primary, replica_bind=replica)
+    session.info[PRIMARY_KEY] = True
+    assert session.get_bind(clause=replica_read) is primary
+
+    assert RoutingSession(bind=primary).get_bind(clause=replica_read) is primary
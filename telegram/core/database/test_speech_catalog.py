@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+
+from core.database.records import SpeechRecord
+from core.database.repositories.speech import SpeechRepository
+from core.database.speech_catalog import SpeechCatalog, SpeechSnapshot
+
+start = datetime(2022, 3, 1, 9, 0)
+speeches = [
+    SpeechRecord(
+        key=f"key-{number}",
+        title=f"Доклад {number}",
+        start_time=start + timedelta(hours=8 * number),
+        end_time=start + timedelta(hours=8 * number + 1),
+        venue="Аудитория",
+        venue_description="https://telegra.ph/",
+    )
+    for number in range(7)
+]
+
+
+def test_snapshot_is_sorted_and_indexed():
+    snapshot = SpeechSnapshot(3, list(reversed(speeches)))
+    assert snapshot.version == 3
+    assert list(snapshot.speeches) == speeches
+    assert snapshot.get("key-2") == speeches[2]._asdict()
+    assert snapshot.get("missing") is None
+    assert snapshot.days == tuple((start + timedelta(days=day)).date() for day in range(3))
+
+
+def test_snapshot_pages():
+    snapshot = SpeechSnapshot(1, speeches)
+    first = snapshot.page(limit=3)
+    assert first.speeches == speeches[:3] and not first.has_prev and first.has_next
+
+    last = snapshot.page(after_key="key-5", limit=3)
+    assert last.speeches == speeches[6:] and last.has_prev and not last.has_next
+
+    back = snapshot.page(before_key="key-3", limit=3)
+    assert back.speeches == speeches[:3] and not back.has_prev and back.has_next
+
+    assert snapshot.page(after_key="missing").speeches == []
+
+
+@pytest.mark.asyncio
+async def test_invalidation_bumps_version():
+    catalog = SpeechCatalog()
+    assert await catalog.invalidate() == 1
+    assert await catalog.invalidate() == 2
+
+
+@pytest.mark.asyncio
+async def test_listening_without_redis_returns():
+    await SpeechCatalog().listen()  # nothing to follow without Redis
+
+
+@pytest.mark.asyncio
+async def test_speeches_missing_from_the_snapshot_are_read_from_the_database(monkeypatch):
+    catalog = SpeechCatalog()
+    catalog._snapshot = SpeechSnapshot(0, speeches[:1])
+    get_one = AsyncMock(side_effect=lambda key: speeches[1]._asdict() if key == "key-1" else None)
+    monkeypatch.setattr(SpeechRepository, "get_one", lambda self, key: get_one(key=key))
+
+    assert await catalog.find("key-0", session=None) == speeches[0]._asdict()
+    get_one.assert_not_called()
+    assert await catalog.find("key-1", session=None) == speeches[1]._asdict()  # added meanwhile
+    assert await catalog.find("missing", session=None) is None  # deleted
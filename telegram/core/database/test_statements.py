@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy.sql.expression import select
+
+from core.database.statements import FilterStatements
+
+table = Table("item", MetaData(), Column("id", Integer), Column("name", String))
+statements = FilterStatements(
+    lambda: select(table.c.id, table.c.name),
+    {"id": table.c.id, "name": table.c.name, "id_from": lambda value: table.c.id >= value},
+)
+
+
+def test_statement_is_built_once_per_combination():
+    first, params = statements.get(id=1, name="a")
+    second, other_params = statements.get(name="b", id=2)
+    assert first is second
+    assert params == {"filter_id": 1, "filter_name": "a"}
+    assert other_params == {"filter_id": 2, "filter_name": "b"}
+    assert statements.get(id=1)[0] is not first
+
+
+def test_none_is_compared_with_is_null():
+    statement, params = statements.get(name=None)
+    assert "name IS NULL" in str(statement)
+    assert params == {}
+    assert statements.get(name="a")[0] is not statement
+
+
+def test_condition_builders():
+    statement, params = statements.get(id_from=5)
+    assert "id >= :filter_id_from" in str(statement)
+    assert params == {"filter_id_from": 5}
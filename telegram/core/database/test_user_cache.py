@@ -0,0 +1,238 @@
+import fnmatch
+from unittest.mock import patch
+
+import pytest
+from aioredis import RedisError, WatchError
+
+from core.database.user_cache import GENERATION_KEY, UserCache
+
+user = {
+    "uid": "testuser@gmail.com",
+    "snp": "Простой Юзер",
+    "phone": "+79031281954",
+    "is_admin": False,
+    "tg_chat_id": 123456,
+}
+
+
+
+class DictRedis:
+    """In-memory stand-in for the Redis commands of the user cache, expiration is ignored"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    async def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, 0)) + 1)
+        return int(self.values[key])
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    async def scan_iter(self, match):
+        for key in list(self.values):
+            if fnmatch.fnmatch(key, match):
+                yield key
+
+    def pipeline(self, transaction=True):
+        return DictPipeline(self)
+
+
+class DictPipeline:
+    """Buffers commands until execute, WATCH fails the transaction if the key has changed"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.watched = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def watch(self, key):
+        self.watched[key] = self.redis.values.get(key)
+
+    async def get(self, key):
+        return await self.redis.get(key)
+
+    def multi(self):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.commands.append(lambda: self.redis.values.__setitem__(key, str(value)))
+
+    def incr(self, key):
+        self.commands.append(lambda: self.redis.values.__setitem__(
+            key, str(int(self.redis.values.get(key, 0)) + 1)
+        ))
+
+    def delete(self, *keys):
+        self.commands.append(lambda: [self.redis.values.pop(key, None) for key in keys])
+
+    async def execute(self):
+        for key, value in self.watched.items():
+            if self.redis.values.get(key) != value:
+                raise WatchError(f"{key} has changed")
+        for command in self.commands:
+            command()
+
+
+class BrokenRedis:
+    """Redis that is down"""
+
+    def __getattr__(self, name):
+        raise RedisError("Connection refused")
+
+
+@pytest.mark.asyncio
+async def test_local_tier_hits_and_misses():
+    cache = UserCache()
+    assert await cache.get(123456) == (False, None)
+
+    await cache.set(123456, user)
+    await cache.set(111111, None)  # unknown users are cached too
+    assert await cache.get(123456) == (True, user)
+    assert await cache.get("111111") == (True, None)  # chat ids may come as strings
+
+    assert cache.stats() == {
+        "local_hits": 2,
+        "redis_hits": 0,
+        "misses": 1,
+        "invalidations": 0,
+        "local_size": 2,
+    }
+
+
+@pytest.mark.asyncio
+async def test_lru_and_ttl():
+    cache = UserCache(max_size=1, local_ttl=10)
+    await cache.set(1, None)
+    await cache.set(123456, user)
+    assert await cache.get(1) == (False, None)  # evicted as the least recently used
+
+    with patch("core.database.user_cache.time.monotonic", return_value=10 ** 9):
+        assert await cache.get(123456) == (False, None)  # expired
+
+
+@pytest.mark.asyncio
+async def test_invalidation():
+    cache = UserCache()
+    await cache.set(123456, user)
+    await cache.set(111111, None)
+
+    await cache.invalidate(uids=[user["uid"]])
+    assert await cache.get(123456) == (False, None)
+
+    await cache.invalidate(tg_chat_ids=[111111, None])
+    assert await cache.get(111111) == (False, None)
+    assert cache.stats()["invalidations"] == 2
+
+
+@pytest.mark.asyncio
+async def test_clear():
+    cache = UserCache()
+    await cache.set(123456, user)
+    await cache.set(111111, None)
+
+    await cache.clear()
+    assert await cache.get(123456) == (False, None)
+    assert await cache.get(111111) == (False, None)
+    assert cache.stats()["local_size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_local_invalidation_by_uid_uses_the_reverse_index():
+    cache = UserCache()
+    await cache.set(123456, user)
+    await cache.set(654321, user)  # the user moved to another chat
+    await cache.set(111111, {**user, "uid": "other@gmail.com"})
+
+    await cache.invalidate(uids=[user["uid"]])
+    assert await cache.get(123456) == (False, None)
+    assert await cache.get(654321) == (False, None)
+    assert await cache.get(111111) == (True, {**user, "uid": "other@gmail.com"})
+
+
+@pytest.mark.asyncio
+async def test_redis_tier_hits_and_misses():
+    redis = DictRedis()
+    cache = UserCache(redis=redis)
+    assert await cache.get(123456) == (False, None)
+    await cache.set(123456, user)
+
+    # another process finds the user in Redis and keeps it locally
+    other = UserCache(redis=redis)
+    assert await other.get(123456) == (True, user)
+    assert await other.get(123456) == (True, user)
+    assert other.stats()["redis_hits"] == 1
+    assert other.stats()["local_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_tier_invalidation():
+    redis = DictRedis()
+    cache = UserCache(redis=redis)
+    await cache.set(123456, user)
+
+    # the Redis tier finds the chat id of the uid
+    other = UserCache(redis=redis)
+    await other.invalidate(uids=[user["uid"]])
+    assert await UserCache(redis=redis).get(123456) == (False, None)
+
+    await cache.set(111111, None)
+    await other.invalidate(tg_chat_ids=[111111])
+    assert await UserCache(redis=redis).get(111111) == (False, None)
+
+    await cache.set(123456, user)
+    await other.clear()
+    assert await UserCache(redis=redis).get(123456) == (False, None)
+    assert redis.values[GENERATION_KEY] == "3"  # clear does not reset the generation
+
+
+@pytest.mark.asyncio
+async def test_stale_fill_is_skipped():
+    redis = DictRedis()
+    cache = UserCache(redis=redis)
+
+    # the user is read from the database, meanwhile it is changed and invalidated
+    generation = await cache.generation()
+    await cache.invalidate(uids=[user["uid"]])
+    await cache.set(123456, user, generation=generation)
+    assert await cache.get(123456) == (False, None)
+    assert await UserCache(redis=redis).get(123456) == (False, None)
+
+    # invalidated by another process
+    generation = await cache.generation()
+    await UserCache(redis=redis).invalidate(tg_chat_ids=[123456])
+    await cache.set(123456, user, generation=generation)
+    assert await UserCache(redis=redis).get(123456) == (False, None)
+
+    generation = await cache.generation()
+    await cache.set(123456, user, generation=generation)
+    assert await UserCache(redis=redis).get(123456) == (True, user)
+
+
+@pytest.mark.asyncio
+async def test_redis_unavailable():
+    cache = UserCache(redis=BrokenRedis())
+    assert await cache.get(123456) == (False, None)
+
+    # the in-process tier keeps working
+    generation = await cache.generation()
+    assert generation == (0, None)
+    await cache.set(123456, user, generation=generation)
+    assert await cache.get(123456) == (True, user)
+
+    await cache.invalidate(uids=[user["uid"]])
+    assert await cache.get(123456) == (False, None)
+    await cache.clear()
@@ -5,11 +5,13 @@ from sqlalchemy.orm.session import sessionmaker
 
 from tests import (
     test_creating,
+    test_migrating,
     test_user,
     test_speech,
     test_role,
     test_user_speech,
     test_token,
+    test_unit_of_work,
     test_dropping
 )
 
@@ -34,6 +36,7 @@ class TestBase:
 
         await test_creating.start(self.session_local)
         await test_dropping.start(self.engine, self.base)
+        await test_migrating.start(self.engine, self.base)
         await test_creating.start(self.session_local)
 
         await test_user.start(self.session_local)
@@ -41,6 +44,7 @@ class TestBase:
         await test_role.start(self.session_local)
         await test_user_speech.start(self.session_local)
         await test_token.start(self.session_local)
+        await test_unit_of_work.start(self.session_local)
 
         # await test_dropping.start(self.engine, self.base)
 
@@ -1,6 +1,9 @@
 # from db_api.delete.phrases import elements as delete_phrases
 
+from sqlalchemy import text
+
 from create_table import update_tables
+from migrations import MIGRATIONS
 
 
 async def start(SessionLocal):
@@ -10,6 +13,17 @@ async def start(SessionLocal):
     async with SessionLocal() as session:
         assert await update_tables() == 0  # no exceptions
 
+        # all migrations are applied and the second start does not apply them again
+        version = await session.scalar(text("select max(version) from schema_version"))
+        assert version == MIGRATIONS[-1].version
+        assert await update_tables() == 0
+        assert await session.scalar(text("select count(*) from schema_version")) == len(MIGRATIONS)
+
+        # phones of users are unique
+        assert await session.scalar(
+            text("select count(*) from pg_indexes where indexname = 'uq__user__phone'")
+        ) == 1
+
         # reset the database
         # assert await delete_phrases(session) == 0
 
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from create_table import upgrade_schema
+from migrations import MIGRATIONS
+
+# tables as the first version of the bot created them: no unique phone, no indexes and
+# no schema_version table
+BASELINE_SCHEMA = [
+    'create table "user" (uid varchar primary key, snp varchar not null, phone varchar not null, '
+    'is_admin boolean not null, tg_chat_id bigint unique)',
+    'create table speech (key varchar primary key, title varchar not null, '
+    'start_time timestamp not null, end_time timestamp not null, venue varchar not null, '
+    'venue_description varchar not null)',
+    'create table role (value varchar primary key)',
+    'create table user_speech (uid_key varchar primary key, '
+    'uid varchar not null references "user" (uid) on update cascade on delete cascade, '
+    'key varchar not null references speech (key) on update cascade on delete cascade, '
+    'role varchar not null references role (value) on update cascade on delete cascade, '
+    'acknowledgment varchar)',
+    'create table token (token varchar primary key, vacant boolean not null)',
+    "insert into token values ('tok', true)",
+]
+
+
+async def create_baseline(engine, base):
+    async with engine.begin() as connection:
+        await connection.run_sync(base.metadata.drop_all)
+        await connection.execute(text('drop table if exists user_speech_duplicate'))
+        for statement in BASELINE_SCHEMA:
+            await connection.execute(text(statement))
+
+
+async def start(engine, base):
+    print('---------------START SCHEMA MIGRATING------------')
+
+    # a baseline database is upgraded to the latest version
+    await create_baseline(engine, base)
+    async with engine.begin() as connection:
+        await connection.execute(text("insert into \"user\" values ('u1', 'snp', '+79031281954', false, null)"))
+        await connection.execute(
+            text("insert into speech values ('s1', 't', :start, :start, 'v', 'vd')"),
+            {'start': datetime(2022, 5, 1, 10)}
+        )
+        await connection.execute(text("insert into role values ('0')"))
+        await connection.execute(text(
+            "insert into user_speech values ('a', 'u1', 's1', '0', null), ('b', 'u1', 's1', '0', null)"
+        ))
+
+    assert await upgrade_schema(engine) == MIGRATIONS[-1].version  # the existing token does not break it
+    assert await upgrade_schema(engine) == MIGRATIONS[-1].version  # the second start changes nothing
+
+    async with engine.connect() as connection:
+        assert await connection.scalar(text('select count(*) from schema_version')) == len(MIGRATIONS)
+        indexes = set((await connection.execute(text('select indexname from pg_indexes'))).scalars())
+        assert {'uq__user__phone', 'uq__user_speech__uid_key', 'uq__speech__title_start_time'} <= indexes
+        # duplicated registrations are moved to the backup table, the earliest one is kept
+        assert list((await connection.execute(text('select uid_key from user_speech'))).scalars()) == ['a']
+        assert list(
+            (await connection.execute(text('select uid_key from user_speech_duplicate'))).scalars()
+        ) == ['b']
+        assert await connection.scalar(text("select count(*) from token where token = 'tok'")) == 1
+
+    # users sharing a phone stop the migration with a clear error and nothing is applied
+    await create_baseline(engine, base)
+    async with engine.begin() as connection:
+        await connection.execute(text(
+            "insert into \"user\" values ('u1', 'snp', '+79031281954', false, null), "
+            "('u2', 'snp', '+79031281954', false, null)"
+        ))
+    try:
+        await upgrade_schema(engine)
+    except Exception as e:
+        assert 'Several users share phones' in str(e)
+    else:
+        assert False
+    async with engine.connect() as connection:
+        assert await connection.scalar(text('select count(*) from schema_version')) == 0
+
+    # leave an empty database for the next tests
+    async with engine.begin() as connection:
+        await connection.run_sync(base.metadata.drop_all)
+        await connection.execute(text('drop table if exists user_speech_duplicate'))
+
+    print('--------------FINISH SCHEMA MIGRATING------------\n')
@@ -95,6 +95,20 @@ async def start(SessionLocal):
         await repository.delete(venue_description=speeches[1]['venue_description'])  # no exceptions
         assert await repository.get_one(venue_description=speeches[1]['venue_description']) is None  # element deleted
 
+        # batches are updated and deleted by key
+        await repository.add(speeches[1])
+        changed = dict(speeches[1], venue='batch venue')
+        await repository.update_many([changed])
+        assert await repository.get_one(key=speeches[1]['key']) == changed
+        await repository.delete_many([speeches[1]['key'], '123'])  # missing keys are skipped
+        assert await repository.get_one(key=speeches[1]['key']) is None
+
+        # records hold the same data as dictionaries
+        records = await repository.get_all(as_records=True)
+        assert sorted(
+            (record._asdict() for record in records), key=lambda speech: speech['key']
+        ) == sorted(await repository.get_all(), key=lambda speech: speech['key'])
+
         # return of modified data
         await repository.delete()
         await repository.add(speeches)
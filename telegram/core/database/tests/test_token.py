@@ -19,6 +19,14 @@ async def start(SessionLocal):
         else:
             assert False
 
+        # a vacant token is used only once
+        await repository.add({'token': 'claimed token', 'vacant': True})
+        assert await repository.claim('claimed token')
+        assert await repository.get_one(token='claimed token', vacant=False) is not None
+        assert not await repository.claim('claimed token')  # already used
+        assert not await repository.claim('123')  # does not exist
+        await repository.delete(token='claimed token')
+
         # updating all data for all parameters does not throw exceptions
         old_token = tokens[1]['token']
         await repository.update()  # empty query throws no exceptions
@@ -0,0 +1,41 @@
+from tests.test_data import users
+
+from repositories.user import UserRepository
+from unit_of_work import UnitOfWork
+
+
+async def start(SessionLocal):
+    print('-------START INTERACTION WITH UNIT OF WORK-------')
+
+    new_user = {'uid': 'unit-of-work', 'snp': 'Unit Of Work', 'phone': '+70000000000', 'is_admin': False}
+
+    # changes of a successful unit are committed once at the end
+    async with UnitOfWork(SessionLocal) as uow:
+        await UserRepository(uow.session).add(new_user)
+        async with SessionLocal() as session:
+            assert await UserRepository(session).get_one(uid=new_user['uid']) is None  # not committed yet
+    async with SessionLocal() as session:
+        assert await UserRepository(session).get_one(uid=new_user['uid']) is not None  # committed
+        await UserRepository(session).delete(uid=new_user['uid'])
+
+    # an error inside the unit discards changes made before it
+    try:
+        async with UnitOfWork(SessionLocal) as uow:
+            repository = UserRepository(uow.session)
+            await repository.add(new_user)
+            await repository.add(users[0])  # already exists
+    except Exception as e:
+        assert type(e) == ValueError
+    else:
+        assert False
+    async with SessionLocal() as session:
+        assert await UserRepository(session).get_one(uid=new_user['uid']) is None  # rolled back
+
+    # explicit rollback discards everything, even changes made after it
+    async with UnitOfWork(SessionLocal) as uow:
+        await uow.rollback()
+        await UserRepository(uow.session).add(new_user)
+    async with SessionLocal() as session:
+        assert await UserRepository(session).get_one(uid=new_user['uid']) is None
+
+    print('-------FINISH INTERACTION WITH UNIT OF WORK------\n')
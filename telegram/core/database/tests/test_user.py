@@ -44,6 +44,12 @@ async def start(SessionLocal):
         await repository.update(tg_chat_id=0, new_uid='1 2')
         assert await repository.get_one(uid='1 2') is not None  # updating by tg_chat_id
 
+        # the previous chat id of a user is not served from the user cache after an update
+        assert await repository.get_one(tg_chat_id=0) is not None  # cached
+        await repository.update(uid='1 2', new_tg_chat_id=1)
+        assert await repository.get_one(tg_chat_id=0) is None
+        assert await repository.get_one(tg_chat_id=1) is not None
+
         assert await repository.get_one(uid=old_uid) is None  # data changes, not new ones are created
         del old_uid
 
@@ -79,6 +85,11 @@ async def start(SessionLocal):
         await repository.delete(tg_chat_id=users[1]['tg_chat_id'])  # no exceptions
         assert await repository.get_one(tg_chat_id=users[1]['tg_chat_id']) is None  # element deleted
 
+        # batches are deleted by uid
+        await repository.add(users[1])
+        await repository.delete_many([users[1]['uid'], '123'])  # missing uids are skipped
+        assert await repository.get_one(uid=users[1]['uid']) is None
+
         # return of modified data
         await repository.delete()
         await repository.add(users)
@@ -1,5 +1,8 @@
+from datetime import datetime, timedelta
 from tests.test_data import user_speeches, speeches, users, roles
 
+from repositories.speech import SpeechRepository
+from repositories.user import UserRepository
 from repositories.user_speech import UserSpeechRepository
 
 
@@ -93,6 +96,72 @@ async def start(SessionLocal):
         await repository.delete(acknowledgment='123')  # no exceptions
         assert await repository.get_one(acknowledgment='123') is None  # element deleted
 
+        await repository.add(user_speeches[-1])
+        await repository.delete_many([user_speeches[-1], {'uid': '123', 'key': '123'}])  # no exceptions
+        assert await repository.get_one(acknowledgment='123') is None  # element deleted
+
+        # schedule of a user is joined with speeches and sorted by start time
+        schedule = await repository.get_schedule(uid=user_speeches[0]['uid'])
+        assert len(schedule) == len(await repository.get_all(uid=user_speeches[0]['uid']))
+        assert [event['start_time'] for event in schedule] == sorted(
+            event['start_time'] for event in schedule
+        )
+        assert all('title' in event and 'role' in event for event in schedule)
+
+        # overlapping speeches are found for a user with one known speech
+        user = await UserRepository(session).add(
+            {'uid': 'overlap@test.com', 'snp': 'overlap', 'phone': '+79990000000'}
+        )
+        start_time = datetime(2030, 1, 1, 10)
+        end_time = start_time + timedelta(hours=1)
+        speech = await SpeechRepository(session).add({
+            'key': 'overlap', 'title': 'overlap', 'start_time': start_time, 'end_time': end_time,
+            'venue': 'overlap', 'venue_description': 'overlap'
+        })
+        await repository.add({'uid': user['uid'], 'key': speech['key'], 'role': roles[0]['value']})
+
+        # a speech overlaps its own interval and any interval crossing it
+        assert await repository.get_overlapping(user['uid'], start_time, end_time) == speech['key']
+        assert await repository.get_overlapping(
+            user['uid'], start_time + timedelta(minutes=30), end_time + timedelta(hours=1)
+        ) == speech['key']
+        # the excluded speech and speeches of other users are not taken into account
+        assert await repository.get_overlapping(
+            user['uid'], start_time, end_time, exclude_key=speech['key']
+        ) is None
+        assert await repository.get_overlapping(user_speeches[0]['uid'], start_time, end_time) is None
+        # intervals are half-open, touching the start or the end of a speech is not an overlap
+        assert await repository.get_overlapping(
+            user['uid'], start_time - timedelta(hours=1), start_time
+        ) is None
+        assert await repository.get_overlapping(
+            user['uid'], end_time, end_time + timedelta(hours=1)
+        ) is None
+
+        await SpeechRepository(session).delete(key=speech['key'])
+        await UserRepository(session).delete(uid=user['uid'])
+
+        # streaming yields the same rows as get_all in batches of at most batch_size
+        streamed = []
+        async for batch in repository.stream(batch_size=2):
+            assert 0 < len(batch) <= 2
+            streamed.extend(batch)
+        assert sorted(streamed, key=lambda row: row['uid_key']) == sorted(
+            await repository.get_all(), key=lambda row: row['uid_key']
+        )
+
+        # pages of responses cover every user_speech once and carry the name of the user
+        responses = []
+        page = await repository.get_responses(limit=2)
+        while page:
+            assert len(page) <= 2 and all('snp' in response for response in page)
+            responses.extend(page)
+            last = page[-1]
+            page = await repository.get_responses(after=(last['key'], last['role'], last['uid']), limit=2)
+        assert sorted(response['uid'] + response['key'] for response in responses) == sorted(
+            row['uid'] + row['key'] for row in await repository.get_all()
+        )
+
         # return of modified data
         user_speeches.pop()
         await repository.delete()
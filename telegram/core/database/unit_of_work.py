@@ -0,0 +1,83 @@
+"""Transaction scope shared by several repositories.
+
+By default every repository method commits its own changes. Inside a unit of work the
+repositories only flush them, and the unit commits or rolls back everything once when the
+``async with`` block ends:
+
+    async with UnitOfWork() as uow:
+        await UserRepository(uow.session).upsert(users)
+        await SpeechRepository(uow.session).add(speeches)
+
+A repository error inside the unit rolls back the whole unit, so changes made afterwards are
+discarded too and the database is never left half-updated.
+"""
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy.ext.asyncio.session import AsyncSession
+
+from .create_table import SessionLocal
+
+# key of the unit of work in the info dictionary of its session
+UNIT_OF_WORK_KEY = "unit_of_work"
+
+
+class UnitOfWork:
+    def __init__(self, session_factory: Callable[[], AsyncSession] = SessionLocal):
+        self._session_factory = session_factory
+        self.session: Optional[AsyncSession] = None
+        self.failed = False
+        self._after_commit: List[Callable[[], Awaitable[None]]] = []
+
+    async def __aenter__(self) -> "UnitOfWork":
+        self.session = self._session_factory()
+        self.session.sync_session.info[UNIT_OF_WORK_KEY] = self
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None and not self.failed:
+                await self.session.commit()
+            else:
+                await self.session.rollback()
+                self._after_commit.clear()
+        finally:
+            self.session.sync_session.info.pop(UNIT_OF_WORK_KEY, None)
+            await self.session.close()
+        for callback in self._after_commit:
+            await callback()
+
+    async def rollback(self) -> None:
+        """Discards all changes of the unit, nothing is committed when the block ends."""
+        self.failed = True
+        await self.session.rollback()
+
+
+def get_unit_of_work(session: AsyncSession) -> Optional[UnitOfWork]:
+    """Returns the unit of work the session belongs to, None outside of a unit."""
+    return session.sync_session.info.get(UNIT_OF_WORK_KEY)
+
+
+async def commit(session: AsyncSession) -> None:
+    """Commits changes of a repository, inside a unit of work they are only flushed."""
+    if get_unit_of_work(session) is None:
+        await session.commit()
+    else:
+        await session.flush()
+
+
+async def rollback(session: AsyncSession) -> None:
+    """Rolls back changes of a repository, inside a unit of work the whole unit fails."""
+    unit_of_work = get_unit_of_work(session)
+    if unit_of_work is None:
+        await session.rollback()
+    else:
+        await unit_of_work.rollback()
+
+
+async def after_commit(session: AsyncSession, callback: Callable[[], Awaitable[None]]) -> None:
+    """Runs the callback right away, inside a unit of work only after the unit is committed."""
+    unit_of_work = get_unit_of_work(session)
+    if unit_of_work is None:
+        await callback()
+    else:
+        unit_of_work._after_commit.append(callback)
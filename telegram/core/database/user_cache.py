@@ -0,0 +1,259 @@
+"""Read-through cache of users looked up by tg_chat_id.
+
+Almost every handler starts with looking up the user who sent the update, so the users are
+cached in two tiers: a small in-process LRU with a short TTL and, if a Redis client is
+attached, a shared Redis tier with a longer one. Unknown tg_chat_ids are cached too, so
+repeated messages of unregistered users do not hit the database either.
+
+UserRepository invalidates both tiers on every write. The in-process tier of other
+processes is not invalidated, its TTL bounds how long they can serve a changed user.
+
+Every invalidation also bumps a generation, locally and in Redis. A lookup that missed the
+cache takes the generation before it queries the database and fills the cache only if the
+generation is still the same, so a user read before a concurrent write is not cached after
+the write has invalidated it.
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from aioredis import Redis, RedisError, WatchError
+from loguru import logger
+
+LOCAL_MAX_SIZE = 10000
+LOCAL_TTL = 30  # seconds
+REDIS_TTL = 5 * 60  # seconds
+REDIS_PREFIX = "user_cache"
+# outside of REDIS_PREFIX, so clear() does not reset the generation
+GENERATION_KEY = "user_cache_generation"
+
+# generation of the in-process tier and of the Redis tier, None if Redis is not used
+Generation = Tuple[int, Optional[str]]
+
+
+class UserCache:
+    def __init__(
+        self,
+        redis: Optional[Redis] = None,
+        max_size: int = LOCAL_MAX_SIZE,
+        local_ttl: float = LOCAL_TTL,
+        redis_ttl: int = REDIS_TTL,
+    ):
+        self.redis = redis
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        # tg_chat_id -> (expiration time, user or None)
+        self._local: "OrderedDict[int, Tuple[float, Optional[dict]]]" = OrderedDict()
+        # uid -> tg_chat_ids of the user's entries in the in-process tier
+        self._local_uids: Dict[str, Set[int]] = {}
+        self._generation = 0
+        self._counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def _tg_chat_id_key(tg_chat_id: int) -> str:
+        return f"{REDIS_PREFIX}:tg_chat_id:{tg_chat_id}"
+
+    @staticmethod
+    def _uid_key(uid: str) -> str:
+        return f"{REDIS_PREFIX}:uid:{uid}"
+
+    def _get_local(self, tg_chat_id: int) -> Tuple[bool, Optional[dict]]:
+        entry = self._local.get(tg_chat_id)
+        if entry is None:
+            return False, None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._drop_local(tg_chat_id)
+            return False, None
+        self._local.move_to_end(tg_chat_id)
+        return True, user
+
+    def _set_local(self, tg_chat_id: int, user: Optional[dict]) -> None:
+        self._drop_local(tg_chat_id)
+        self._local[tg_chat_id] = (time.monotonic() + self.local_ttl, user)
+        if user is not None:
+            self._local_uids.setdefault(user["uid"], set()).add(tg_chat_id)
+        while len(self._local) > self.max_size:
+            self._drop_local(next(iter(self._local)))
+
+    def _drop_local(self, tg_chat_id: int) -> None:
+        entry = self._local.pop(tg_chat_id, None)
+        if entry is None or entry[1] is None:
+            return
+        uid = entry[1]["uid"]
+        tg_chat_ids = self._local_uids.get(uid, set())
+        tg_chat_ids.discard(tg_chat_id)
+        if not tg_chat_ids:
+            self._local_uids.pop(uid, None)
+
+    async def get(self, tg_chat_id: int) -> Tuple[bool, Optional[dict]]:
+        """Looks the user up in the cache.
+
+        :param tg_chat_id: user's tg chat id
+        :type tg_chat_id: int
+
+        :return: whether the user is cached and the user, None if there is no such user
+        :rtype: Tuple[bool, dict | None]
+
+        """
+
+        tg_chat_id = int(tg_chat_id)  # handlers may pass chat ids read from Redis as strings
+        found, user = self._get_local(tg_chat_id)
+        if found:
+            self._counters["local_hits"] += 1
+            return True, None if user is None else dict(user)
+
+        if self.redis is not None:
+            try:
+                value = await self.redis.get(self._tg_chat_id_key(tg_chat_id))
+            except RedisError as exp:
+                logger.warning(f"User cache is unavailable: {exp}")
+                value = None
+            if value is not None:
+                user = json.loads(value)
+                self._set_local(tg_chat_id, user)
+                self._counters["redis_hits"] += 1
+                return True, None if user is None else dict(user)
+
+        self._counters["misses"] += 1
+        return False, None
+
+    async def generation(self) -> Generation:
+        """Returns the current generation, taken before the database is queried on a miss.
+
+        :return: generation of the in-process tier and of the Redis tier
+        :rtype: Tuple[int, str | None]
+
+        """
+
+        if self.redis is None:
+            return self._generation, None
+        try:
+            return self._generation, await self.redis.get(GENERATION_KEY) or "0"
+        except RedisError as exp:
+            logger.warning(f"User cache is unavailable: {exp}")
+            return self._generation, None
+
+    async def set(
+        self, tg_chat_id: int, user: Optional[dict], generation: Optional[Generation] = None
+    ) -> None:
+        """Caches the user found by tg_chat_id, None if there is no such user.
+
+        :param tg_chat_id: user's tg chat id
+        :type tg_chat_id: int
+
+        :param user: dictionary - json format of the user; or nothing
+        :type user: dict | None
+
+        :param generation: generation taken before the user was read, nothing is cached if
+                           the cache was invalidated since then
+        :type generation: Tuple[int, str | None] | None
+
+        :return: nothing
+        :rtype: None
+
+        """
+
+        tg_chat_id = int(tg_chat_id)
+        user = None if user is None else dict(user)
+        if generation is not None and generation[0] != self._generation:
+            return
+        if self.redis is not None and not (generation is not None and generation[1] is None):
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    if generation is not None:
+                        await pipe.watch(GENERATION_KEY)
+                        if (await pipe.get(GENERATION_KEY) or "0") != generation[1]:
+                            return
+                        pipe.multi()
+                    pipe.set(self._tg_chat_id_key(tg_chat_id), json.dumps(user), ex=self.redis_ttl)
+                    if user is not None:
+                        pipe.set(self._uid_key(user["uid"]), tg_chat_id, ex=self.redis_ttl)
+                    await pipe.execute()
+            except WatchError:
+                return  # invalidated by another process meanwhile
+            except RedisError as exp:
+                logger.warning(f"User cache is unavailable: {exp}")
+        self._set_local(tg_chat_id, user)
+
+    async def invalidate(
+        self, uids: Iterable[str] = (), tg_chat_ids: Iterable[Optional[int]] = ()
+    ) -> None:
+        """Removes users from the cache by uid or tg_chat_id.
+
+        :param uids: unique ids of changed users
+        :type uids: Iterable[str]
+
+        :param tg_chat_ids: tg chat ids of changed users, Nones are skipped
+        :type tg_chat_ids: Iterable[int | None]
+
+        :return: nothing
+        :rtype: None
+
+        """
+
+        uids = set(uids)
+        tg_chat_ids = {int(tg_chat_id) for tg_chat_id in tg_chat_ids if tg_chat_id is not None}
+        if not uids and not tg_chat_ids:
+            return
+        self._counters["invalidations"] += 1
+        self._generation += 1
+
+        local_tg_chat_ids = set(tg_chat_ids)
+        for uid in uids:
+            local_tg_chat_ids.update(self._local_uids.get(uid, ()))
+        for tg_chat_id in local_tg_chat_ids:
+            self._drop_local(tg_chat_id)
+
+        if self.redis is None:
+            return
+        try:
+            uid_keys = [self._uid_key(uid) for uid in uids]
+            if uid_keys:
+                tg_chat_ids.update(
+                    int(tg_chat_id)
+                    for tg_chat_id in await self.redis.mget(uid_keys)
+                    if tg_chat_id is not None
+                )
+            keys = uid_keys + [self._tg_chat_id_key(tg_chat_id) for tg_chat_id in tg_chat_ids]
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.incr(GENERATION_KEY)
+            pipe.delete(*keys)
+            await pipe.execute()
+        except RedisError as exp:
+            logger.warning(f"User cache is unavailable: {exp}")
+
+    async def clear(self) -> None:
+        """Drops both tiers, used when all users are removed at once.
+
+        :return: nothing
+        :rtype: None
+
+        """
+
+        self._counters["invalidations"] += 1
+        self._generation += 1
+        self.clear_local()
+        if self.redis is None:
+            return
+        try:
+            await self.redis.incr(GENERATION_KEY)
+            keys = [key async for key in self.redis.scan_iter(match=f"{REDIS_PREFIX}:*")]
+            if keys:
+                await self.redis.delete(*keys)
+        except RedisError as exp:
+            logger.warning(f"User cache is unavailable: {exp}")
+
+    def clear_local(self) -> None:
+        """Drops the in-process tier."""
+        self._local.clear()
+        self._local_uids.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit, miss and invalidation counters and the size of the in-process tier."""
+        return {**self._counters, "local_size": len(self._local)}
+
+
+user_cache = UserCache()
@@ -1,8 +1,9 @@
-from .general_schedule import general_schedule
+from .general_schedule import general_schedule, general_schedule_page
 from .guest_schedule import (
     personal_schedule,
     show_personal_schedule_today,
     show_personal_schedule_tomorrow,
+    show_personal_schedule_day,
     show_personal_schedule_all,
     return_main_menu,
     show_personal_speech,
@@ -24,6 +25,9 @@ def setup(dp: Dispatcher):
     dp.register_message_handler(
         show_personal_schedule_all, regexp="Весь период", state="guest_main"
     )
+    dp.register_message_handler(
+        show_personal_schedule_day, regexp=r"^\d{2}\.\d{2}$", state="guest_main"
+    )
     dp.register_message_handler(show_personal_speech, regexp="Выступления", state="guest_main")
     dp.register_message_handler(
         return_main_menu, regexp="Вернуться в главное меню", state="guest_main"
@@ -38,5 +42,8 @@ def setup(dp: Dispatcher):
     dp.register_callback_query_handler(
         show_event_description, CallBackFilter("show_desc"), state="guest_main"
     )
+    dp.register_callback_query_handler(
+        general_schedule_page, CallBackFilter("schedule"), state="guest_main"
+    )
     dp.register_message_handler(event_status_speaker, state="response_speaker")
     dp.register_message_handler(event_status_guest, state="response_guest")
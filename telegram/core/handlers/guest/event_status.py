@@ -1,58 +1,62 @@
 import asyncio
 from time import sleep
-from typing import Dict, Any
 
 from aiogram import types
 from loguru import logger
 
 from core import config
 from core.utils.reminder import GuestReminder, SpeakerReminder
-from core.database.create_table import SessionLocal
-from core.database.repositories.speech import SpeechRepository
+from core.keyboards.all_keyboards import remove_add_event_from_page
+from sqlalchemy.ext.asyncio.session import AsyncSession
+from core.database.routing import use_primary
+from core.database.speech_catalog import speech_catalog
 from core.database.repositories.user_speech import UserSpeechRepository
 from core.database.repositories.user import UserRepository
 
-
-def _events_intersect(event_1: Dict[str, Any], event_2) -> bool:
-    return (
-        event_1["start_time"] <= event_2["start_time"] <= event_1["end_time"]
-        or event_2["start_time"] <= event_1["start_time"] <= event_2["end_time"]
-    )
+EVENT_NOT_FOUND = "Мероприятие не найдено, возможно, его удалили"
 
 
-async def add_event(callback: types.CallbackQuery):
+async def add_event(callback: types.CallbackQuery, session: AsyncSession):
     """Adds event to personal schedule and make a job for reminder
 
     :param callback: Callback instance
     :type callback: types.CallbackQuery
+    :param session: database session of the update
+    :type session: AsyncSession
     """
-    session = SessionLocal()
-    speech_repo = SpeechRepository(session=session)
+    # the check for an added or intersecting event must see events added a moment ago
+    use_primary(session)
     user_speech_repo = UserSpeechRepository(session)
     user_repo = UserRepository(session)
 
-    event_id = callback.data.split(":")[1]
+    _, event_id, *source = callback.data.split(":")
+    from_page = source == ["page"]  # button of a general schedule page, the page must stay
     logger.debug(f"Guest {callback.from_user} chose to add {event_id}")
 
-    target_event = await speech_repo.get_one(key=event_id)
+    target_event = await speech_catalog.find(event_id, session)
+    if target_event is None:
+        await callback.answer(EVENT_NOT_FOUND, show_alert=True)
+        return
     user = await user_repo.get_one(tg_chat_id=callback.from_user.id)
     us = await user_speech_repo.get_one(user["uid"], key=target_event["key"])
-    user_speech_list = await user_speech_repo.get_all(user["uid"])
     # check added before
     added = us is not None
     if added:
         logger.debug(f"Event {event_id} was added before by guest {callback.from_user}")
-        await callback.message.delete_reply_markup()
-        await callback.message.edit_text(
-            callback.message.text + "\nВы выбрали это мероприятие раньше"
-        )
+        if from_page:
+            await callback.answer("Вы выбрали это мероприятие раньше")
+        else:
+            await callback.message.delete_reply_markup()
+            await callback.message.edit_text(
+                callback.message.text + "\nВы выбрали это мероприятие раньше"
+            )
     else:
-        intersection_event_id = None
-        for user_speech in user_speech_list:
-            event = await speech_repo.get_one(key=user_speech["key"])
-            # check intersections
-            if _events_intersect(event, target_event):
-                intersection_event_id = event["key"]
+        intersection_event_id = await user_speech_repo.get_overlapping(
+            user["uid"],
+            target_event["start_time"],
+            target_event["end_time"],
+            exclude_key=target_event["key"],
+        )
         if intersection_event_id is not None:
             logger.debug(
                 f"Event {event_id} intersects with {intersection_event_id} by guest {callback.from_user}"
@@ -71,38 +75,51 @@ async def add_event(callback: types.CallbackQuery):
             guest_reminder = GuestReminder(chat_id=callback.from_user.id, event=target_event)
             config.sc.add_remind(guest_reminder)
             logger.debug(f"Event {event_id} was successfully added by guest {callback.from_user}")
-            await callback.message.delete_reply_markup()
-            await callback.message.edit_text(callback.message.text + "\nВы выбрали это мероприятие")
-    await session.close()
+            if from_page:
+                await callback.message.edit_reply_markup(
+                    remove_add_event_from_page(callback.message.reply_markup, event_id)
+                )
+                await callback.answer("Вы выбрали это мероприятие")
+            else:
+                await callback.message.delete_reply_markup()
+                await callback.message.edit_text(
+                    callback.message.text + "\nВы выбрали это мероприятие"
+                )
 
 
-async def show_event_description(callback: types.CallbackQuery):
+async def show_event_description(callback: types.CallbackQuery, session: AsyncSession):
     """Sends event description into chat
 
     :param callback: Callback instance
     :type callback: types.CallbackQuery
+    :param session: database session of the update
+    :type session: AsyncSession
     """
-    session = SessionLocal()
-    speech_repo = SpeechRepository(session=session)
-
     event_id = callback.data.split(":")[1]
     logger.debug(f"Sending description of event {event_id} to user {callback.from_user}")
 
-    target_event = await speech_repo.get_one(key=event_id)
+    target_event = await speech_catalog.find(event_id, session)
+    if target_event is None:
+        await callback.answer(EVENT_NOT_FOUND, show_alert=True)
+        return
     await callback.message.answer(target_event['title'] + "\n" + target_event['venue_description'])
 
-    await session.close()
-
 
-async def remove_event_guest(callback: types.CallbackQuery):
+async def remove_event_guest(callback: types.CallbackQuery, session: AsyncSession):
     """Removes guest event to personal schedule and delete a job for reminder
 
     :param callback: Callback instance
     :type callback: types.CallbackQuery
+    :param session: database session of the update
+    :type session: AsyncSession
     """
     event_id = callback.data.split(":")[1]
     logger.debug(f"Guest {callback.from_user} chose to remove {event_id}")
-    session = SessionLocal()
+    target_event = await speech_catalog.find(event_id, session)
+    if target_event is None:  # deleted together with its registrations
+        await callback.answer(EVENT_NOT_FOUND, show_alert=True)
+        await callback.message.delete()
+        return
     user_repo = UserRepository(session)
     user = await user_repo.get_one(tg_chat_id=callback.from_user.id)
     user_speech_repo = UserSpeechRepository(session)
@@ -111,26 +128,29 @@ async def remove_event_guest(callback: types.CallbackQuery):
     logger.debug(
         f"Deleting a job to event {event_id} which was added by guest {callback.from_user}"
     )
-    speech_repo = SpeechRepository(session=session)
-    target_event = await speech_repo.get_one(key=event_id)
     guest_reminder = GuestReminder(chat_id=callback.from_user.id, event=target_event)
     config.sc.remove_remind(guest_reminder)
     logger.debug(
         f"A job to event {event_id} which was added by guest {callback.from_user} was successfully removed"
     )
-    await session.close()
     await callback.message.delete()
 
 
-async def remove_event_speaker(callback: types.CallbackQuery):
+async def remove_event_speaker(callback: types.CallbackQuery, session: AsyncSession):
     """Removes speaker event to personal schedule and delete a job for reminder
 
     :param callback: Callback instance
     :type callback: types.CallbackQuery
+    :param session: database session of the update
+    :type session: AsyncSession
     """
     event_id = callback.data.split(":")[1]
     logger.debug(f"Guest {callback.from_user} chose to remove {event_id}")
-    session = SessionLocal()
+    target_event = await speech_catalog.find(event_id, session)
+    if target_event is None:  # deleted together with its registrations
+        await callback.answer(EVENT_NOT_FOUND, show_alert=True)
+        await callback.message.delete()
+        return
     user_repo = UserRepository(session)
     user = await user_repo.get_one(tg_chat_id=callback.from_user.id)
     user_speech_repo = UserSpeechRepository(session)
@@ -138,8 +158,6 @@ async def remove_event_speaker(callback: types.CallbackQuery):
     logger.debug(
         f"Event {event_id} was successfully deleted by speaker {callback.from_user} from db"
     )
-    speech_repo = SpeechRepository(session=session)
-    target_event = await speech_repo.get_one(key=event_id)
     speaker_reminder = SpeakerReminder(email=user["uid"], event=target_event)
     config.sc.remove_remind(speaker_reminder)
     logger.debug(f"Speakers job to event {event_id}  {callback.from_user} was successfully removed")
@@ -156,5 +174,4 @@ async def remove_event_speaker(callback: types.CallbackQuery):
             else:
                 logger.debug(f"No tg_chat_id for moderator {moderator}")
     
-    await session.close()
     await callback.message.delete()
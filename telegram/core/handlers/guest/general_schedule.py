@@ -1,51 +1,114 @@
+from typing import Optional, Set, Tuple
+
 from aiogram import types
 from aiogram.dispatcher.storage import FSMContext
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.exceptions import MessageNotModified
 from loguru import logger
+from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from core.utils.messages import SCHEDULE_ENTRY_MESSAGE
 from core.keyboards.all_keyboards import all_keyboards
-from core.database.create_table import SessionLocal
-from core.database.repositories.speech import SpeechRepository
+from core.database.speech_catalog import speech_catalog
 from core.database.repositories.user_speech import UserSpeechRepository
 from core.database.repositories.user import UserRepository
 
 
-async def general_schedule(message: types.Message, state: FSMContext):
-    session = SessionLocal()
-    user_speech_repo = UserSpeechRepository(session)
-    user_repo = UserRepository(session)
-    speech_repo = SpeechRepository(session)
+async def render_schedule_page(
+    after_key: Optional[str] = None,
+    before_key: Optional[str] = None,
+    selected: Optional[Set[str]] = None,
+) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    """Forms text and keyboard of one general schedule page
+
+    :param after_key: key of the last event of the previous page
+    :type after_key: str | None
+    :param before_key: key of the first event of the next page
+    :type before_key: str | None
+    :param selected: keys of events the guest is registered for, None for moderators
+    :type selected: Set[str] | None
+    :return: text and keyboard of the page, or Nones if the page is empty
+    :rtype: Tuple[str | None, InlineKeyboardMarkup | None]
+    """
+    page = (await speech_catalog.get()).page(after_key=after_key, before_key=before_key)
+    if not page.speeches:
+        return None, None
+
+    entries = []
+    for number, event in enumerate(page.speeches, start=1):
+        entry = f"{number}. " + SCHEDULE_ENTRY_MESSAGE.format(
+            title=event.title,
+            starts_at=event.start_time.strftime("%d-%m %H:%M"),
+            ends_at=event.end_time.strftime("%d-%m %H:%M"),
+            venue=event.venue,
+        )
+        if selected is not None and event.key in selected:
+            entry += "\n<em>Вы записаны на это мероприятие</em>"
+        entries.append(entry)
+
+    reply_markup = all_keyboards["schedule_page"](
+        page.speeches, page.has_prev, page.has_next, selected
+    )
+    return "\n\n".join(entries), reply_markup
+
+
+async def _selected_keys(session: AsyncSession, tg_chat_id: int) -> Optional[Set[str]]:
+    """Keys of events the guest is registered for, None if the user is unknown"""
+    user = await UserRepository(session).get_one(tg_chat_id=tg_chat_id)
+    if not user:
+        return None
+    user_speech_list = await UserSpeechRepository(session).get_all(user["uid"], as_records=True)
+    return {user_speech.key for user_speech in user_speech_list}
 
+
+async def general_schedule(message: types.Message, state: FSMContext, session: AsyncSession):
     logger.debug("In general schedule for guest")
     await message.answer("Общее расписание:")
 
     # Forming list where user is guest already
-    user = await user_repo.get_one(tg_chat_id=message.from_user.id)
-    if not user:
+    selected = await _selected_keys(session, message.from_user.id)
+    if selected is None:
         await message.answer("Мероприятий нет :(")
         logger.debug(f"Can't find user with {message.from_user.id} tel id")
-        await session.close()
         return
-    user_speech_list = await user_speech_repo.get_all(user["uid"])
-    previous_selected_list = [user_speech["key"] for user_speech in user_speech_list]
-    has_events = False
-    for event in await speech_repo.get_all():
-        has_events = True
-        selected = event["key"] in previous_selected_list
-        msg_text = SCHEDULE_ENTRY_MESSAGE.format(
-            title=event["title"],
-            starts_at=event["start_time"].strftime("%d-%m %H:%M"),
-            ends_at=event["end_time"].strftime("%d-%m %H:%M"),
-            venue=event["venue"],
-        )
-        if selected:
-            msg_text += "\n<em>Вы записаны на это мероприятие</em>"
-        reply_markup = all_keyboards["add_event"](event["key"]) if not selected else all_keyboards['show_desc'](event['key'])
-        await message.answer(
-            msg_text,
-            reply_markup=reply_markup,
-            parse_mode="HTML",
-        )
-    if not has_events:
+    text, reply_markup = await render_schedule_page(selected=selected)
+    if text is None:
         await message.answer("Мероприятий нет :(")
-    await session.close()
+    else:
+        await message.answer(text, reply_markup=reply_markup, parse_mode="HTML")
+
+
+async def general_schedule_page(callback: types.CallbackQuery, session: AsyncSession):
+    """Shows the next or the previous general schedule page in place of the current one
+
+    :param callback: Callback instance
+    :type callback: types.CallbackQuery
+    :param session: database session of the update
+    :type session: AsyncSession
+    """
+    _, direction, event_id = callback.data.split(":", 2)
+    logger.debug(f"Guest {callback.from_user} turns schedule page {direction} from {event_id}")
+    selected = await _selected_keys(session, callback.from_user.id)
+    if selected is None:
+        await callback.answer()
+        return
+    text, reply_markup = await render_schedule_page(
+        after_key=event_id if direction == "next" else None,
+        before_key=event_id if direction == "prev" else None,
+        selected=selected,
+    )
+    await show_schedule_page(callback, text, reply_markup)
+
+
+async def show_schedule_page(
+    callback: types.CallbackQuery, text: Optional[str], reply_markup: Optional[InlineKeyboardMarkup]
+):
+    """Edits the schedule message to show another page"""
+    if text is None:
+        await callback.answer("Расписание изменилось, откройте его заново", show_alert=True)
+        return
+    try:
+        await callback.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    except MessageNotModified:
+        pass
+    await callback.answer()
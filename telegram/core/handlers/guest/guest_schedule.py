@@ -1,17 +1,24 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
+from typing import Tuple
 
 from aiogram import types
 from click import option
 from loguru import logger
 
 from core.utils.messages import SCHEDULE_ENTRY_MESSAGE
-from core.keyboards.all_keyboards import all_keyboards
-from core.database.repositories.speech import SpeechRepository
-from core.database.create_table import SessionLocal
+from core.keyboards.all_keyboards import all_keyboards, DAY_BUTTON_FORMAT
+from sqlalchemy.ext.asyncio.session import AsyncSession
+from core.database.speech_catalog import speech_catalog
 from core.database.repositories.user_speech import UserSpeechRepository
 from core.database.repositories.user import UserRepository
 
 
+def _day_window(day: date) -> Tuple[datetime, datetime]:
+    """Returns start times bounding one day: the start of the day and the start of the next one"""
+    day_start = datetime.combine(day, time.min)
+    return day_start, day_start + timedelta(days=1)
+
+
 async def personal_schedule(message: types.Message):
     """Choosing personal schedule
 
@@ -19,110 +26,110 @@ async def personal_schedule(message: types.Message):
     :type message: types.Message
     """
     logger.debug(f"In personal schedule for guest {message.from_user}")
+    days = (await speech_catalog.get()).days
     await message.answer(
         "Выберите опцию. Для навигации используйте кнопки.",
-        reply_markup=all_keyboards["guest_personal_schedule"](),
+        reply_markup=all_keyboards["guest_personal_schedule"](days),
     )
 
 
-async def show_personal_schedule_today(message: types.Message):
-    """Answers personal schedule for today
+async def _show_personal_schedule_for_day(
+    message: types.Message, session: AsyncSession, day: date, day_name: str
+):
+    """Answers personal schedule for one day, only speeches of this day are read from db
 
     :param message: Message instance
     :type message: types.Message
+    :param session: database session of the update
+    :type session: AsyncSession
+    :param day: day of the schedule
+    :type day: date
+    :param day_name: day in the text of the answers, e.g. "сегодня"
+    :type day_name: str
     """
-    session = SessionLocal()
     user_speech_repo = UserSpeechRepository(session)
     user_repo = UserRepository(session)
-    speech_repo = SpeechRepository(session=session)
 
-    logger.debug(f"In show personal schedule for today for guest {message.from_user}")
-    await message.answer("Расписание на сегодня:")
+    logger.debug(f"In show personal schedule for {day} for guest {message.from_user}")
+    await message.answer(f"Расписание на {day_name}:")
 
     user = await user_repo.get_one(tg_chat_id=message.from_user.id)
     if not user:
-        await message.answer("Мероприятий на сегодня нет :(")
+        await message.answer(f"Мероприятий на {day_name} нет :(")
         logger.debug(f"Can't find user with {message.from_user.id} tel id")
-        await session.close()
         return
-    user_speech_list = await user_speech_repo.get_all(user["uid"], role="0")
+    start_from, start_before = _day_window(day)
     has_events = False
-    for user_speech in user_speech_list:
-        event = await speech_repo.get_one(key=user_speech["key"])
-        if event["start_time"].date() == datetime.today().date():
-            has_events = True
-            msg = SCHEDULE_ENTRY_MESSAGE.format(
-                title=event["title"],
-                starts_at=event["start_time"].strftime("%d-%m %H:%M"),
-                ends_at=event["end_time"].strftime("%d-%m %H:%M"),
-                venue=event["venue"],
-            )
-            await message.answer(
-                msg,
-                reply_markup=all_keyboards["remove_event"](event["key"]),
-                parse_mode="HTML",
-            )
+    for event in await user_speech_repo.get_schedule(
+        user["uid"], role="0", start_from=start_from, start_before=start_before
+    ):
+        has_events = True
+        msg = SCHEDULE_ENTRY_MESSAGE.format(
+            title=event["title"],
+            starts_at=event["start_time"].strftime("%d-%m %H:%M"),
+            ends_at=event["end_time"].strftime("%d-%m %H:%M"),
+            venue=event["venue"],
+        )
+        await message.answer(
+            msg,
+            reply_markup=all_keyboards["remove_event"](event["key"]),
+            parse_mode="HTML",
+        )
     if not has_events:
-        logger.debug(f"User {message.from_user.id} has not events for today")
-        await message.answer("Мероприятий на сегодня нет :(")
+        logger.debug(f"User {message.from_user.id} has not events for {day}")
+        await message.answer(f"Мероприятий на {day_name} нет :(")
+
+
 
-    await session.close()
+async def show_personal_schedule_today(message: types.Message, session: AsyncSession):
+    """Answers personal schedule for today
+
+    :param message: Message instance
+    :type message: types.Message
+    :param session: database session of the update
+    :type session: AsyncSession
+    """
+    await _show_personal_schedule_for_day(message, session, date.today(), "сегодня")
 
 
-async def show_personal_schedule_tomorrow(message: types.Message):
+async def show_personal_schedule_tomorrow(message: types.Message, session: AsyncSession):
     """Answers personal schedule for tomorrow
 
     :param message: Message instance
     :type message: types.Message
+    :param session: database session of the update
+    :type session: AsyncSession
     """
-    session = SessionLocal()
-    user_speech_repo = UserSpeechRepository(session)
-    user_repo = UserRepository(session)
-    speech_repo = SpeechRepository(session=session)
+    tomorrow = date.today() + timedelta(days=1)
+    await _show_personal_schedule_for_day(message, session, tomorrow, "завтра")
 
-    logger.debug(f"In show personal schedule for tomorrow for guest {message.from_user}")
-    await message.answer("Расписание на завтра:")
 
-    user = await user_repo.get_one(tg_chat_id=message.from_user.id)
-    if not user:
-        await message.answer("Мероприятий на завтра нет :(")
-        logger.debug(f"Can't find user with {message.from_user.id} tel id")
-        await session.close()
-        return
-    user_speech_list = await user_speech_repo.get_all(user["uid"], role="0")
-    has_events = False
-    for user_speech in user_speech_list:
-        event = await speech_repo.get_one(key=user_speech["key"])
-        if event["start_time"].date() == datetime.today().date() + timedelta(days=1):
-            has_events = True
-            msg = SCHEDULE_ENTRY_MESSAGE.format(
-                title=event["title"],
-                starts_at=event["start_time"].strftime("%d-%m %H:%M"),
-                ends_at=event["end_time"].strftime("%d-%m %H:%M"),
-                venue=event["venue"],
-            )
-            await message.answer(
-                msg,
-                reply_markup=all_keyboards["remove_event"](event["key"]),
-                parse_mode="HTML",
-            )
-    if not has_events:
-        logger.debug(f"User {message.from_user.id} has not events for tomorrow")
-        await message.answer("Мероприятий на завтра нет :(")
+async def show_personal_schedule_day(message: types.Message, session: AsyncSession):
+    """Answers personal schedule for the day from the day button
 
-    await session.close()
+    :param message: Message instance
+    :type message: types.Message
+    :param session: database session of the update
+    :type session: AsyncSession
+    """
+    days = (await speech_catalog.get()).days
+    for day in days:
+        if day.strftime(DAY_BUTTON_FORMAT) == message.text:
+            await _show_personal_schedule_for_day(message, session, day, message.text)
+            return
+    await message.answer("В этот день мероприятий нет :(")
 
 
-async def show_personal_schedule_all(message: types.Message):
+async def show_personal_schedule_all(message: types.Message, session: AsyncSession):
     """Answers all personal schedule
 
     :param message: Message instance
     :type message: types.Message
+    :param session: database session of the update
+    :type session: AsyncSession
     """
-    session = SessionLocal()
     user_speech_repo = UserSpeechRepository(session)
     user_repo = UserRepository(session)
-    speech_repo = SpeechRepository(session=session)
 
     logger.debug(f"In show all personal schedule for guest {message.from_user}")
     await message.answer("Расписание за весь период:")
@@ -131,11 +138,9 @@ async def show_personal_schedule_all(message: types.Message):
     if not user:
         await message.answer("Мероприятий нет :(")
         logger.debug(f"Can't find user with {message.from_user.id} tel id")
-        await session.close()
-    user_speech_list = await user_speech_repo.get_all(user["uid"], role="0")
+        return
     has_events = False
-    for user_speech in user_speech_list:
-        event = await speech_repo.get_one(key=user_speech["key"])
+    for event in await user_speech_repo.get_schedule(user["uid"], role="0"):
         has_events = True
         msg = SCHEDULE_ENTRY_MESSAGE.format(
             title=event["title"],
@@ -151,19 +156,18 @@ async def show_personal_schedule_all(message: types.Message):
     if not has_events:
         logger.debug(f"User {message.from_user.id} has not events")
         await message.answer("Мероприятий нет :(")
-    await session.close()
 
 
-async def show_personal_speech(message: types.Message):
+async def show_personal_speech(message: types.Message, session: AsyncSession):
     """Answers personal speech schedule
 
     :param message: Message instance
     :type message: types.Message
+    :param session: database session of the update
+    :type session: AsyncSession
     """
-    session = SessionLocal()
     user_speech_repo = UserSpeechRepository(session)
     user_repo = UserRepository(session)
-    speech_repo = SpeechRepository(session=session)
 
     logger.debug(f"In show personal speech schedule for guest {message.from_user}")
     await message.answer("Ваши выступления:")
@@ -172,12 +176,9 @@ async def show_personal_speech(message: types.Message):
     if not user:
         await message.answer("Мероприятий, где вы спикер, нет :(")
         logger.debug(f"Can't find user with {message.from_user.id} tel id")
-        await session.close()
         return
-    user_speech_list = await user_speech_repo.get_all(user["uid"], role="1")
     has_events = False
-    for user_speech in user_speech_list:
-        event = await speech_repo.get_one(key=user_speech["key"])
+    for event in await user_speech_repo.get_schedule(user["uid"], role="1"):
         has_events = True
         msg = SCHEDULE_ENTRY_MESSAGE.format(
             title=event["title"],
@@ -192,7 +193,6 @@ async def show_personal_speech(message: types.Message):
         )
     if not has_events:
         await message.answer("Мероприятий, где вы спикер, нет :(")
-    await session.close()
 
 
 async def return_main_menu(message: types.Message):
@@ -2,7 +2,7 @@
 from aiogram import types
 from loguru import logger
 from aiogram.dispatcher.storage import FSMContext
-from core.database.create_table import SessionLocal
+from sqlalchemy.ext.asyncio.session import AsyncSession
 from core import config
 from core.database.repositories.user_speech import UserSpeechRepository
 from core.utils.reminder import SpeakerReminder
@@ -10,15 +10,16 @@ from core.database.repositories.user_speech import UserSpeechRepository
 from core.database.repositories.user import UserRepository
 
 
-async def event_status_guest(message: types.Message, state: FSMContext):
+async def event_status_guest(message: types.Message, state: FSMContext, session: AsyncSession):
     """Handles result whether guest will go to a speech or not
 
     :param message: Message instance
     :type message: types.Message
     :param state: FSMContext instance
     :type state: FSMContext:
+    :param session: database session of the update
+    :type session: AsyncSession
     """
-    session = SessionLocal()
     user_repo = UserRepository(session)
     user_speech_repo = UserSpeechRepository(session)
 
@@ -45,15 +46,16 @@ async def event_status_guest(message: types.Message, state: FSMContext):
         )
 
 
-async def event_status_speaker(message: types.Message, state: FSMContext):
+async def event_status_speaker(message: types.Message, state: FSMContext, session: AsyncSession):
     """Handles result whether speaker will go to a speech or not
 
     :param message: Message instance
     :type message: types.Message
     :param state: FSMContext instance
     :type state: FSMContext:
+    :param session: database session of the update
+    :type session: AsyncSession
     """
-    session = SessionLocal()
     user_repo = UserRepository(session)
     user = await user_repo.get_one(tg_chat_id=message.from_user.id)
     moderators_list = await user_repo.get_all(is_admin=True)
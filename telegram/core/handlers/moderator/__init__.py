@@ -3,7 +3,7 @@ from aiogram import Dispatcher
 from loguru import logger
 from . import moderator_handlers
 from . import token_handlers
-from .general_schedule import general_schedule
+from .general_schedule import general_schedule, general_schedule_page
 from .show_responses import show_responses
 import re
 
@@ -40,7 +40,7 @@ def setup(dp: Dispatcher):
     dp.register_message_handler(
         moderator_handlers.upload_xls,
         state="ready_upload_xls",
-        regexp=re.compile("(Вернуться назад)|(Стереть все данные)", re.IGNORECASE),
+        regexp=moderator_handlers.UPLOAD_COMMANDS,
     )
     dp.register_message_handler(general_schedule, regexp="Общее расписание", state="moderator_main")
     dp.register_message_handler(show_responses, regexp="Ответы участников", state="moderator_main")
@@ -49,5 +49,8 @@ def setup(dp: Dispatcher):
     dp.register_callback_query_handler(
         show_event_description, CallBackFilter("show_desc"), state="moderator_main"
     )
+    dp.register_callback_query_handler(
+        general_schedule_page, CallBackFilter("schedule"), state="moderator_main"
+    )
 
     logger.debug("End moderator handler dispatcher")
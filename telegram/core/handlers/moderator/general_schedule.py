@@ -2,11 +2,7 @@ from aiogram import types
 from aiogram.dispatcher.storage import FSMContext
 from loguru import logger
 
-from core.utils.messages import SCHEDULE_ENTRY_MESSAGE
-from core.database.create_table import SessionLocal
-from core.database.repositories.speech import SpeechRepository
-
-from core.keyboards.all_keyboards import all_keyboards
+from ..guest.general_schedule import render_schedule_page, show_schedule_page
 
 
 async def general_schedule(message: types.Message, state: FSMContext):
@@ -19,18 +15,23 @@ async def general_schedule(message: types.Message, state: FSMContext):
     """
     logger.debug(f"In general schedule for moderator {message.from_user}")
     await message.answer("Общее расписание:")
-    session = SessionLocal()
-    speech_repo = SpeechRepository(session)
-    has_events = False
-    for event in await speech_repo.get_all():
-        has_events = True
-        msg = SCHEDULE_ENTRY_MESSAGE.format(
-            title=event["title"],
-            starts_at=event["start_time"].strftime("%d-%m %H:%M"),
-            ends_at=event["end_time"].strftime("%d-%m %H:%M"),
-            venue=event["venue"],
-        )
-        await message.answer(msg, parse_mode='HTML', reply_markup=all_keyboards['show_desc'](event['key']))
-    if not has_events:
+    text, reply_markup = await render_schedule_page()
+    if text is None:
         await message.answer("Мероприятий нет :(")
-    await session.close()
+    else:
+        await message.answer(text, parse_mode="HTML", reply_markup=reply_markup)
+
+
+async def general_schedule_page(callback: types.CallbackQuery):
+    """Shows the next or the previous general schedule page in place of the current one
+
+    :param callback: Callback instance
+    :type callback: types.CallbackQuery
+    """
+    _, direction, event_id = callback.data.split(":", 2)
+    logger.debug(f"Moderator {callback.from_user} turns schedule page {direction} from {event_id}")
+    text, reply_markup = await render_schedule_page(
+        after_key=event_id if direction == "next" else None,
+        before_key=event_id if direction == "prev" else None,
+    )
+    await show_schedule_page(callback, text, reply_markup)
@@ -1,3 +1,5 @@
+import io
+import re
 from ast import fix_missing_locations
 from tkinter.tix import Tree
 from pydantic import SecretStr
@@ -5,15 +7,26 @@ from loguru import logger
 from aiogram import types
 from aiogram.dispatcher.storage import FSMContext
 
-from core.database.create_table import SessionLocal
-from core.database.repositories.speech import SpeechRepository
+from sqlalchemy.ext.asyncio.session import AsyncSession
+from core.database.routing import use_primary
+from core.database.speech_catalog import speech_catalog
 from core.utils.reminder import ModeratorReminder, SpeakerReminder
 from core import config
 from core.utils.utils import clear_directory, reset_base_state
-from core.utils.parser_csv import parse_xlsx, delete_all_data_in_tables
+from core.utils.parser_csv import (
+    delete_all_data_in_tables,
+    format_report,
+    format_summary,
+    parse_xlsx,
+)
 from core.keyboards.all_keyboards import all_keyboards
 from core.database.repositories.user_speech import UserSpeechRepository
 
+GO_BACK = "Вернуться назад"
+DELETE_ALL_DATA = "Удалить все данные"
+# texts upload_xls answers besides a document
+UPLOAD_COMMANDS = re.compile(f"^({GO_BACK}|{DELETE_ALL_DATA})$")
+
 
 async def prepare_upload_xls(message: types.Message, state: FSMContext):
     """Set appropriate state"""
@@ -22,13 +35,13 @@ async def prepare_upload_xls(message: types.Message, state: FSMContext):
     await message.answer("Загрузите сюда файл .xls", reply_markup=all_keyboards["back_button"]())
 
 
-async def upload_xls(message: types.Message, state: FSMContext):
+async def upload_xls(message: types.Message, state: FSMContext, session: AsyncSession):
     logger.debug("Upload csv")
-    if message.text == "Вернуться назад":
+    if message.text == GO_BACK:
         await reset_base_state(message, state)
         await message.answer("Вы вернулись назад")
         return
-    elif message.text == "Удалить все данные":
+    elif message.text == DELETE_ALL_DATA:
         await delete_all_data_in_tables()
         await message.answer("Вы удалили все данные из таблиц")
         return
@@ -43,15 +56,15 @@ async def upload_xls(message: types.Message, state: FSMContext):
     )
     if dest:  # ????????????????????? ваще хз чо будет здесь елси всё крашнется
         await message.answer("Подождите пожалуйста, это может занять некоторое время")
-        error = await parse_xlsx(dest_dir + "/" + file_name, message.from_user.id)
-        if error == None:
+        errors = await parse_xlsx(dest_dir + "/" + file_name, message.from_user.id)
+        if not errors:
             await message.answer("Файл успешно загружен")
             await reset_base_state(message, state)
             # set reminder to moderator
             logger.debug(f"Setting reminds for moderator {message.from_user}")
-            session = SessionLocal()
-            speech_repo = SpeechRepository(session)
-            event_list = await speech_repo.get_all()
+            use_primary(session)  # speakers have just been imported
+            speeches = await speech_catalog.get()
+            event_list = [speech._asdict() for speech in speeches.speeches]
             if event_list:
                 for event in event_list:
                     reminder = ModeratorReminder(event)
@@ -61,17 +74,28 @@ async def upload_xls(message: types.Message, state: FSMContext):
                 logger.debug(f"Reminds for moderator {message.from_user} don't set")
             logger.debug(f"Setting reminds for speakers {message.from_user}")
             user_speech_repo = UserSpeechRepository(session)
-            user_speech_list = await user_speech_repo.get_all(role="1")
-            if user_speech_list:
+            has_speakers = False
+            async for user_speech_list in user_speech_repo.stream(role="1"):
                 for user_speech in user_speech_list:
-                    event = await speech_repo.get_one(key=user_speech["key"])
+                    has_speakers = True
+                    event = speeches.get(user_speech["key"])
+                    if event is None:  # deleted by a later import
+                        logger.warning(f"No speech {user_speech['key']} for a speaker reminder")
+                        continue
                     speaker_reminder = SpeakerReminder(user_speech["uid"], event)
                     config.sc.add_remind(speaker_reminder)
+            if has_speakers:
                 logger.debug(f"Reminds for speaker {message.from_user} set successfully")
             else:
                 logger.debug(f"Reminds for speaker {message.from_user} don't set")
+        elif len(errors) > 1:  # report of several bad rows
+            report = types.InputFile(
+                io.BytesIO(format_report(errors).encode()), filename="errors.txt"
+            )
+            await message.answer_document(report, caption=format_summary(errors))
+            return
         else:
-            await message.answer(error)
+            await message.answer(errors[0])
             return
     else:
         await message.answer("Ошибка при загрузке, свяжитесь с раззработчиками")
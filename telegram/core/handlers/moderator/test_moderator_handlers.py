@@ -0,0 +1,25 @@
+import pytest
+from unittest.mock import AsyncMock
+
+from . import moderator_handlers
+from .moderator_handlers import DELETE_ALL_DATA, GO_BACK, UPLOAD_COMMANDS, upload_xls
+
+
+def test_upload_commands_are_routed():
+    assert UPLOAD_COMMANDS.match(DELETE_ALL_DATA)
+    assert UPLOAD_COMMANDS.match(GO_BACK)
+    assert not UPLOAD_COMMANDS.match("Стереть все данные")
+
+
+@pytest.mark.asyncio
+async def test_delete_all_data(monkeypatch):
+    delete_all_data_in_tables = AsyncMock()
+    monkeypatch.setattr(
+        moderator_handlers, "delete_all_data_in_tables", delete_all_data_in_tables
+    )
+    message = AsyncMock(text=DELETE_ALL_DATA)
+
+    await upload_xls(message, AsyncMock(), AsyncMock())
+
+    delete_all_data_in_tables.assert_called_once_with()
+    message.answer.assert_called_with("Вы удалили все данные из таблиц")
@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, call
 from .token_handlers import (
     start_enter_token,
     use_token,
@@ -8,8 +8,12 @@ from .token_handlers import (
     enter_phone_for_token,
 )
 from core.keyboards.all_keyboards import all_keyboards
-from core.database.repositories import user
-from core.database.create_table import SessionLocal
+from core.database.repositories import token, user
+
+
+async def restore_test_token(session):
+    """The tests below use the token, it is made vacant again for the next ones"""
+    await token.TokenRepository(session=session).update(token="test_token", new_vacant=True)
 
 
 @pytest.mark.asyncio
@@ -27,7 +31,7 @@ async def test_start_enter_token():
 
 
 @pytest.mark.asyncio
-async def test_use_correct_token(use_test_token):
+async def test_use_correct_token(use_test_token, session):
     message_correct = "Ваш токен верный, теперь введите вашу почту"
     state_correct = "enter_email_for_token"
     correct_token = "test_token"
@@ -35,14 +39,18 @@ async def test_use_correct_token(use_test_token):
     message = AsyncMock(text=correct_token)
     state = AsyncMock()
 
-    await use_token(message, state)
+    await use_token(message, state, session)
 
     message.answer.assert_called_with(message_correct)
     state.set_state.assert_called_with(state_correct)
+    state.set_data.assert_called_with({"token": correct_token})
+    # the token is used only at the end of the registration
+    tr = token.TokenRepository(session=session)
+    assert await tr.get_one(token=correct_token, vacant=True) is not None
 
 
 @pytest.mark.asyncio
-async def test_use_incorrect_token(use_test_guest, use_test_token):
+async def test_use_incorrect_token(use_test_guest, use_test_token, session):
     # specially acces on behalf simple user
     # so we have to be returned to the main menu
     message_correct = "Возврат в главное меню"
@@ -54,14 +62,14 @@ async def test_use_incorrect_token(use_test_guest, use_test_token):
     message = AsyncMock(text=incorrect_token, from_user=AsyncMock(id=test_user_id))
     state = AsyncMock()
 
-    await use_token(message, state)
+    await use_token(message, state, session)
 
     message.answer.assert_called_with(text=message_correct, reply_markup=kb_correct)
     state.set_state.assert_called_with(state_correct)
 
 
 @pytest.mark.asyncio
-async def test_bad_email_for_token(use_test_guest):
+async def test_bad_email_for_token(use_test_guest, session):
     # specially acces on behalf simple user
     # so we have to be returned to the main menu
     message_correct = "Некорректный email. Введите его ещё раз"
@@ -70,13 +78,13 @@ async def test_bad_email_for_token(use_test_guest):
     message = AsyncMock(text=existing_email)
     state = AsyncMock()
 
-    await enter_email_for_token(message, state)
+    await enter_email_for_token(message, state, session)
 
     message.answer.assert_called_with(message_correct)
 
 
 @pytest.mark.asyncio
-async def test_enter_existing_email_for_token(use_test_guest):
+async def test_enter_existing_email_for_token(use_test_guest, use_test_token, session):
     # specially acces on behalf simple user
     # so we have to be returned to the main menu
     message_correct = "Вот ваше меню"
@@ -87,14 +95,22 @@ async def test_enter_existing_email_for_token(use_test_guest):
     message = AsyncMock(text=existing_email)
     state = AsyncMock()
 
-    await enter_email_for_token(message, state)
+    async def get_data(default):
+        return {"token": "test_token"}
+
+    state.get_data = get_data
+
+    await enter_email_for_token(message, state, session)
 
     message.answer.assert_called_with(message_correct, reply_markup=kb_correct)
     state.set_state.assert_called_with(state_correct)
+    tr = token.TokenRepository(session=session)
+    assert await tr.get_one(token="test_token", vacant=False) is not None
+    await restore_test_token(session)
 
 
 @pytest.mark.asyncio
-async def test_enter_new_emain_for_token():
+async def test_enter_new_emain_for_token(session):
     email = "newnewemail@gmail.com"
     message_correct = "Ваша почта не была найдена в базе. Продолжите создание аккаунта. Введите ФИО"
     state_correct = "enter_snp_for_token"
@@ -102,11 +118,16 @@ async def test_enter_new_emain_for_token():
 
     message = AsyncMock(text=email)
     state = AsyncMock()
-    await enter_email_for_token(message, state)
+
+    async def get_data(default):
+        return {"token": "test_token"}
+
+    state.get_data = get_data
+    await enter_email_for_token(message, state, session)
 
     message.answer.assert_called_with(message_correct)
     state.set_state.assert_called_with(state_correct)
-    state.set_data.assert_called_with(data_correct)
+    state.update_data.assert_called_with(**data_correct)
 
 
 @pytest.mark.asyncio
@@ -131,7 +152,7 @@ async def test_enter_snp_for_token():
 
 
 @pytest.mark.asyncio
-async def test_enter_phone_for_token():
+async def test_enter_phone_for_token(use_test_token, session):
     # email and snp from prev test
     email = "newnewemail@gmail.com"
     snp = "mysnp"
@@ -145,17 +166,67 @@ async def test_enter_phone_for_token():
     state = AsyncMock()
 
     async def get_data(default):
-        return {"email": email, "snp": snp}
+        return {"token": "test_token", "email": email, "snp": snp}
 
     state.get_data = get_data
 
-    await enter_phone_for_token(message, state)
+    await enter_phone_for_token(message, state, session)
     message.answer.assert_called_with(message_correct, reply_markup=kb_correct)
     state.set_state_assert_called_with(state_correct)
 
-    ur = user.UserRepository(session=SessionLocal())
+    ur = user.UserRepository(session=session)
     assert (
         await ur.get_one(uid=email, snp=snp, phone=phone, tg_chat_id=tg_chat_id, is_admin=True)
         is not None
     )
-    ur.session.close()
+    tr = token.TokenRepository(session=session)
+    assert await tr.get_one(token="test_token", vacant=False) is not None
+    await restore_test_token(session)
+
+
+@pytest.mark.asyncio
+async def test_enter_taken_phone_for_token(use_test_guest, use_test_token, session):
+    # the phone of the test guest, the user is not added and the token stays vacant
+    email = "takenphone@gmail.com"
+    phone = "+79031281954"
+    message_correct = (
+        "Такой номер телефона уже зарегистрирован. Пройдите весь этап регистрации заново, пожалуйста"
+    )
+
+    message = AsyncMock(text=phone, from_user=AsyncMock(id=567890))
+    state = AsyncMock()
+
+    async def get_data(default):
+        return {"token": "test_token", "email": email, "snp": "mysnp"}
+
+    state.get_data = get_data
+
+    await enter_phone_for_token(message, state, session)
+    assert call(message_correct) in message.answer.call_args_list
+
+    assert await user.UserRepository(session=session).get_one(uid=email) is None
+    tr = token.TokenRepository(session=session)
+    assert await tr.get_one(token="test_token", vacant=True) is not None
+
+
+@pytest.mark.asyncio
+async def test_enter_phone_for_used_token(use_test_token, session):
+    email = "usedtoken@gmail.com"
+    message_correct = "Токен уже использован. Вы вернетесь в базовое меню"
+
+    tr = token.TokenRepository(session=session)
+    await tr.update(token="test_token", new_vacant=False)
+
+    message = AsyncMock(text="+79057342899", from_user=AsyncMock(id=678901))
+    state = AsyncMock()
+
+    async def get_data(default):
+        return {"token": "test_token", "email": email, "snp": "mysnp"}
+
+    state.get_data = get_data
+
+    await enter_phone_for_token(message, state, session)
+    assert call(message_correct) in message.answer.call_args_list
+
+    assert await user.UserRepository(session=session).get_one(uid=email) is None
+    await restore_test_token(session)
@@ -1,49 +1,90 @@
 from aiogram import types
 from aiogram.dispatcher.storage import FSMContext
+from sqlalchemy.ext.asyncio.session import AsyncSession
 from core.database.repositories import token, user
-from core.database.create_table import SessionLocal
+from core.database.unit_of_work import UnitOfWork
 from core.utils.utils import reset_base_state
 from core.keyboards.all_keyboards import all_keyboards
 from validate_email import validate_email
 from loguru import logger
 
 
+async def _claim_token(session: AsyncSession, user_token: str, change) -> bool:
+    """Uses the token and changes the user in one transaction.
+
+    If the token is no longer vacant nothing is changed and False is returned. If the change
+    fails its error is raised and the token stays vacant.
+    """
+    async with UnitOfWork(lambda: session) as uow:
+        if not await token.TokenRepository(session=uow.session).claim(token=user_token):
+            await uow.rollback()
+            return False
+        await change(user.UserRepository(session=uow.session))
+    return True
+
+
+async def _token_is_used(message: types.Message, state: FSMContext):
+    await message.answer("Токен уже использован. Вы вернетесь в базовое меню")
+    await reset_base_state(message, state)
+
+
 async def start_enter_token(message: types.Message, state: FSMContext):
     logger.debug(f"User want to upgrade to admin")
     await state.set_state("enter_token")
     await message.answer("Введите токен")
 
 
-async def use_token(message: types.Message, state: FSMContext):
+async def use_token(message: types.Message, state: FSMContext, session: AsyncSession):
     user_token = message.text.rstrip().lstrip().lower()
     logger.debug(f"Get token, start check it")
     logger.debug(f"Token {user_token}")
 
-    tr = token.TokenRepository(session=SessionLocal())
+    tr = token.TokenRepository(session=session)
 
+    # the token is used only when the account is ready, so an abandoned dialog does not burn it
     if await tr.get_one(token=user_token, vacant=True):
+        await state.set_data({"token": user_token})
         await state.set_state("enter_email_for_token")
-        # await tr.update(token=message.text, new_vacant=False)
         await message.answer("Ваш токен верный, теперь введите вашу почту")
     else:
         await message.answer("Неправильный токен. Вы вернетесь в базовое меню")
         await reset_base_state(message, state)
-    await tr.session.close()
 
 
-async def enter_email_for_token(message: types.Message, state: FSMContext):
+async def enter_email_for_token(message: types.Message, state: FSMContext, session: AsyncSession):
     email = message.text.rstrip().lstrip().lower()
     if not validate_email(email_address=email, check_smtp=False, check_dns=False):
         await message.answer("Некорректный email. Введите его ещё раз")
         return
     logger.debug(f"Get {email=}, try update")
 
-    ur = user.UserRepository(session=SessionLocal())
+    user_not_saved_data = await state.get_data(default=None)
+    if not user_not_saved_data:
+        await message.answer("Произошла ошибка при добавлении")
+        await reset_base_state(message, state)
+        logger.error("Error while getting user info from state stroage")
+        return
+
+    ur = user.UserRepository(session=session)
     if await ur.get_one(uid=email):  # if it is existing user
+
+        async def promote(ur: user.UserRepository):
+            await ur.update(uid=email, new_is_admin=True, new_tg_chat_id=message.from_user.id)
+
+        try:
+            claimed = await _claim_token(session, user_not_saved_data.get("token", ""), promote)
+        except ValueError as exp:
+            logger.error(exp)
+            await message.answer("Произошла ошибка при добавлении")
+            await reset_base_state(message, state)
+            return
+        if not claimed:
+            await _token_is_used(message, state)
+            return
         await message.answer(
             "Ваша почта найдена в базе данных. Ваш аккаунт получил права модератора"
         )
-        await ur.update(uid=message.text, new_is_admin=True, new_tg_chat_id=message.from_user.id)
+        await state.reset_data()
         await state.set_state("moderator_main")
         await message.answer("Вот ваше меню", reply_markup=all_keyboards["moderator_menu"]())
     else:  # if db is empty or it is false user
@@ -51,9 +92,7 @@ async def enter_email_for_token(message: types.Message, state: FSMContext):
             "Ваша почта не была найдена в базе. Продолжите создание аккаунта. Введите ФИО"
         )
         await state.set_state("enter_snp_for_token")
-        await state.set_data({"email": email})
-
-    await ur.session.close()
+        await state.update_data(email=email)
 
 
 async def enter_snp_for_token(message: types.Message, state: FSMContext):
@@ -76,7 +115,7 @@ async def enter_snp_for_token(message: types.Message, state: FSMContext):
     await message.answer("Введите ваш телефон")
 
 
-async def enter_phone_for_token(message: types.Message, state: FSMContext):
+async def enter_phone_for_token(message: types.Message, state: FSMContext, session: AsyncSession):
     phone = message.text.rstrip().lstrip().lower()
     logger.debug(f"Get {phone=}")
 
@@ -89,8 +128,7 @@ async def enter_phone_for_token(message: types.Message, state: FSMContext):
         logger.error("Error while getting user info from state stroage")
         return
 
-    ur = user.UserRepository(session=SessionLocal())
-    try:
+    async def add(ur: user.UserRepository):
         await ur.add(
             {
                 "uid": user_not_saved_data["email"],
@@ -100,6 +138,10 @@ async def enter_phone_for_token(message: types.Message, state: FSMContext):
                 "tg_chat_id": message.from_user.id,
             }
         )
+
+    ur = user.UserRepository(session=session)
+    try:
+        claimed = await _claim_token(session, user_not_saved_data.get("token", ""), add)
     except Exception as exp:
         logger.error(exp)
         if await ur.get_one(phone=phone):
@@ -111,12 +153,13 @@ async def enter_phone_for_token(message: types.Message, state: FSMContext):
         await message.answer(
             "Произошла ошибка при добавлении в базу данных. Пройдите весь этап регистрации заново, пожалуйста"
         )
-        await ur.session.close()
+        return
+    if not claimed:
+        await _token_is_used(message, state)
         return
 
     await state.reset_data()
     await state.set_state("moderator_main")
-    await ur.session.close()
     await message.answer(
         "Вы получили права модераторa", reply_markup=all_keyboards["moderator_menu"]()
     )
@@ -1,12 +1,12 @@
 from aiogram import types
 from aiogram.dispatcher.storage import FSMContext
 from aiogram.types.reply_keyboard import ReplyKeyboardRemove
+from sqlalchemy.ext.asyncio.session import AsyncSession
 from validate_email import validate_email
 from loguru import logger
 
 from core.keyboards.all_keyboards import all_keyboards
 from core.database.repositories import user
-from core.database.create_table import SessionLocal
 from core.email_verificator import email_verificator
 
 
@@ -15,11 +15,11 @@ async def ask_email(message: types.Message, state: FSMContext):
     await state.set_state("need_enter_email")
 
 
-async def check_email(message: types.Message, state: FSMContext):
+async def check_email(message: types.Message, state: FSMContext, session: AsyncSession):
     """Asks email and if email exist assign special state according to its role. Then updates db with tg_chat_id"""
 
     logger.info(f"Receive message from tg {message.text}")
-    ur = user.UserRepository(session=SessionLocal())
+    ur = user.UserRepository(session=session)
 
     email = message.text.rstrip().lstrip().lower()
     if not validate_email(email_address=email, check_smtp=False, check_dns=False):
@@ -33,7 +33,6 @@ async def check_email(message: types.Message, state: FSMContext):
     if not user_:
         logger.info(f"Unknown email {email}")
         await message.answer("Вашего email нет в базе данных. Попробуйте ещё раз")
-        await ur.session.close()
         return
 
     if user_["tg_chat_id"] != message.from_user.id:
@@ -47,7 +46,6 @@ async def check_email(message: types.Message, state: FSMContext):
             "Мы отправили на данную почту сообщение. Пройдите, пожалуйста, по ссылке в нём, чтобы "
             "подтвердить, что эта почта принадлежит вам. После подтверждения бот вам снова напишет"
         )
-        await ur.session.close()
         return
 
     if user_["is_admin"]:
@@ -75,10 +73,8 @@ async def check_email(message: types.Message, state: FSMContext):
             logger.info(f"Unknown role f{email}")
             await message.answer("Неправильный email, чтобы войти попробуйте ввести его ещё раз")
 
-    await ur.session.close()
 
-
-async def commands(message: types.Message, state: FSMContext):
+async def commands(message: types.Message, state: FSMContext, session: AsyncSession):
     match message.text[1:]:  # escape forwarding slash
         case "start":
             await message.answer(
@@ -93,7 +89,7 @@ async def commands(message: types.Message, state: FSMContext):
             await state.reset_data()
             await state.reset_state()
         case "menu":
-            ur = user.UserRepository(session=SessionLocal())
+            ur = user.UserRepository(session=session)
             _user = await ur.get_one(tg_chat_id=message.from_user.id)
             if not _user:
                 await message.answer("Для начала работы введите свою почту")
@@ -104,7 +100,6 @@ async def commands(message: types.Message, state: FSMContext):
             else:
                 await message.answer("Показ меню", reply_markup=all_keyboards["guest_menu"]())
                 await state.set_state("guest_main")
-            await ur.session.close()
         case "help":
             await message.answer(
                 "Страничка помощи:\n\
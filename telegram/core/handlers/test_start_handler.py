@@ -22,31 +22,31 @@ async def test_ask_email_handler():
 
 
 @pytest.mark.asyncio
-async def test_check_non_validating_email():
+async def test_check_non_validating_email(session):
     # мыло, которое не валидируется
     message_answer_correct = "Ваш email не прошёл валидацию. Пожалуйста, попробуйте ещё раз или свяжитесь с администратором"
     message_mock = AsyncMock(text="NOT EMAIL")
     state_mock = AsyncMock(text="")
 
-    await check_email(message=message_mock, state=state_mock)
+    await check_email(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_answer_correct)
 
 
 @pytest.mark.asyncio
-async def test_check_non_existing_email(use_test_guest):
+async def test_check_non_existing_email(use_test_guest, session):
     # мыло, которого пока нет в базе
     message_answer_correct = "Вашего email нет в базе данных. Попробуйте ещё раз"
     message_mock = AsyncMock(text="testuser0@gmail.com")
     state_mock = AsyncMock(text="")
 
-    await check_email(message=message_mock, state=state_mock)
+    await check_email(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_answer_correct)
 
 
 @pytest.mark.asyncio
-async def test_existing_guest_entrance(use_test_guest):
+async def test_existing_guest_entrance(use_test_guest, session):
     # перелогиненый гость, который гость
     message_answer_correct = "Ваша почта подтверждена. Для навигации используйте кнопки в меню"
     answer_reply_markup = all_keyboards["guest_menu"]()
@@ -55,14 +55,14 @@ async def test_existing_guest_entrance(use_test_guest):
     message_mock = AsyncMock(text="testuser1@gmail.com", from_user=AsyncMock(id=123456))
     state_mock = AsyncMock(text="")
 
-    await check_email(message=message_mock, state=state_mock)
+    await check_email(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_answer_correct, reply_markup=answer_reply_markup)
     state_mock.set_state.assert_called_with(state_correct)
 
 
 @pytest.mark.asyncio
-async def test_existing_admin_entrance(use_test_admin):
+async def test_existing_admin_entrance(use_test_admin, session):
     # перелогинение админа
     message_answer_correct = "Ваша почта подтверждена. Для навигации используйте кнопки в меню"
     answer_reply_markup = all_keyboards["moderator_menu"]()
@@ -71,14 +71,14 @@ async def test_existing_admin_entrance(use_test_admin):
     message_mock = AsyncMock(text="testadmin1@gmail.com", from_user=AsyncMock(id=654321))
     state_mock = AsyncMock(text="")
 
-    await check_email(message=message_mock, state=state_mock)
+    await check_email(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_answer_correct, reply_markup=answer_reply_markup)
     state_mock.set_state.assert_called_with(state_correct)
 
 
 @pytest.mark.asyncio
-async def test_login_from_old_device_to_new_profile(use_test_guest):
+async def test_login_from_old_device_to_new_profile(use_test_guest, session):
     #
     message_answer_correct = (
         "Ваш телеграм id не найден. Вы либо зашли впервые, либо зашли с другого аккаунта. "
@@ -89,19 +89,19 @@ async def test_login_from_old_device_to_new_profile(use_test_guest):
     message_mock = AsyncMock(text="testuser1@gmail.com", from_user=AsyncMock(id=100000))  # wrong id
     state_mock = AsyncMock(text="")
 
-    await check_email(message=message_mock, state=state_mock)
+    await check_email(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_answer_correct)
 
 
 @pytest.mark.asyncio
-async def test_start_stop_hekp_commands():
+async def test_start_stop_hekp_commands(session):
     # /start
     message_answer_correct = "Для того, чтобы войти, введите email"
     state_correct = "need_enter_email"
     message_mock = AsyncMock(text="/start")
     state_mock = AsyncMock()
-    await commands(message=message_mock, state=state_mock)
+    await commands(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(
         message_answer_correct, reply_markup=ReplyKeyboardRemove()
@@ -112,7 +112,7 @@ async def test_start_stop_hekp_commands():
     message_answer_correct = "Вы отключились от бота. Зайдите заново с помощью команды /start"
     message_mock = AsyncMock(text="/stop")
     state_mock = AsyncMock()
-    await commands(message=message_mock, state=state_mock)
+    await commands(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(
         message_answer_correct, reply_markup=ReplyKeyboardRemove()
@@ -129,12 +129,12 @@ async def test_start_stop_hekp_commands():
 
     message_mock = AsyncMock(text="/help")
     state_mock = AsyncMock()
-    await commands(message=message_mock, state=state_mock)
+    await commands(message=message_mock, state=state_mock, session=session)
     message_mock.answer.assert_called_with(message_answer_correct)
 
 
 @pytest.mark.asyncio
-async def test_menu_command(use_test_guest, use_test_admin):
+async def test_menu_command(use_test_guest, use_test_admin, session):
     # guest_menu
     message_correct = "Показ меню"
     state_correct = "guest_main"
@@ -143,7 +143,7 @@ async def test_menu_command(use_test_guest, use_test_admin):
     message_mock = AsyncMock(text="/menu", from_user=AsyncMock(id=123456))
     state_mock = AsyncMock()
 
-    await commands(message=message_mock, state=state_mock)
+    await commands(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_correct, reply_markup=rp_correct)
     state_mock.set_state.assert_called_with(state_correct)
@@ -156,7 +156,7 @@ async def test_menu_command(use_test_guest, use_test_admin):
     message_mock = AsyncMock(text="/menu", from_user=AsyncMock(id=654321))
     state_mock = AsyncMock()
 
-    await commands(message=message_mock, state=state_mock)
+    await commands(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_correct, reply_markup=rp_correct)
     state_mock.set_state.assert_called_with(state_correct)
@@ -168,7 +168,7 @@ async def test_menu_command(use_test_guest, use_test_admin):
     message_mock = AsyncMock(text="/menu", from_user=AsyncMock(id=100000))
     state_mock = AsyncMock()
 
-    await commands(message=message_mock, state=state_mock)
+    await commands(message=message_mock, state=state_mock, session=session)
 
     message_mock.answer.assert_called_with(message_correct)
     state_mock.set_state.assert_called_with(state_correct)
@@ -1,3 +1,6 @@
+from datetime import date
+from typing import Optional, Sequence, Set
+
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -7,6 +10,9 @@ from aiogram.types import (
 
 all_keyboards = {}
 
+# text of a day button in the personal schedule keyboard
+DAY_BUTTON_FORMAT = "%d.%m"
+
 # I've used functions because lately info in buttons and their number may differ beacuse
 # of different number of days in Conference, so they will have to be dinamically configured
 def kb_guest_menu():
@@ -18,7 +24,7 @@ def kb_guest_menu():
     return kb_guest
 
 
-def kb_guest_personal_schedule():
+def kb_guest_personal_schedule(days: Sequence[date] = ()):
     kb_guest = ReplyKeyboardMarkup()
     kb_guest.add(
         KeyboardButton("Сегодня"),
@@ -26,8 +32,9 @@ def kb_guest_personal_schedule():
         KeyboardButton("Весь период"),
         KeyboardButton("Выступления"),
         KeyboardButton("Вернуться в главное меню")
-        # TODO dynamically configurred days
     )
+    if days:
+        kb_guest.add(*[KeyboardButton(day.strftime(DAY_BUTTON_FORMAT)) for day in days])
     return kb_guest
 
 
@@ -88,6 +95,48 @@ def kb_remove_speaker(id: str) -> InlineKeyboardMarkup:
     return kb_speech
 
 
+def kb_schedule_page(
+    events: Sequence, has_prev: bool, has_next: bool, selected: Optional[Set[str]] = None
+) -> InlineKeyboardMarkup:
+    """Keyboard of one general schedule page. Buttons of the events are numbered like the
+    events in the message; "Добавить" buttons are shown only when selected keys are passed"""
+    kb_page = InlineKeyboardMarkup()
+    for number, event in enumerate(events, start=1):
+        buttons = []
+        if selected is not None and event.key not in selected:
+            buttons.append(
+                InlineKeyboardButton(
+                    text=f"{number}. Добавить", callback_data=f"add:{event.key}:page"
+                )
+            )
+        buttons.append(
+            InlineKeyboardButton(
+                text=f"{number}. Подробнее", callback_data="show_desc:" + event.key
+            )
+        )
+        kb_page.row(*buttons)
+    navigation = []
+    if has_prev:
+        navigation.append(
+            InlineKeyboardButton(text="◀ Назад", callback_data="schedule:prev:" + events[0].key)
+        )
+    if has_next:
+        navigation.append(
+            InlineKeyboardButton(text="Вперёд ▶", callback_data="schedule:next:" + events[-1].key)
+        )
+    if navigation:
+        kb_page.row(*navigation)
+    return kb_page
+
+
+def remove_add_event_from_page(kb: InlineKeyboardMarkup, id: str) -> InlineKeyboardMarkup:
+    """Removes "Добавить" button of the event from the schedule page keyboard"""
+    kb_page = InlineKeyboardMarkup()
+    for row in kb.inline_keyboard:
+        kb_page.row(*[button for button in row if button.callback_data != f"add:{id}:page"])
+    return kb_page
+
+
 all_keyboards["guest_menu"] = kb_guest_menu
 all_keyboards["guest_personal_schedule"] = kb_guest_personal_schedule
 all_keyboards["moderator_menu"] = kb_moderator_menu
@@ -97,3 +146,4 @@ all_keyboards["show_desc"] = kb_show_event_description
 all_keyboards["remove_event"] = kb_remove_event
 all_keyboards["remove_speaker"] = kb_remove_speaker
 all_keyboards["back_button"] = kb_go_back_button
+all_keyboards["schedule_page"] = kb_schedule_page
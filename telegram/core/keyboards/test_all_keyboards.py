@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from core.database.records import SpeechRecord
+from core.keyboards.all_keyboards import all_keyboards, remove_add_event_from_page
+
+
+def make_event(key: str) -> SpeechRecord:
+    return SpeechRecord(
+        key=key,
+        title=f"title {key}",
+        start_time=datetime(2022, 3, 1, 10),
+        end_time=datetime(2022, 3, 1, 11),
+        venue="venue",
+        venue_description="https://telegra.ph/desc",
+    )
+
+
+def callbacks(kb):
+    return [[button.callback_data for button in row] for row in kb.inline_keyboard]
+
+
+def test_schedule_page_for_guest():
+    events = [make_event("a"), make_event("b")]
+
+    kb = all_keyboards["schedule_page"](events, has_prev=True, has_next=True, selected={"b"})
+
+    assert callbacks(kb) == [
+        ["add:a:page", "show_desc:a"],
+        ["show_desc:b"],
+        ["schedule:prev:a", "schedule:next:b"],
+    ]
+
+
+def test_schedule_page_for_moderator():
+    events = [make_event("a"), make_event("b")]
+
+    kb = all_keyboards["schedule_page"](events, has_prev=False, has_next=False)
+
+    assert callbacks(kb) == [["show_desc:a"], ["show_desc:b"]]
+
+
+def test_remove_add_event_from_page():
+    events = [make_event("a"), make_event("b")]
+    kb = all_keyboards["schedule_page"](events, has_prev=False, has_next=True, selected=set())
+
+    kb = remove_add_event_from_page(kb, "a")
+
+    assert callbacks(kb) == [
+        ["show_desc:a"],
+        ["add:b:page", "show_desc:b"],
+        ["schedule:next:b"],
+    ]
@@ -0,0 +1,15 @@
+"""Package to declare middlewares."""
+from aiogram import Dispatcher
+from loguru import logger
+from .db_session import DbSessionMiddleware
+
+
+def setup(dp: Dispatcher):
+    """Setups middlewares.
+
+    :param dp: Dispatcher instance
+    :type dp: Dispatcher
+    """
+    logger.debug("Set up of middlewares...")
+    dp.middleware.setup(DbSessionMiddleware())
+    logger.debug("Successful")
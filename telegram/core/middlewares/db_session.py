@@ -0,0 +1,59 @@
+"""Module to declare middleware giving every update its own database session."""
+import time
+from typing import Callable
+
+from aiogram.dispatcher.middlewares import LifetimeControllerMiddleware
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio.session import AsyncSession
+
+from core.database.create_table import SessionLocal
+
+# sessions holding a connection longer than this are reported as warnings
+SLOW_SESSION_THRESHOLD = 1.0  # seconds
+CONNECTED_AT_KEY = "connected_at"
+
+
+def _on_begin(session, transaction, connection):
+    """Remembers when the session got its first connection"""
+    session.info.setdefault(CONNECTED_AT_KEY, time.perf_counter())
+
+
+class DbSessionMiddleware(LifetimeControllerMiddleware):
+    """Passes one session per update to handlers as the `session` argument.
+
+    The session connects to the database only on the first query, so updates whose handlers
+    do not use it cost no connection. It is closed after the handler whatever the handler
+    did, and the time it held a connection is logged.
+    """
+
+    skip_patterns = ["error", "update"]
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = SessionLocal,
+        slow_threshold: float = SLOW_SESSION_THRESHOLD,
+    ):
+        super().__init__()
+        self.session_factory = session_factory
+        self.slow_threshold = slow_threshold
+
+    async def pre_process(self, obj, data: dict, *args):
+        session = self.session_factory()
+        event.listen(session.sync_session, "after_begin", _on_begin)
+        data["session"] = session
+
+    async def post_process(self, obj, data: dict, *args):
+        session = data.pop("session", None)
+        if session is None:
+            return
+        connected_at = session.sync_session.info.get(CONNECTED_AT_KEY)
+        await session.close()
+        if connected_at is None:
+            return
+        held = time.perf_counter() - connected_at
+        report = f"Session of {type(obj).__name__} held a connection for {held:.3f} s"
+        if held > self.slow_threshold:
+            logger.warning(report)
+        else:
+            logger.debug(report)
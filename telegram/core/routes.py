@@ -4,6 +4,9 @@ from fastapi.responses import HTMLResponse
 # from aiogram import types, Dispatcher, Bot
 from core.email_verificator import email_verificator
 from core.config import jinja_env
+from core.database.create_table import engine, replica_engine
+from core.database.pool import pool_stats
+from core.database.user_cache import user_cache
 
 
 router = APIRouter()
@@ -19,3 +22,16 @@ async def verify(token: str):
         message = "Мы успешно подтвердили ваш аккаунт"
     template = jinja_env.get_template("verify_answer.html").render(message=message)
     return HTMLResponse(content=template)
+
+
+@router.get("/metrics/cache")
+async def cache_metrics():
+    return {"user_cache": user_cache.stats()}
+
+
+@router.get("/metrics/pool")
+async def pool_metrics():
+    metrics = {"pool": pool_stats(engine)}
+    if replica_engine is not None:
+        metrics["replica_pool"] = pool_stats(replica_engine)
+    return metrics
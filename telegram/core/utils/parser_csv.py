@@ -1,21 +1,38 @@
-import httpx
-import json
+import asyncio
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
 from loguru import logger
+from multiprocessing import get_context
 from pathlib import Path
+from uuid import uuid4 as create_uuid
 
 import openpyxl
+from sqlalchemy.sql.expression import text
 from validate_email import validate_email
 from phonenumbers import carrier, parse
 from phonenumbers.phonenumberutil import number_type
 
-from core.config import config
+from core.config import config, redis, sc
 from core.database.repositories import user, speech, user_speech, role
-from core.database.create_table import SessionLocal
+from core.database.routing import use_primary
+from core.database.speech_catalog import speech_catalog
+from core.database.unit_of_work import UnitOfWork, after_commit
+from core.database.user_cache import user_cache
+from .telegraph import TelegraphError, TelegraphPublisher
 from .utils import MyValidationError
 
 ROLE_GUEST = "0"
 ROLE_SPEAKER = "1"
+ROWS_CHUNK_SIZE = 500  # rows of a sheet read and validated at once
+CHUNKS_PER_WORKER = 2  # chunks queued for every process of the validation pool
+PHONE_CACHE_SIZE = 100000
+# tables cleared by delete_all_data_in_tables, the token table is kept
+RESET_TABLES = ("user_speech", "speech", '"user"', "role")
+
+_validation_pool = None
 
 
 async def parse_xlsx(full_path: str, admin_tg_id: str):
@@ -31,192 +48,465 @@ async def parse_xlsx(full_path: str, admin_tg_id: str):
         full_path (str): full path to xlsx file
 
     Returns:
-        str: Error or None
+        list: errors, one for every bad row; empty if the workbook is imported
     """
     xlsx_file = Path(full_path)
-    xlsx_obj = openpyxl.load_workbook(xlsx_file)
+    # read-only mode streams rows from the file instead of loading every cell into memory
+    loop = asyncio.get_running_loop()
+    xlsx_obj = await loop.run_in_executor(
+        None, partial(openpyxl.load_workbook, xlsx_file, read_only=True)
+    )
+
+    # nothing is written until every row of the workbook is valid
+    try:
+        members, events, errors = await read_workbook(xlsx_obj)
+    finally:
+        xlsx_obj.close()
+    if errors:
+        return errors
+
+    # pages are created on Telegraph before the transaction, no row locks are held during
+    # the requests
+    error = await publish_descriptions(events)
+    if error:
+        return [error]
+
+    # the whole workbook is imported in one transaction, on any error nothing is changed
+    async with UnitOfWork() as uow:
+        use_primary(uow.session)  # the import is computed from the current rows
+        errors = await import_workbook(members, events, uow.session)
+        if errors:
+            await uow.rollback()
+    if not errors:
+        await speech_catalog.invalidate()
+    return errors
+
+
+async def import_workbook(members, events, session):
+    """Update database with the members and events read from the workbook.
+    The current rows are loaded once, the rows to insert, update and delete are computed in
+    memory and every set is written with one bulk statement. Repositories are expected to
+    share one unit of work, so nothing is committed here
 
-    session = SessionLocal()
+    Args:
+        members (list): members read by read_workbook
+        events (list): events read by read_workbook with published descriptions
+        session (AsyncSession): session of the unit of work
+
+    Returns:
+        list: errors, empty if the workbook is imported
+    """
     ur = user.UserRepository(session=session)
     rr = role.RoleRepository(session=session)
     sr = speech.SpeechRepository(session=session)
     usr = user_speech.UserSpeechRepository(session=session)
 
-    old_db_emails = set()
     if not await rr.get_one(value=ROLE_GUEST):
         await rr.add({"value": ROLE_GUEST})  # default guest
         await rr.add({"value": ROLE_SPEAKER})  # perfect speaker
 
-    all_users = await ur.get_all()
-    logger.debug(f"All users in db: {all_users}")
-    for cur_user in all_users:
-        old_db_emails.add(cur_user["uid"])
+    errors = await apply_members(members, ur)
+    if errors:
+        return errors
+    error = await apply_events(events, sr, usr)
+    return [error] if error else []
 
-    members_data = xlsx_obj["Участники"].values
-    _ = next(members_data)  # skip title
-    row_number = 2  # use row number for human readable user erorrs. 1st row is title
-    for row in members_data:
-        try:
-            email, fio, phone, is_admin = process_members_row(row)
-        except MyValidationError as exp:
+
+async def read_workbook(xlsx_obj):
+    """Read and validate both sheets of the workbook without writing anything.
+    Every row is checked, so all bad rows are reported at once
+
+    Args:
+        xlsx_obj (openpyxl.Workbook): opened xlsx file
+
+    Returns:
+        list, list, list: members, events and errors of all bad rows
+    """
+    members, errors = await read_members(xlsx_obj)
+    events, event_errors = await read_events(xlsx_obj, {member["uid"] for member in members})
+    return members, events, errors + event_errors
+
+
+def format_summary(errors):
+    """Summary of a report of several bad rows, the caption of the report file
+
+    Returns:
+        str: summary
+    """
+    return f"Найдено ошибок: {len(errors)}. Данные не сохранены"
+
+
+def format_report(errors):
+    """Join errors of bad rows into one report, a single error is returned as it is
+
+    Returns:
+        str: report
+    """
+    if len(errors) == 1:
+        return errors[0]
+    return format_summary(errors) + "\n" + "\n".join(errors)
+
+
+async def read_members(xlsx_obj):
+    """Read and validate all rows of the members sheet
+
+    Args:
+        xlsx_obj (openpyxl.Workbook): opened xlsx file
+
+    Returns:
+        list, list: members of good rows with the numbers of their rows and errors of bad rows
+    """
+    row_number = 1  # use row number for human readable user erorrs. 1st row is title
+    members = []
+    errors = []
+    row_numbers_by_email, row_numbers_by_phone = {}, {}
+    member_rows = iter_rows(iter_sheet(xlsx_obj, "Участники", process_members_row))
+    async for row, processed, exp in member_rows:
+        row_number += 1
+        if isinstance(exp, MyValidationError):
             logger.info(f"Ошибка от пользователя {exp}")
-            return f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. {str(exp)}"
-        except Exception as exp:
+            errors.append(f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. {str(exp)}")
+            continue
+        if exp is not None:
             logger.error(
                 f"Неожиданная ошибка от пользователя при заполнения конфига {exp}. Изначальная строчка {row}"
             )
-            return f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. {str(exp)}"
+            errors.append(f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. {str(exp)}")
+            continue
+        email, fio, phone, is_admin = processed
         if not email or not fio or not phone:
-            return f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. Одна из колонок пуста"
-        try:
-            if email in old_db_emails:
-                await ur.update(uid=email, new_snp=fio, new_phone=phone, new_is_admin=is_admin)
-                old_db_emails.remove(email)
-            else:
-                await ur.add({"uid": email, "snp": fio, "phone": phone, "is_admin": is_admin})
-        except Exception as exp:
-            logger.error(exp)
+            errors.append(f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. Одна из колонок пуста")
+            continue
+        if email in row_numbers_by_email:
+            errors.append(
+                f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. "
+                f"Email уже указан в строке {row_numbers_by_email[email]}"
+            )
+            continue
+        if phone in row_numbers_by_phone:
+            errors.append(
+                f"Произошла ошибка при обработке листа 'Участники', в строке {row_number}. "
+                f"Телефон уже указан в строке {row_numbers_by_phone[phone]}"
+            )
+            continue
+        row_numbers_by_email[email] = row_number
+        row_numbers_by_phone[phone] = row_number
+        members.append(
+            {"uid": email, "snp": fio, "phone": phone, "is_admin": is_admin, "row_number": row_number}
+        )
+    return members, errors
 
-            return f"Произошла ошибка при обработке листа 'Участники' в строке {row_number}. \
-                Проверьте уникальность вводимых данных или свяжитесь с администратором"
-        row_number += 1
 
-    for old_email in old_db_emails:
-        await ur.delete(uid=old_email)
+async def apply_members(members, ur):
+    """Delete the users that are not in the sheet, then insert new and update existing members
+    with one upsert. Deleting first lets a member take the phone or tg chat of a removed user,
+    if the upsert fails the unit of work rolls the deletion back
 
-    old_db_events = set()
-    all_events = await sr.get_all()
-    logger.debug(f"All events in db: {all_events}")
-    for cur_event in all_events:
-        old_db_events.add((cur_event["title"], cur_event["start_time"]))
+    Args:
+        members (list): members with the numbers of their rows in the sheet
+        ur (UserRepository): repository of the unit of work
 
-    event_data = xlsx_obj["Событие"].values
-    _ = next(event_data)  # skip title
-    row_number = 2
+    Returns:
+        list: errors of the rows clashing with users in the database
+    """
+    old_db_emails = {cur_user["uid"] for cur_user in await ur.get_all()}
+    logger.debug(f"{len(old_db_emails)} users in db")
+    await ur.delete_many(sorted(old_db_emails - {member["uid"] for member in members}))
 
-    for row in event_data:
-        try:
-            title, speakers, start, end, place, desc_place = process_events_row(row)
-        except MyValidationError as exp:
+    try:
+        results = await ur.upsert(members)
+    except Exception as exp:
+        logger.error(exp)
+        return [
+            "Произошла ошибка при обработке листа 'Участники'. \
+            Проверьте уникальность вводимых данных или свяжитесь с администратором"
+        ]
+    errors = []
+    for member, result in zip(members, results):
+        if result["status"] in (user.UPSERT_CONFLICT, user.UPSERT_INVALID):
+            logger.info(f"Строка {member['row_number']} не сохранена: {result['reason']}")
+            errors.append(
+                f"Произошла ошибка при обработке листа 'Участники', в строке {member['row_number']}. "
+                f"{result['reason']}"
+            )
+    return errors
+
+
+async def read_events(xlsx_obj, emails):
+    """Read and validate all rows of the events sheet
+
+    Args:
+        xlsx_obj (openpyxl.Workbook): opened xlsx file
+        emails (set): emails of the members, every speaker must be one of them
+
+    Returns:
+        list, list: events of good rows in the order of rows and errors of bad rows
+    """
+    row_number = 1
+    events = []
+    errors = []
+    event_rows = iter_rows(iter_sheet(xlsx_obj, "Событие", process_events_row))
+    async for row, processed, exp in event_rows:
+        row_number += 1
+        if isinstance(exp, MyValidationError):
             logger.info(f"Ошибка от пользователя {exp}")
-            return (
+            errors.append(
                 f"Произошла ошибка при обработке листа 'События', в строке {row_number}. {str(exp)}"
             )
-        except Exception as exp:
+            continue
+        if exp is not None:
             logger.error(
                 f"Неожиданная ошибка от пользователя при заполнения конфига {exp}. Изначальная строчка {row}"
             )
-            return (
+            errors.append(
                 f"Произошла ошибка при обработке листа 'События', в строке {row_number}. {str(exp)}"
             )
+            continue
+        title, speakers, start, end, place, desc_place = processed
         if not title or not speakers or not start or not end or not place:
-            return f"Произошла ошибка при обработке листа 'События', в строке {row_number}. Одна из колонок пуста"
-        desc_place = (
-            (desc_place[:8000] + "...") if len(desc_place) > 8000 else desc_place
-        )  # truncate long strings
-        desc_lines = desc_place.split("\n")
-        data = {
-            "access_token": config.TELEGRAPH_TOKEN,
-            "title": title,
-            "author_name": "Olamia",
-            "author_url": "https://t.me/olamiaconfbot",
-            "content": json.dumps([{"tag": "p", "children": [line]} for line in desc_lines]),
-        }
+            errors.append(f"Произошла ошибка при обработке листа 'События', в строке {row_number}. Одна из колонок пуста")
+            continue
+        missing_speakers = [speaker for speaker in speakers if speaker not in emails]
+        if missing_speakers:
+            logger.debug(f"Error while checking existence of {missing_speakers}")
+            errors.append(
+                f"Произошла ошибка при обработке листа 'События', строка {row_number}. "
+                f"Email спикеров {', '.join(missing_speakers)} не существует в листе 'Участники'"
+            )
+            continue
+        events.append(
+            {
+                "row_number": row_number,
+                "title": title,
+                "speakers": speakers,
+                "start_time": start,
+                "end_time": end,
+                "venue": place,
+                "description": desc_place,
+            }
+        )
+    return events, errors
+
+
+async def publish_descriptions(events):
+    """Publish the venue description of every event to Telegraph and save the links in
+    venue_description of the events. Pages are created concurrently through one client,
+    pages of unchanged descriptions are taken from the cache
+
+    Args:
+        events (list): events read from the sheet
+
+    Returns:
+        str: Error of the first failed row or None
+    """
+    async with TelegraphPublisher(
+        config.TELEGRAPH_TOKEN,
+        concurrency=config.TELEGRAPH_CONCURRENCY,
+        timeout=config.TELEGRAPH_TIMEOUT,
+        retries=config.TELEGRAPH_RETRIES,
+        redis=redis,
+    ) as publisher:
+        tasks = [asyncio.create_task(publish_description(publisher, event)) for event in events]
         try:
-            async with httpx.AsyncClient() as client:  # TODO Telegraph timeout
-                response = await client.post("https://api.telegra.ph/createPage", data=data)
-        except httpx.RequestError:
-            return f"Не удалось загрузить описание для строки {row_number}. Нет доступа к Telegraph"
-        if response.status_code != httpx.codes.OK:
-            logger.error(response)
-            return f"Не удалось загрузить описание для строки {row_number}. Ответ {response.status_code}"
-        resp_json = response.json()
-        if resp_json["ok"]:
-            desc_link = response.json()["result"]["url"]
+            for task in tasks:  # in the order of rows
+                error = await task
+                if error:
+                    return error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def publish_description(publisher, event):
+    """Publish the venue description of one event to Telegraph
+
+    Returns:
+        str: Error or None
+    """
+    try:
+        event["venue_description"] = await publisher.create_page(
+            event["title"], event["description"]
+        )
+    except TelegraphError as exp:
+        reason = f". {exp}" if str(exp) else ""
+        return f"Не удалось загрузить описание для строки {event['row_number']}{reason}"
+
+
+async def apply_events(events, sr, usr):
+    """Write the difference between the events of the sheet and the speeches in the database.
+    I use combination of title and start_time to uniquely identify one speech, a later row with
+    the same title and start_time replaces an earlier one
+
+    Args:
+        events (list): events read from the sheet with published descriptions
+        sr (SpeechRepository): repository of the unit of work
+        usr (UserSpeechRepository): repository of the unit of work
+
+    Returns:
+        str: Error or None
+    """
+    sheet_events = {(event["title"], event["start_time"]): event for event in events}
+    old_db_events = {
+        (cur_event["title"], cur_event["start_time"]): cur_event
+        for cur_event in await sr.get_all()
+    }
+    logger.debug(f"{len(old_db_events)} events in db")
+
+    new_speeches, changed_speeches = [], []
+    for identity, event in sheet_events.items():
+        current = {
+            "title": event["title"],
+            "start_time": event["start_time"],
+            "end_time": event["end_time"],
+            "venue": event["venue"],
+            "venue_description": event["venue_description"],
+        }
+        old_event = old_db_events.pop(identity, None)
+        if old_event is None:
+            current["key"] = str(create_uuid())
+            new_speeches.append(current)
         else:
-            logger.error(json.dumps(resp_json))
-            logger.error(data["content"])
-            return f"Не удалось загрузить описание для строки {row_number}"
-        try:
-            if (title, start) in old_db_events:
-                # I use combination of title and start_time to uniquely identify one record
-                await sr.update(
-                    title=title,
-                    start_time=start,
-                    new_end_time=end,
-                    new_venue=place,
-                    new_venue_description=desc_link,
-                )
-                old_db_events.remove((title, start))
-
-            else:
-                await sr.add(
-                    {
-                        "title": title,
-                        "start_time": start,
-                        "end_time": end,
-                        "venue": place,
-                        "venue_description": desc_link,
-                    }
-                )
-            current_key = (await sr.get_one(title=title, start_time=start))["key"]
-
-            # next we have to handle all speakers like users and events before
-            old_db_speakers = set()
-            all_old_db_speakers = await usr.get_all(key=current_key, role=ROLE_SPEAKER)
-
-            for old_speaker in all_old_db_speakers:
-                old_db_speakers.add(old_speaker["uid"])
-
-            for speaker in speakers:  # speaker is speaker email
-                check_existance = await ur.get_one(uid=speaker)
-                if not check_existance:
-                    logger.debug(f"Error while checking existence of {speaker}")
-                    return f"Произошла ошибка при обработке листа 'События', строка {row_number}. \
-                        Email одного из спикеров не существует в листе 'Участники'"
-                if speaker in old_db_speakers:
-                    old_db_speakers.remove(speaker)
-                else:
-                    await usr.add({"uid": speaker, "key": current_key, "role": ROLE_SPEAKER})
-
-            for old_speaker in old_db_speakers:
-                await usr.delete(uid=old_speaker, key=current_key, role=ROLE_SPEAKER)
-            row_number += 1
+            current["key"] = old_event["key"]
+            if current != old_event:
+                changed_speeches.append(current)
+        event["key"] = current["key"]
 
-        except Exception as exp:
-            logger.error(exp)
-            return f"Произошла ошибка при обработке листа 'События', строкa {row_number}. \
-                Проверьте корректность вводимых данных."
-    for old_event in old_db_events:
-        await sr.delete(title=old_event[0], start_time=old_event[1])
+    try:
+        # speakers of deleted speeches are deleted by the foreign key cascade
+        await sr.delete_many([old_event["key"] for old_event in old_db_events.values()])
+        await sr.update_many(changed_speeches)
+        await sr.add(new_speeches)
+
+        # next we have to handle all speakers like users and events before
+        old_db_speakers = {
+            (old_speaker["uid"], old_speaker["key"])
+            for old_speaker in await usr.get_all(role=ROLE_SPEAKER)
+        }
+        speakers = {
+            (speaker, event["key"])
+            for event in sheet_events.values()
+            for speaker in event["speakers"]
+        }
+        await usr.delete_many(
+            [{"uid": uid, "key": key} for uid, key in old_db_speakers - speakers]
+        )
+        await usr.add(
+            [
+                {"uid": uid, "key": key, "role": ROLE_SPEAKER}
+                for uid, key in speakers - old_db_speakers
+            ]
+        )
+    except ValueError as exp:
+        logger.error(exp)
+        return "Произошла ошибка при обработке листа 'События'. \
+            Проверьте корректность вводимых данных."
+
+    logger.debug(
+        f"Events: {len(new_speeches)} added, {len(changed_speeches)} updated, "
+        f"{len(old_db_events)} deleted"
+    )
+
+
+def get_validation_pool():
+    """Return the process pool validating rows of uploaded sheets, it is created on first use
+    and kept for later uploads together with the memoized phones of its processes.
+
+    Workers are spawned rather than forked: a fork would copy the running event loop, the open
+    database and Redis connections and the scheduler threads of the bot into every worker.
+    """
+    global _validation_pool
+    if _validation_pool is None:
+        _validation_pool = ProcessPoolExecutor(
+            max_workers=config.VALIDATION_WORKERS, mp_context=get_context("spawn")
+        )
+    return _validation_pool
 
-    await session.close()
 
+def shutdown_validation_pool():
+    """Stop the processes of the validation pool, used on shutdown"""
+    global _validation_pool
+    if _validation_pool is not None:
+        _validation_pool.shutdown(cancel_futures=True)
+        _validation_pool = None
 
-async def delete_all_data_in_tables():
-    session = SessionLocal()
 
-    ur = user.UserRepository(session=session)
-    sr = speech.SpeechRepository(session=session)
-    usr = user_speech.UserSpeechRepository(session=session)
-    rr = role.RoleRepository(session=session)
+def _read_chunk(rows, chunk_size):
+    """Read the next rows of a sheet, runs in a worker thread"""
+    return list(islice(rows, chunk_size))
+
 
-    users = await ur.get_all()
-    for _user in users:
-        await ur.delete(**_user)
+def _process_chunk(rows, process_row):
+    """Process rows of a sheet, runs in a process of the validation pool
 
-    speeches = await sr.get_all()
-    for _spech in speeches:
-        await sr.delete(**_spech)
+    Returns:
+        list: (row, processed row or None, exception or None) for every row
+    """
+    chunk = []
+    for row in rows:
+        try:
+            chunk.append((row, process_row(row), None))
+        except Exception as exp:
+            chunk.append((row, None, exp))
+    return chunk
 
-    many_user_spech = await usr.get_all()
-    for _user_spech in many_user_spech:
-        await usr.delete(**_user_spech)
 
-    await rr.delete(value=ROLE_GUEST)
-    await rr.delete(value=ROLE_SPEAKER)
+async def iter_sheet(xlsx_obj, sheet_name, process_row, chunk_size=ROWS_CHUNK_SIZE):
+    """Yield chunks of processed rows of the sheet in the order of rows, the title row is skipped.
+    Rows are read in a worker thread and processed in the validation pool, several chunks at
+    once, so the event loop is not blocked by validation of a large sheet
 
-    await session.close()
+    Args:
+        xlsx_obj (openpyxl.Workbook): workbook opened in read-only mode
+        sheet_name (str): name of the sheet
+        process_row (Callable): process_members_row or process_events_row
+        chunk_size (int): number of rows in one chunk
+
+    Yields:
+        list: (row, processed row or None, exception or None) for every row of the chunk
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_validation_pool()
+    rows = xlsx_obj[sheet_name].iter_rows(min_row=2, values_only=True)
+    pending = deque()  # chunks being processed, in the order of rows
+    max_pending = config.VALIDATION_WORKERS * CHUNKS_PER_WORKER
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                chunk = await loop.run_in_executor(None, _read_chunk, rows, chunk_size)
+                if not chunk:
+                    exhausted = True
+                    break
+                pending.append(loop.run_in_executor(pool, _process_chunk, chunk, process_row))
+            if not pending:
+                return
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def iter_rows(chunks):
+    """Yield rows of the chunks yielded by iter_sheet one by one"""
+    async for chunk in chunks:
+        for row in chunk:
+            yield row
+
+
+async def delete_all_data_in_tables():
+    """Remove all users, speeches, their links and roles in one transaction.
+    Tokens are kept. After the transaction is committed pending reminders of every replica
+    are removed and the caches of users and speeches are dropped, if it fails nothing is changed
+    """
+    async with UnitOfWork() as uow:
+        await uow.session.execute(text(f"TRUNCATE {', '.join(RESET_TABLES)} CASCADE"))
+        await after_commit(uow.session, _clear_after_reset)
+
+
+async def _clear_after_reset():
+    await sc.reset_everywhere()
+    await user_cache.clear()
+    await speech_catalog.invalidate()
 
 
 def process_members_row(row):
@@ -237,12 +527,25 @@ def process_members_row(row):
 
     if not validate_email(email_address=email, check_smtp=False, check_dns=False):
         raise MyValidationError("Неправильно записан email адрес")
-    if not carrier._is_mobile(number_type(parse(phone))):
+    if not is_mobile_phone(phone):
         raise MyValidationError("Неправильно записан номер телефона")
 
     return email, fio, phone, is_admin
 
 
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def is_mobile_phone(phone):
+    """Check that the phone is a mobile number. Parsing is slow and the same phones come with
+    every upload, so results are memoized in every process of the validation pool
+
+    Args:
+        phone (str): phone without surrounding spaces
+    Returns:
+        bool: whether it is a mobile number
+    """
+    return carrier._is_mobile(number_type(parse(phone)))
+
+
 def process_events_row(row):
     """Process one row in members sheet. Be careful if data schema in xlsx will change
     need to change this function too
@@ -5,9 +5,10 @@ from time import time
 import tzlocal
 import asyncio
 from datetime import timedelta, datetime
-from typing import Dict
+from typing import Dict, Optional
 
 from aiogram import Dispatcher
+from aioredis import Redis, RedisError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.base import JobLookupError
 from loguru import logger
@@ -16,6 +17,10 @@ from core.database.create_table import SessionLocal
 from core.database.repositories.user_speech import UserSpeechRepository
 from core.database.repositories.user import UserRepository
 
+# every process keeps its reminders in its own scheduler, a reset is broadcast to all of them
+RESET_CHANNEL = "reminders:reset"
+RESUBSCRIBE_DELAY = 5  # seconds
+
 
 def serialize_timedelta(delta: timedelta, locale: str = "ru_RU") -> str:
     if locale != "ru_RU":  # we only need russian, but who knows
@@ -276,6 +281,7 @@ class Scheduler:
         )"""
         self.scheduler = AsyncIOScheduler(timezone=tz)  # event_loop=asyncio.get_event_loop())
         self.dp = dp
+        self.redis: Optional[Redis] = None
         # self.scheduler.start()
         logger.debug("Scheduler was initialized successfully")
 
@@ -290,6 +296,35 @@ class Scheduler:
     def remove_remind(self, reminder: BasicReminder):
         reminder.remove_notification(self.scheduler)
 
+    def remove_all_reminds(self):
+        logger.debug("Removing all notifications")
+        self.scheduler.remove_all_jobs()
+
+    async def reset_everywhere(self):
+        """Removes all notifications of this process and of the other replicas"""
+        self.remove_all_reminds()
+        if self.redis is None:
+            return
+        try:
+            await self.redis.publish(RESET_CHANNEL, "reset")
+        except RedisError as exp:
+            logger.warning(f"Unable to publish reminders reset: {exp}")
+
+    async def listen_resets(self):
+        """Removes all notifications when another replica resets them, runs until cancelled"""
+        if self.redis is None:
+            return
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(RESET_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.remove_all_reminds()
+            except RedisError as exp:
+                logger.warning(f"Reminders lost their subscription: {exp}")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+
 
 """
 scheduler = Scheduler(None)
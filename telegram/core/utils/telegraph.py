@@ -0,0 +1,137 @@
+"""Publishing of venue descriptions to Telegraph.
+
+All pages of an import are created through one pooled client with at most ``concurrency``
+requests in flight. A request that fails because of the network, a timeout, 429 or a 5xx
+answer is retried with exponential backoff, other answers fail at once.
+
+If a Redis client is given, urls of created pages are kept in Redis by a hash of their
+content, so a page with the same title and description is created only once and re-uploads
+of an unchanged schedule make no requests to Telegraph.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+import httpx
+from aioredis import Redis, RedisError
+from loguru import logger
+
+TELEGRAPH_URL = "https://api.telegra.ph"
+REDIS_PREFIX = "telegraph_page"
+MAX_DESCRIPTION_LENGTH = 8000
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TelegraphError(Exception):
+    """The page was not created, the message is shown to the moderator"""
+
+
+class TelegraphPublisher:
+    def __init__(
+        self,
+        access_token: str,
+        concurrency: int = 8,
+        timeout: float = 10,
+        retries: int = 3,
+        backoff: float = 0.5,
+        base_url: str = TELEGRAPH_URL,
+        redis: Optional[Redis] = None,
+    ):
+        self.access_token = access_token
+        self.redis = redis
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+        )
+
+    async def __aenter__(self) -> "TelegraphPublisher":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self._client.aclose()
+
+    async def create_page(self, title: str, description: str) -> str:
+        """Creates a page with the description split into paragraphs by lines, a page created
+        earlier with the same title and description is reused.
+
+        :param title: title of the page
+        :type title: str
+
+        :param description: text of the page, truncated if it is too long
+        :type description: str
+
+        :return: url of the created page
+        :rtype: str
+
+        """
+
+        if len(description) > MAX_DESCRIPTION_LENGTH:
+            description = description[:MAX_DESCRIPTION_LENGTH] + "..."
+        data = {
+            "access_token": self.access_token,
+            "title": title,
+            "author_name": "Olamia",
+            "author_url": "https://t.me/olamiaconfbot",
+            "content": json.dumps(
+                [{"tag": "p", "children": [line]} for line in description.split("\n")]
+            ),
+        }
+
+        content_hash = hashlib.sha256(f'{title}\0{data["content"]}'.encode()).hexdigest()
+        url = await self._get_cached(content_hash)
+        if url is not None:
+            return url
+
+        async with self._semaphore:
+            response = await self._post("/createPage", data)
+
+        resp_json = response.json()
+        if not resp_json["ok"]:
+            logger.error(json.dumps(resp_json))
+            logger.error(data["content"])
+            raise TelegraphError()
+        url = resp_json["result"]["url"]
+        await self._set_cached(content_hash, url)
+        return url
+
+    async def _get_cached(self, content_hash: str) -> Optional[str]:
+        if self.redis is None:
+            return None
+        try:
+            return await self.redis.get(f"{REDIS_PREFIX}:{content_hash}")
+        except RedisError as exp:
+            logger.warning(f"Telegraph page cache is unavailable: {exp}")
+            return None
+
+    async def _set_cached(self, content_hash: str, url: str) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(f"{REDIS_PREFIX}:{content_hash}", url)
+        except RedisError as exp:
+            logger.warning(f"Telegraph page cache is unavailable: {exp}")
+
+    async def _post(self, path: str, data: dict) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = await self._client.post(path, data=data)
+            except httpx.RequestError as exp:
+                if last_attempt:
+                    raise TelegraphError("Нет доступа к Telegraph") from exp
+                logger.warning(f"Telegraph request failed: {exp!r}, retrying")
+            else:
+                if response.status_code == httpx.codes.OK:
+                    return response
+                if last_attempt or response.status_code not in RETRY_STATUSES:
+                    logger.error(response)
+                    raise TelegraphError(f"Ответ {response.status_code}")
+                logger.warning(f"Telegraph answered {response.status_code}, retrying")
+            await asyncio.sleep(self.backoff * 2 ** attempt)
@@ -0,0 +1,158 @@
+from unittest.mock import AsyncMock
+
+import openpyxl
+import pytest
+
+from core.database.repositories import user
+from . import parser_csv
+from .parser_csv import (
+    apply_members,
+    format_report,
+    format_summary,
+    is_mobile_phone,
+    read_workbook,
+)
+
+MEMBERS_TITLE = ("Почта", "ФИО", "Телефон", "Администратор")
+EVENTS_TITLE = ("Название", "Спикеры", "Начало", "Конец", "Место", "Описание места")
+
+
+def save_workbook(path, members, events):
+    workbook = openpyxl.Workbook()
+    members_sheet = workbook.active
+    members_sheet.title = "Участники"
+    events_sheet = workbook.create_sheet("Событие")
+    for row in (MEMBERS_TITLE, *members):
+        members_sheet.append(row)
+    for row in (EVENTS_TITLE, *events):
+        events_sheet.append(row)
+    workbook.save(path)
+    return openpyxl.load_workbook(path, read_only=True)
+
+
+@pytest.mark.asyncio
+async def test_every_bad_row_is_reported(tmp_path):
+    xlsx_obj = save_workbook(
+        tmp_path / "schedule.xlsx",
+        members=[
+            ("speaker@gmail.com", "Спикер", "+79031281954", False),
+            ("bad@email@gmail.com", "Плохая почта", "+79031281955", False),
+            ("guest@gmail.com", "Гость", "+79031281954", False),
+        ],
+        events=[
+            ("Доклад", "speaker@gmail.com", "2022-05-01 10:00:00", "2022-05-01 11:00:00", "Зал", "Этаж"),
+            ("Конец раньше начала", "speaker@gmail.com", "2022-05-01 10:00:00", "2022-05-01 09:00:00", "Зал", "Этаж"),
+            ("Без спикера", "nobody@gmail.com", "2022-05-01 12:00:00", "2022-05-01 13:00:00", "Зал", "Этаж"),
+        ],
+    )
+
+    members, events, errors = await read_workbook(xlsx_obj)
+    xlsx_obj.close()
+
+    assert [member["uid"] for member in members] == ["speaker@gmail.com"]
+    assert members[0]["row_number"] == 2
+    assert [event["title"] for event in events] == ["Доклад"]
+    assert events[0]["row_number"] == 2
+    assert len(errors) == 4
+    assert "'Участники', в строке 3" in errors[0]
+    assert "Телефон уже указан в строке 2" in errors[1]
+    assert "'События', в строке 3" in errors[2]
+    assert "nobody@gmail.com" in errors[3]
+
+    report = format_report(errors)
+    assert format_summary(errors) == "Найдено ошибок: 4. Данные не сохранены"
+    assert report.split("\n") == [format_summary(errors), *errors]
+    assert format_report(errors[:1]) == errors[0]
+
+
+@pytest.mark.asyncio
+async def test_rejected_members_are_reported_by_their_rows():
+    members = [
+        {"uid": "speaker@gmail.com", "snp": "Спикер", "phone": "+79031281954", "is_admin": False,
+         "row_number": 2},
+        # row 3 of the sheet was bad and is not among the members
+        {"uid": "guest@gmail.com", "snp": "Гость", "phone": "+79031281955", "is_admin": False,
+         "row_number": 4},
+    ]
+    ur = AsyncMock()
+    ur.get_all.return_value = []
+    ur.upsert.return_value = [
+        {"uid": "speaker@gmail.com", "status": user.UPSERT_INSERTED, "reason": None},
+        {"uid": "guest@gmail.com", "status": user.UPSERT_CONFLICT, "reason": "phone exists"},
+    ]
+
+    errors = await apply_members(members, ur)
+
+    assert errors == ["Произошла ошибка при обработке листа 'Участники', в строке 4. phone exists"]
+
+
+@pytest.mark.asyncio
+async def test_removed_users_free_their_phones_before_upsert():
+    # the phone of a user missing from the sheet moves to a new member
+    members = [
+        {"uid": "new@gmail.com", "snp": "Новый", "phone": "+79031281954", "is_admin": False,
+         "row_number": 2},
+    ]
+    ur = AsyncMock()
+    ur.get_all.return_value = [{"uid": "old@gmail.com"}, {"uid": "new@gmail.com"}]
+    ur.upsert.return_value = [
+        {"uid": "new@gmail.com", "status": user.UPSERT_INSERTED, "reason": None},
+    ]
+
+    assert await apply_members(members, ur) == []
+
+    assert [call[0] for call in ur.mock_calls[1:]] == ["delete_many", "upsert"]
+    ur.delete_many.assert_called_once_with(["old@gmail.com"])
+
+
+@pytest.mark.asyncio
+async def test_descriptions_are_published_before_the_transaction(tmp_path, monkeypatch):
+    steps = []
+
+    class RecordingUnitOfWork:
+        async def __aenter__(self):
+            steps.append("begin")
+            return AsyncMock()
+
+        async def __aexit__(self, *exc_info):
+            steps.append("end")
+
+    async def publish_descriptions(events):
+        steps.append("publish")
+
+    async def import_workbook(members, events, session):
+        steps.append("import")
+        return []
+
+    monkeypatch.setattr(parser_csv, "UnitOfWork", RecordingUnitOfWork)
+    monkeypatch.setattr(parser_csv, "publish_descriptions", publish_descriptions)
+    monkeypatch.setattr(parser_csv, "import_workbook", import_workbook)
+    monkeypatch.setattr(parser_csv, "use_primary", lambda session: None)
+    monkeypatch.setattr(parser_csv.speech_catalog, "invalidate", AsyncMock())
+    save_workbook(
+        tmp_path / "schedule.xlsx",
+        members=[("speaker@gmail.com", "Спикер", "+79031281954", False)],
+        events=[
+            ("Доклад", "speaker@gmail.com", "2022-05-01 10:00:00", "2022-05-01 11:00:00", "Зал", "Этаж"),
+        ],
+    ).close()
+
+    assert await parser_csv.parse_xlsx(str(tmp_path / "schedule.xlsx"), 1) == []
+    assert steps == ["publish", "begin", "import", "end"]
+
+
+def test_phones_are_memoized():
+    is_mobile_phone.cache_clear()
+    assert is_mobile_phone("+79031281954")
+    assert is_mobile_phone("+79031281954")
+    assert is_mobile_phone.cache_info().hits == 1
+
+
+def test_validation_pool_spawns_workers():
+    pool = parser_csv.get_validation_pool()
+    try:
+        assert pool._mp_context.get_start_method() == "spawn"
+        assert pool.submit(is_mobile_phone, "+79031281954").result(timeout=60)
+    finally:
+        parser_csv.shutdown_validation_pool()
+    assert parser_csv._validation_pool is None
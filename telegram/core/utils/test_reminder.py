@@ -0,0 +1,22 @@
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from aioredis import RedisError
+
+from .reminder import RESET_CHANNEL, Scheduler
+
+
+@pytest.mark.asyncio
+async def test_reset_is_broadcast():
+    sc = Scheduler(None)
+    sc.scheduler = Mock()
+    await sc.reset_everywhere()  # without Redis only this process is reset
+    sc.scheduler.remove_all_jobs.assert_called_once_with()
+
+    sc.redis = AsyncMock()
+    await sc.reset_everywhere()
+    sc.redis.publish.assert_called_once_with(RESET_CHANNEL, "reset")
+
+    sc.redis.publish.side_effect = RedisError("Connection refused")
+    await sc.reset_everywhere()  # the local reset is done anyway
+    assert sc.scheduler.remove_all_jobs.call_count == 3
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from .telegraph import TelegraphError, TelegraphPublisher
+
+
+class DictRedis:
+    """In-memory stand-in for the few Redis commands of the page cache"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value):
+        self.values[key] = value
+
+
+class StandInTelegraph:
+    """Local HTTP server answering createPage like telegra.ph"""
+
+    def __init__(self):
+        self.requests = []
+        self.failures = []  # statuses answered before the pages are created
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create_page(self, request):
+        data = await request.post()
+        self.requests.append(dict(data))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.05)
+            if self.failures:
+                return web.Response(status=self.failures.pop(0))
+            if data["access_token"] != "token":
+                return web.json_response({"ok": False, "error": "ACCESS_TOKEN_INVALID"})
+            page = f"https://telegra.ph/{data['title']}"
+            return web.json_response({"ok": True, "result": {"url": page}})
+        finally:
+            self.in_flight -= 1
+
+
+@pytest_asyncio.fixture
+async def telegraph():
+    server = StandInTelegraph()
+    app = web.Application()
+    app.router.add_post("/createPage", server.create_page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    server.url = f"http://127.0.0.1:{port}"
+
+    yield server
+
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_pages_are_created_concurrently(telegraph):
+    async with TelegraphPublisher("token", concurrency=3, base_url=telegraph.url) as publisher:
+        urls = await asyncio.gather(
+            *(publisher.create_page(f"page{number}", "a\nb") for number in range(10))
+        )
+
+    assert urls == [f"https://telegra.ph/page{number}" for number in range(10)]
+    assert telegraph.max_in_flight == 3
+    assert telegraph.requests[0]["content"] == (
+        '[{"tag": "p", "children": ["a"]}, {"tag": "p", "children": ["b"]}]'
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_requests_are_retried(telegraph):
+    telegraph.failures = [503, 429]
+    async with TelegraphPublisher(
+        "token", retries=2, backoff=0.01, base_url=telegraph.url
+    ) as publisher:
+        assert await publisher.create_page("page", "text") == "https://telegra.ph/page"
+    assert len(telegraph.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_errors(telegraph):
+    telegraph.failures = [503, 503]
+    async with TelegraphPublisher(
+        "token", retries=1, backoff=0.01, base_url=telegraph.url
+    ) as publisher:
+        with pytest.raises(TelegraphError, match="Ответ 503"):
+            await publisher.create_page("page", "text")
+
+    telegraph.failures = [400]
+    async with TelegraphPublisher("token", retries=3, base_url=telegraph.url) as publisher:
+        with pytest.raises(TelegraphError, match="Ответ 400"):
+            await publisher.create_page("page", "text")  # not retried
+
+    async with TelegraphPublisher("bad token", base_url=telegraph.url) as publisher:
+        with pytest.raises(TelegraphError):
+            await publisher.create_page("page", "text")
+
+    async with TelegraphPublisher(
+        "token", retries=1, backoff=0.01, base_url="http://127.0.0.1:1"
+    ) as publisher:
+        with pytest.raises(TelegraphError, match="Нет доступа к Telegraph"):
+            await publisher.create_page("page", "text")
+
+
+@pytest.mark.asyncio
+async def test_unchanged_pages_are_reused(telegraph):
+    redis = DictRedis()
+    async with TelegraphPublisher("token", base_url=telegraph.url, redis=redis) as publisher:
+        url = await publisher.create_page("page", "text")
+        assert await publisher.create_page("page", "text") == url
+    assert len(telegraph.requests) == 1
+
+    # the cache outlives the publisher, only changed pages are created again
+    async with TelegraphPublisher("token", base_url=telegraph.url, redis=redis) as publisher:
+        assert await publisher.create_page("page", "text") == url
+        await publisher.create_page("page", "new text")
+        await publisher.create_page("new page", "text")
+    assert len(telegraph.requests) == 3
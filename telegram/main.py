@@ -1,13 +1,16 @@
 """Module to declare fastApi web server to get webhooks from telegram."""
+import asyncio
+
 import uvicorn
 
 from aiogram import types, Dispatcher, Bot
 from fastapi import FastAPI
 
 from core.config import config
-from core.config import bot, dp, sc
+from core.config import bot, dp, sc, redis
 from core import handlers
 from core import filters
+from core import middlewares
 
 
 app = FastAPI()
@@ -19,10 +22,18 @@ WEBHOK_PATH = "/bot"
 async def on_startup():
     """Initializes filters, middlewares, hadlers and webhook."""
     from core.database.create_table import update_tables
+    from core.database.user_cache import user_cache
+    from core.database.speech_catalog import speech_catalog
 
     await update_tables(dev=False)
+    user_cache.redis = redis
+    speech_catalog.redis = redis
+    sc.redis = redis
+    app.state.speech_catalog_listener = asyncio.create_task(speech_catalog.listen())
+    app.state.reminders_listener = asyncio.create_task(sc.listen_resets())
     await bot.set_webhook(url=config.WEBHOOK_URL + WEBHOK_PATH)
     filters.setup(dp)
+    middlewares.setup(dp)
     handlers.setup(dp)
     sc.scheduler.start()
     from core.routes import router
@@ -46,6 +57,11 @@ async def bot_webhook(update: dict):
 @app.on_event("shutdown")
 async def on_shutdown():
     """Closes all connections."""
+    from core.utils.parser_csv import shutdown_validation_pool
+
+    app.state.speech_catalog_listener.cancel()
+    app.state.reminders_listener.cancel()
+    shutdown_validation_pool()
     await dp.bot.close()
     await dp.storage.close()
     await dp.storage.wait_closed()